@@ -1,10 +1,17 @@
 from flask import Blueprint, request, jsonify, Response, stream_with_context
+from werkzeug.datastructures import ContentRange
 from werkzeug.utils import secure_filename
 from pathlib import Path
-import shutil
 import json
+import os
 from config import Config
 from services.claude_client import ClaudeClient
+from services import http_transport, metrics, tracing
+from services.scheduler import PRIORITIES, TokenBucketScheduler
+from services.file_tail import tail_file
+from services.listing import DirectoryListing, ListingQuery
+from services.sessions import SessionBusyError
+from services.trash import TRASH_DIR_NAME
 
 api_bp = Blueprint('api', __name__)
 
@@ -16,19 +23,40 @@ def init_claude_client():
     if claude_client is None:
         claude_client = ClaudeClient(
             user_files_dir=Config.USER_FILES_DIR,
-            responses_dir=Config.RESPONSES_DIR
+            responses_dir=Config.RESPONSES_DIR,
+            traces_dir=Config.TRACES_DIR
         )
     return claude_client
 
 
 @api_bp.route('/health', methods=['GET'])
 def health_check():
+    """
+    Состояние API: переиспользование соединений с Claude API (счетчики воркера,
+    ответившего на запрос) и очередь планировщика (общая для всех воркеров)
+    """
+    scheduler = claude_client.scheduler if claude_client is not None else TokenBucketScheduler(
+        Config.SCHEDULER_DIR,
+        requests_per_minute=Config.CLAUDE_RPM_LIMIT,
+        input_tokens_per_minute=Config.CLAUDE_ITPM_LIMIT,
+        output_tokens_per_minute=Config.CLAUDE_OTPM_LIMIT
+    )
     return jsonify({
         "status": "ok",
-        "message": "!API!"
+        "message": "!API!",
+        "worker_pid": os.getpid(),
+        "http_connections": http_transport.connection_stats(),
+        "scheduler": scheduler.snapshot()
     })
 
 
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Метрики в формате Prometheus (агрегированы по всем воркерам gunicorn)"""
+    body, content_type = metrics.render()
+    return Response(body, mimetype=content_type)
+
+
 @api_bp.route('/upload', methods=['POST'])
 def upload_files():
     """
@@ -94,6 +122,8 @@ def upload_files():
                 "extension": file_ext
             })
 
+        if uploaded_files:
+            init_claude_client().generations.bump("user_files")
         return jsonify({
             "message": f"Загружено файлов: {len(uploaded_files)}",
             "files": uploaded_files
@@ -105,16 +135,46 @@ def upload_files():
         return jsonify({"error": str(e)}), 500
 
 
+def _listing_response(listing: DirectoryListing, key: str, default_sort: str, default_order: str):
+    """
+    Страница листинга с ETag. Если поколение директории и параметры не менялись,
+    клиент с If-None-Match получает 304 без обхода директории
+    """
+    query = ListingQuery.from_args(
+        request.args,
+        default_sort=default_sort,
+        default_order=default_order,
+        default_limit=Config.LISTING_DEFAULT_LIMIT,
+        max_limit=Config.LISTING_MAX_LIMIT
+    )
+    generation = listing.generation()
+    etag = listing.etag(query, generation)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        page = listing.page(query, generation)
+        response = jsonify({
+            key: page["items"],
+            "total": page["total"],
+            "next_cursor": page["next_cursor"]
+        })
+    response.set_etag(etag)
+    # Браузер кеширует ответ, но каждый раз переспрашивает сервер с If-None-Match
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 @api_bp.route('/files', methods=['GET'])
 def list_files():
-    """Получение списка загруженных файлов"""
+    """
+    Получение списка загруженных файлов. Параметры: prefix, extension, modified_after,
+    modified_before, sort (path|name|size|modified), order, limit, cursor
+    """
     try:
         client = init_claude_client()
-        files = client.get_available_files()
-        return jsonify({
-            "files": files,
-            "total": len(files)
-        })
+        return _listing_response(client.file_listing, "files", "path", "asc")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -126,16 +186,15 @@ def delete_file(filepath):
         file_path = Config.USER_FILES_DIR / filepath
 
         file_path.resolve().relative_to(Config.USER_FILES_DIR.resolve())
+        if TRASH_DIR_NAME in Path(filepath).parts:
+            return jsonify({"error": "Недопустимый путь"}), 400
 
-        if not file_path.exists():
+        if not file_path.exists() or file_path.resolve() == Config.USER_FILES_DIR.resolve():
             return jsonify({"error": "Файл не найден"}), 404
 
-        if file_path.is_file():
-            file_path.unlink()
-        elif file_path.is_dir():
-            shutil.rmtree(file_path)
-
-        return jsonify({"message": "Файл успешно удален"})
+        # Файл сразу переносится в корзину, содержимое и индекс очищаются в фоне
+        job = init_claude_client().delete_user_files([file_path])
+        return jsonify({"message": "Файл успешно удален", "job_id": job["job_id"], "status": job["status"]}), 202
     except ValueError:
         return jsonify({"error": "Недопустимый путь"}), 400
     except Exception as e:
@@ -146,13 +205,12 @@ def delete_file(filepath):
 def clear_all_files():
     """Удаление всех загруженных файлов"""
     try:
-        for item in Config.USER_FILES_DIR.iterdir():
-            if item.is_file():
-                item.unlink()
-            elif item.is_dir():
-                shutil.rmtree(item)
+        targets = [item for item in Config.USER_FILES_DIR.iterdir() if item.name != TRASH_DIR_NAME]
+        if not targets:
+            return jsonify({"message": "Все файлы удалены", "job_id": None, "status": "done"})
 
-        return jsonify({"message": "Все файлы удалены"})
+        job = init_claude_client().delete_user_files(targets)
+        return jsonify({"message": "Все файлы удалены", "job_id": job["job_id"], "status": job["status"]}), 202
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -161,7 +219,8 @@ def clear_all_files():
 def process_query():
     """
     Обработка запроса пользователя (синхронная версия)
-    Body: {"query": "string", "max_tokens": int (optional)}
+    Body: {"query": "string", "max_tokens": int (optional), "priority": "interactive" | "batch" (optional),
+           "session_id": "string" (optional, продолжение диалога)}
     """
     try:
         data = request.get_json()
@@ -170,19 +229,39 @@ def process_query():
             return jsonify({"error": "Запрос не указан"}), 400
 
         query = data['query']
-        max_tokens = data.get('max_tokens', 8000)
+        max_tokens = data.get('max_tokens')
+        priority = data.get('priority', 'interactive')
+        session_id = data.get('session_id')
+
+        if priority not in PRIORITIES:
+            return jsonify({"error": f"Неизвестный приоритет: {priority}"}), 400
 
         client = init_claude_client()
-        result = client.process_query_sync(query, max_tokens)
+        if session_id is not None and not client.sessions.exists(session_id):
+            return jsonify({"error": "Сессия не найдена"}), 404
+
+        result = client.process_query_sync(query, max_tokens, priority, session_id)
 
         if result.get('success'):
             return jsonify({
+                "query_id": result['query_id'],
+                "session_id": result['session_id'],
                 "response": result['text'],
                 "usage": result['usage'],
-                "created_files": result.get('created_files', [])
+                "created_files": result.get('created_files', []),
+                "routing": result.get('routing'),
+                "retrieval": result.get('retrieval')
             })
         else:
-            return jsonify({"error": result.get('error', 'Unknown error')}), 500
+            status = {"session_busy": 409, "session_not_found": 404}.get(result.get('code'), 500)
+            return jsonify({
+                "error": result.get('error', 'Unknown error'),
+                "query_id": result.get('query_id'),
+                "session_id": result.get('session_id')
+            }), status
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -192,7 +271,8 @@ def process_query():
 def process_query_stream():
     """
     Обработка запроса пользователя (streaming версия)
-    Body: {"query": "string", "max_tokens": int (optional)}
+    Body: {"query": "string", "max_tokens": int (optional), "priority": "interactive" | "batch" (optional),
+           "session_id": "string" (optional, продолжение диалога)}
     """
     try:
         data = request.get_json()
@@ -201,12 +281,19 @@ def process_query_stream():
             return jsonify({"error": "Запрос не указан"}), 400
 
         query = data['query']
-        max_tokens = data.get('max_tokens', 8000)
+        max_tokens = data.get('max_tokens')
+        priority = data.get('priority', 'interactive')
+        session_id = data.get('session_id')
+
+        if priority not in PRIORITIES:
+            return jsonify({"error": f"Неизвестный приоритет: {priority}"}), 400
 
         client = init_claude_client()
+        if session_id is not None and not client.sessions.exists(session_id):
+            return jsonify({"error": "Сессия не найдена"}), 404
 
         def generate():
-            for event in client.process_query_stream(query, max_tokens):
+            for event in client.process_query_stream(query, max_tokens, priority, session_id):
                 yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
 
         return Response(
@@ -219,33 +306,117 @@ def process_query_stream():
             }
         )
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@api_bp.route('/sessions', methods=['GET'])
+def list_sessions():
+    """Список сессий диалога"""
+    try:
+        client = init_claude_client()
+        sessions = client.sessions.list_sessions()
+        return jsonify({
+            "sessions": sessions,
+            "count": len(sessions)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
-@api_bp.route('/responses', methods=['GET'])
-def list_responses():
-    """Получение списка сгенерированных ответов"""
+@api_bp.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Запросы сессии (без полной истории сообщений)"""
     try:
         client = init_claude_client()
-        responses = client.get_response_files()
+        if not client.sessions.exists(session_id):
+            return jsonify({"error": "Сессия не найдена"}), 404
+        session = client.sessions.load(session_id)
         return jsonify({
-            "responses": responses,
-            "total": len(responses)
+            "session_id": session.session_id,
+            "created_at": session.created_at,
+            "compactions": session.compactions,
+            "messages": len(session.messages),
+            "queries": session.queries
         })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@api_bp.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Удаление сессии"""
+    try:
+        client = init_claude_client()
+        if not client.sessions.delete(session_id):
+            return jsonify({"error": "Сессия не найдена"}), 404
+        return jsonify({"message": "Сессия удалена"})
+    except SessionBusyError:
+        return jsonify({"error": "Сессия занята другим запросом"}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Состояние задания фонового удаления: queued, running, done или failed"""
+    try:
+        job = init_claude_client().deletions.get(job_id)
+        if job is None:
+            return jsonify({"error": "Задание не найдено"}), 404
+        return jsonify(job)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/queries/<query_id>/trace', methods=['GET'])
+def get_query_trace(query_id):
+    """Трасса выполнения запроса: ходы API, команды MemoryTool, чтение файлов"""
+    try:
+        trace = tracing.load_trace(Config.TRACES_DIR, query_id)
+        if trace is None:
+            return jsonify({"error": "Трасса не найдена"}), 404
+        return jsonify(trace)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/responses', methods=['GET'])
+def list_responses():
+    """Получение списка сгенерированных ответов (параметры как у /files, по умолчанию новые первыми)"""
+    try:
+        client = init_claude_client()
+        return _listing_response(client.response_listing, "responses", "modified", "desc")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def _resolve_response(filepath: str) -> Path:
+    """Путь файла ответа; ValueError - путь за пределами responses"""
+    file_path = Config.RESPONSES_DIR / filepath
+    file_path.resolve().relative_to(Config.RESPONSES_DIR.resolve())
+    if TRASH_DIR_NAME in Path(filepath).parts:
+        raise ValueError(f"Недопустимый путь: {filepath}")
+    return file_path
+
+
 @api_bp.route('/responses/<path:filepath>', methods=['GET'])
 def get_response(filepath):
     """Получение содержимого сгенерированного ответа"""
     try:
-        file_path = Config.RESPONSES_DIR / filepath
-
-        file_path.resolve().relative_to(Config.RESPONSES_DIR.resolve())
+        file_path = _resolve_response(filepath)
 
         if not file_path.exists() or not file_path.is_file():
             return jsonify({"error": "Файл не найден"}), 404
@@ -261,19 +432,147 @@ def get_response(filepath):
         return jsonify({"error": str(e)}), 500
 
 
+def _file_body(file_path: Path, start: int, length: int):
+    """
+    Тело ответа из диапазона файла. Под gunicorn - wsgi.file_wrapper: воркер
+    отдает его через sendfile с текущей позиции файла ровно Content-Length байт,
+    без копирования в Python. Иначе (dev-сервер) - чтение блоками до length байт
+    """
+    f = open(file_path, "rb")
+    f.seek(start)
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None and "gunicorn" in request.environ.get("SERVER_SOFTWARE", ""):
+        return file_wrapper(f)
+
+    def read_range():
+        with f:
+            remaining = length
+            while remaining > 0:
+                data = f.read(min(remaining, 64 * 1024))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+    return read_range()
+
+
+@api_bp.route('/responses/<path:filepath>/raw', methods=['GET'])
+def download_response(filepath):
+    """
+    Содержимое ответа как есть: Range (один диапазон байт), ETag и Last-Modified
+    для условных запросов. Просмотрщик перезапрашивает только дописанный хвост
+    (Range: bytes=<размер>-) или получает 304, если файл не менялся
+    """
+    try:
+        file_path = _resolve_response(filepath)
+        if not file_path.is_file():
+            return jsonify({"error": "Файл не найден"}), 404
+
+        stat = file_path.stat()
+        size = stat.st_size
+        etag = f"{stat.st_ino:x}-{size:x}-{stat.st_mtime_ns:x}"
+
+        response = Response(mimetype="text/plain", direct_passthrough=True)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response.accept_ranges = "bytes"
+        response.headers["Cache-Control"] = "no-cache"
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            since = request.if_modified_since
+            not_modified = since is not None and int(stat.st_mtime) <= since.timestamp()
+        if not_modified:
+            response.status_code = 304
+            return response
+
+        start, stop = 0, size
+        # If-Range: диапазон только для той же версии файла, иначе файл целиком
+        if request.range and (request.if_range.etag is None or request.if_range.etag == etag) \
+                and (request.if_range.date is None or int(stat.st_mtime) <= request.if_range.date.timestamp()):
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                response.status_code = 416
+                response.headers["Content-Range"] = f"bytes */{size}"
+                return response
+            start, stop = byte_range
+            response.status_code = 206
+            response.content_range = ContentRange("bytes", start, stop, size)
+
+        response.response = _file_body(file_path, start, stop - start)
+        response.content_length = stop - start
+        return response
+    except ValueError:
+        return jsonify({"error": "Недопустимый путь"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api_bp.route('/responses/<path:filepath>/tail', methods=['GET'])
+def tail_response(filepath):
+    """
+    SSE с текстом, дописываемым в файл ответа, пока запрос еще пишет его.
+    Query: offset - байт, с которого продолжить (next_offset последнего события)
+    """
+    try:
+        file_path = _resolve_response(filepath)
+        offset = int(request.args.get("offset", 0))
+        if offset < 0:
+            return jsonify({"error": "offset должен быть неотрицательным"}), 400
+        if not file_path.is_file():
+            return jsonify({"error": "Файл не найден"}), 404
+
+        client = init_claude_client()
+        slot = client.tail_slots.acquire()
+        if slot is None:
+            response = jsonify({"error": "Слишком много открытых просмотров, повторите позже"})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+
+        def generate():
+            try:
+                for event in tail_file(
+                    file_path,
+                    offset=offset,
+                    poll_interval=Config.RESPONSE_TAIL_POLL_INTERVAL,
+                    idle_timeout=Config.RESPONSE_TAIL_IDLE_SECONDS,
+                    max_seconds=Config.RESPONSE_TAIL_MAX_SECONDS,
+                    is_writing=client.active_queries.any_active
+                ):
+                    yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            finally:
+                client.tail_slots.release(slot)
+
+        response = Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+                'Connection': 'keep-alive'
+            }
+        )
+        # Стрим не начался (клиент ушел до первого байта) - слот освобождается при закрытии ответа
+        response.call_on_close(lambda: client.tail_slots.release(slot))
+        return response
+    except ValueError:
+        return jsonify({"error": "Недопустимый путь или offset"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @api_bp.route('/responses/<path:filepath>', methods=['DELETE'])
 def delete_response(filepath):
     """Удаление сгенерированного ответа"""
     try:
-        file_path = Config.RESPONSES_DIR / filepath
-
-        file_path.resolve().relative_to(Config.RESPONSES_DIR.resolve())
+        file_path = _resolve_response(filepath)
 
-        if not file_path.exists():
+        if not file_path.exists() or file_path.resolve() == Config.RESPONSES_DIR.resolve():
             return jsonify({"error": "Файл не найден"}), 404
 
-        file_path.unlink()
-        return jsonify({"message": "Ответ удален"})
+        job = init_claude_client().delete_responses([file_path])
+        return jsonify({"message": "Ответ удален", "job_id": job["job_id"], "status": job["status"]}), 202
     except ValueError:
         return jsonify({"error": "Недопустимый путь"}), 400
     except Exception as e:
@@ -2,6 +2,8 @@ from flask import Flask
 from flask_cors import CORS
 from config import Config
 from api.routes import api_bp
+from services import metrics
+from services.file_processor import FileProcessor
 import logging
 
 logging.basicConfig(
@@ -32,6 +34,12 @@ def create_app():
     logger.info(f"USER_FILES_DIR: {Config.USER_FILES_DIR}")
     logger.info(f"RESPONSES_DIR: {Config.RESPONSES_DIR}")
 
+    warmup_suffixes = Config.warmup_suffixes()
+    if warmup_suffixes is None or warmup_suffixes:
+        loaded = FileProcessor.warm_up(warmup_suffixes)
+        logger.info(f"Библиотеки форматов загружены заранее: {', '.join(loaded)}")
+
+    metrics.init_app(app)
     app.register_blueprint(api_bp, url_prefix='/api')
 
     @app.route('/')
@@ -45,7 +53,9 @@ def create_app():
                 "files": "/api/files",
                 "query": "/api/query",
                 "query_stream": "/api/query/stream",
-                "responses": "/api/responses"
+                "sessions": "/api/sessions",
+                "responses": "/api/responses",
+                "metrics": "/api/metrics"
             }
         }
 
@@ -0,0 +1,88 @@
+"""
+Пакетная индексация user_files: оглавление с диапазонами строк, краткое
+содержание и смысловые фрагменты каждого файла для MemoryTool.view.
+
+    cd backend && python build_index.py            # краткое содержание - первые строки файла
+    cd backend && python build_index.py --llm      # краткое содержание от модели (INDEX_SUMMARY_MODEL)
+    cd backend && python build_index.py --train-dict  # обучить словарь zstd на корпусе и пересжать текст
+
+Файл обрабатывается один раз на содержимое (sha256): повторный запуск
+индексирует только новые и измененные файлы. Запускать после загрузки файлов,
+например по cron или вручную. Словарь стоит переобучать, когда корпус заметно
+изменился: новые файлы сжимаются текущим словарем.
+"""
+import argparse
+import logging
+import sys
+from anthropic import Anthropic
+from config import Config
+from services import http_transport
+from services.file_index import FileIndex, LLMSummarizer, TokenCounter
+from services.frame_store import FrameStore
+from services.scheduler import TokenBucketScheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Индексация файлов пользователя")
+    parser.add_argument("--llm", action="store_true", help="Краткое содержание от модели")
+    parser.add_argument("--force", action="store_true", help="Пересобрать все артефакты")
+    parser.add_argument("--train-dict", action="store_true", help="Обучить словарь zstd на сохраненном тексте")
+    parser.add_argument("--count-tokens", action="store_true",
+                        help="Точное число токенов файлов через count_tokens API (для маршрутизации; "
+                             "уже проиндексированные файлы - вместе с --force)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    Config.init_directories()
+
+    summarizer = None
+    token_counter = None
+    if args.llm or args.count_tokens:
+        client = Anthropic(
+            api_key=Config.CLAUDE_API_KEY,
+            base_url=Config.CLAUDE_BASE_URL,
+            http_client=http_transport.get_http_client()
+        )
+    if args.llm:
+        scheduler = TokenBucketScheduler(
+            Config.SCHEDULER_DIR,
+            requests_per_minute=Config.CLAUDE_RPM_LIMIT,
+            input_tokens_per_minute=Config.CLAUDE_ITPM_LIMIT,
+            output_tokens_per_minute=Config.CLAUDE_OTPM_LIMIT
+        )
+        summarizer = LLMSummarizer(client, Config.INDEX_SUMMARY_MODEL, scheduler)
+    if args.count_tokens:
+        token_counter = TokenCounter(client, Config.TOKEN_COUNT_MODEL)
+
+    index = FileIndex(
+        Config.INDEX_DIR,
+        Config.USER_FILES_DIR,
+        chunk_target_chars=Config.CHUNK_TARGET_CHARS,
+        chunk_max_chars=Config.CHUNK_MAX_CHARS,
+        store=FrameStore(
+            Config.STORE_DIR,
+            frame_bytes=Config.STORE_FRAME_KB * 1024,
+            level=Config.STORE_ZSTD_LEVEL,
+            dict_size=Config.STORE_DICT_KB * 1024
+        ) if Config.STORE_EXTRACTED_TEXT else None
+    )
+    counts = index.build(summarizer=summarizer, force=args.force, max_sections=Config.INDEX_MAX_SECTIONS,
+                         token_counter=token_counter)
+    print(
+        f"Проиндексировано: {counts['built']}, без изменений: {counts['cached']}, "
+        f"ошибок: {counts['failed']}, удалено устаревших: {counts['removed']}"
+    )
+
+    if index.store is not None:
+        if args.train_dict and not index.store.train_dictionary():
+            print("Словарь не обучен: слишком мало текста")
+        stats = index.store.stats()
+        print(
+            f"Текст: {stats['artifacts']} файлов, {stats['raw_bytes']} -> {stats['stored_bytes']} байт "
+            f"(сжатие {stats['ratio']}x, словарь {stats['dict_id'] or 'нет'})"
+        )
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,26 +7,136 @@ load_dotenv()
 class Config:
     # Claude API
     CLAUDE_API_KEY = os.getenv("CLAUDE_API")
+    CLAUDE_BASE_URL = os.getenv("CLAUDE_BASE_URL")  # None - api.anthropic.com; для бенчмарков - локальный mock
     CLAUDE_MODEL = "claude-sonnet-4-6"  #"claude-sonnet-4-5-20250929"
     CLAUDE_BETAS = ["context-1m-2025-08-07", "context-management-2025-06-27"]
+    CLAUDE_MAX_TOKENS = int(os.getenv("CLAUDE_MAX_TOKENS", 8000))
+
+    # Правила выбора модели, max_tokens и бет по размеру корпуса и запроса (JSON,
+    # пример - routing_rules.example.json). Не задан - значения выше для всех запросов
+    ROUTING_RULES_PATH = os.getenv("ROUTING_RULES_PATH")
+    # Модель для count_tokens при индексации (build_index.py --count-tokens)
+    TOKEN_COUNT_MODEL = os.getenv("TOKEN_COUNT_MODEL", CLAUDE_MODEL)
+
+    # Лимиты организации Anthropic, общие для всех воркеров (0 - без ограничения)
+    CLAUDE_RPM_LIMIT = int(os.getenv("CLAUDE_RPM_LIMIT", 0))
+    CLAUDE_ITPM_LIMIT = int(os.getenv("CLAUDE_ITPM_LIMIT", 0))
+    CLAUDE_OTPM_LIMIT = int(os.getenv("CLAUDE_OTPM_LIMIT", 0))
+    SCHEDULER_DIR = Path(os.getenv("CLAUDE_SCHEDULER_DIR", "/tmp/claude-memory-scheduler"))
+
+    # HTTP соединения с API: один пул на воркер. Ходы одного запроса разделены
+    # выполнением инструментов, поэтому keep-alive должен переживать паузу между ними
+    # (у httpx по умолчанию 5 секунд - почти каждый ход открывал новое TLS соединение)
+    CLAUDE_HTTP_MAX_CONNECTIONS = int(os.getenv("CLAUDE_HTTP_MAX_CONNECTIONS", 20))
+    CLAUDE_HTTP_MAX_KEEPALIVE = int(os.getenv("CLAUDE_HTTP_MAX_KEEPALIVE", 10))
+    CLAUDE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("CLAUDE_HTTP_KEEPALIVE_EXPIRY", 300))
+    CLAUDE_HTTP_CONNECT_TIMEOUT = float(os.getenv("CLAUDE_HTTP_CONNECT_TIMEOUT", 10))
+    CLAUDE_HTTP2 = os.getenv("CLAUDE_HTTP2", "False").lower() == "true"  # требует пакет h2
+    # gzip тела запроса: история с результатами инструментов занимает мегабайты.
+    # Выключено по умолчанию - сжатие запросов не описано в документации API
+    CLAUDE_HTTP_COMPRESS = os.getenv("CLAUDE_HTTP_COMPRESS", "False").lower() == "true"
+    CLAUDE_HTTP_COMPRESS_MIN_BYTES = int(os.getenv("CLAUDE_HTTP_COMPRESS_MIN_BYTES", 64 * 1024))
+
+    # Таймаут хода: база + max_tokens / минимальная скорость генерации, не больше максимума
+    CLAUDE_TURN_TIMEOUT_BASE = float(os.getenv("CLAUDE_TURN_TIMEOUT_BASE", 60))
+    CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND = float(os.getenv("CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND", 20))
+    CLAUDE_TURN_TIMEOUT_MAX = float(os.getenv("CLAUDE_TURN_TIMEOUT_MAX", 600))
+    # Ход, которому нужно больше CLAUDE_TURN_TIMEOUT_MAX, идет стримом. Повторы хода:
+    # только ошибки соединения и 408/409/429/5xx, таймаут чтения не повторяется
+    CLAUDE_TURN_RETRIES = int(os.getenv("CLAUDE_TURN_RETRIES", 2))
 
     # Storage paths
     BASE_DIR = Path(__file__).parent
     STORAGE_DIR = BASE_DIR / "storage"
     USER_FILES_DIR = STORAGE_DIR / "user_files"
     RESPONSES_DIR = STORAGE_DIR / "responses"
+    TRACES_DIR = STORAGE_DIR / "traces"
+    SESSIONS_DIR = STORAGE_DIR / "sessions"
+    INDEX_DIR = STORAGE_DIR / "index"
+    STORE_DIR = INDEX_DIR / "text"
+
+    # Сессии диалога: бюджет на диск для всех сессий (сверх него удаляются
+    # давно не использованные), время жизни и предел контекста одной сессии,
+    # после которого старые результаты команд сжимаются
+    SESSION_BUDGET_MB = int(os.getenv("SESSION_BUDGET_MB", 1024))
+    SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", 72))
+    SESSION_MAX_CONTEXT_TOKENS = int(os.getenv("SESSION_MAX_CONTEXT_TOKENS", 600000))
+
+    # Индекс user_files (build_index.py): оглавление с диапазонами строк и краткое
+    # содержание каждого файла показываются в листинге директории MemoryTool.view
+    INDEX_MAX_SECTIONS = int(os.getenv("INDEX_MAX_SECTIONS", 200))
+    INDEX_LISTING_SECTIONS = int(os.getenv("INDEX_LISTING_SECTIONS", 40))
+    # Общий бюджет строк описаний в одном листинге: в директории с тысячами файлов
+    # оглавления сокращаются, а сверх бюджета файл описывается одной строкой
+    INDEX_LISTING_MAX_LINES = int(os.getenv("INDEX_LISTING_MAX_LINES", 600))
+    INDEX_SUMMARY_MODEL = os.getenv("INDEX_SUMMARY_MODEL", "claude-haiku-4-5")
+    # Фрагменты (view "<файл>#<id>"): мелкие соседние записи объединяются до TARGET,
+    # запись длиннее MAX делится по строкам
+    CHUNK_TARGET_CHARS = int(os.getenv("CHUNK_TARGET_CHARS", 4000))
+    CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", 12000))
+    # Извлеченный текст проиндексированных файлов хранится в INDEX_DIR/text в zstd
+    # кадрах по STORE_FRAME_KB: view с view_range распаковывает только нужные кадры.
+    # Словарь корпуса обучается командой build_index.py --train-dict
+    STORE_EXTRACTED_TEXT = os.getenv("STORE_EXTRACTED_TEXT", "True").lower() == "true"
+    STORE_ZSTD_LEVEL = int(os.getenv("STORE_ZSTD_LEVEL", 6))
+    STORE_FRAME_KB = int(os.getenv("STORE_FRAME_KB", 64))
+    STORE_DICT_KB = int(os.getenv("STORE_DICT_KB", 110))
+
+    # Локальный поиск (BM25) по фрагментам проиндексированных файлов перед первым
+    # вызовом API: до TOP_K фрагментов в пределах BUDGET токенов прикладываются к вопросу
+    RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "True").lower() == "true"
+    RETRIEVAL_BUDGET_TOKENS = int(os.getenv("RETRIEVAL_BUDGET_TOKENS", 6000))
+    RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+
+    # Листинги /api/files и /api/responses: размер страницы по умолчанию и максимальный.
+    # Счетчики поколений директорий (ETag листингов) общие для воркеров
+    LISTING_DEFAULT_LIMIT = int(os.getenv("LISTING_DEFAULT_LIMIT", 1000))
+    LISTING_MAX_LIMIT = int(os.getenv("LISTING_MAX_LIMIT", 5000))
+    LISTING_STATE_DIR = Path(os.getenv("LISTING_STATE_DIR", "/tmp/claude-memory-listing"))
+
+    # Режим tail для файлов ответов (/api/responses/<path>/tail): опрос размера файла,
+    # завершение после IDLE секунд без изменений или через MAX секунд
+    RESPONSE_TAIL_POLL_INTERVAL = float(os.getenv("RESPONSE_TAIL_POLL_INTERVAL", 0.5))
+    RESPONSE_TAIL_IDLE_SECONDS = float(os.getenv("RESPONSE_TAIL_IDLE_SECONDS", 60))
+    RESPONSE_TAIL_MAX_SECONDS = float(os.getenv("RESPONSE_TAIL_MAX_SECONDS", 600))
+    # Стрим держит sync воркер: одновременно не больше четверти воркеров (сверх - 429).
+    # Стрим завершается, когда файл дочитан и ни один запрос не выполняется
+    RESPONSE_TAIL_MAX_STREAMS = int(os.getenv(
+        "RESPONSE_TAIL_MAX_STREAMS", max(1, int(os.getenv("GUNICORN_WORKERS", 4)) // 4)
+    ))
+    TAIL_STATE_DIR = Path(os.getenv("TAIL_STATE_DIR", "/tmp/claude-memory-tail"))
+
+    # Задания фонового удаления (/api/jobs/<job_id>): записи хранятся JOBS_TTL_HOURS
+    JOBS_DIR = Path(os.getenv("JOBS_DIR", "/tmp/claude-memory-jobs"))
+    JOBS_TTL_HOURS = float(os.getenv("JOBS_TTL_HOURS", 24))
 
     # File upload settings
     MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
     ALLOWED_EXTENSIONS = {'.json', '.txt', '.xml', '.pdf', '.csv', '.xlsx', '.xls', '.docx'}
 
+    # Библиотеки форматов, импортируемые при старте: "" - лениво при первом файле,
+    # "all" - все сразу, ".pdf,.xlsx" - выбранные. С preload_app импорт в мастере
+    # разделяется воркерами через copy-on-write
+    FILE_PROCESSOR_WARMUP = os.getenv("FILE_PROCESSOR_WARMUP", "")
+
     # Flask settings
     FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
     FLASK_PORT = int(os.getenv("FLASK_PORT", 5000))
     FLASK_DEBUG = os.getenv("FLASK_DEBUG", "False").lower() == "true"
 
+    @classmethod
+    def warmup_suffixes(cls):
+        """Расширения для FileProcessor.warm_up; None - все, [] - ни одного"""
+        value = cls.FILE_PROCESSOR_WARMUP.strip().lower()
+        if value == "all":
+            return None
+        return [part.strip() for part in value.split(",") if part.strip()]
+
     @classmethod
     def init_directories(cls):
         """Создает необходимые директории при запуске"""
         cls.USER_FILES_DIR.mkdir(parents=True, exist_ok=True)
         cls.RESPONSES_DIR.mkdir(parents=True, exist_ok=True)
+        cls.TRACES_DIR.mkdir(parents=True, exist_ok=True)
+        cls.SESSIONS_DIR.mkdir(parents=True, exist_ok=True)
+        cls.INDEX_DIR.mkdir(parents=True, exist_ok=True)
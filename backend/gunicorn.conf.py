@@ -1,5 +1,12 @@
 import multiprocessing
 import os
+import shutil
+
+# Метрики prometheus_client в multiprocess режиме: каждый воркер пишет свои файлы,
+# /api/metrics агрегирует их. Переменная должна быть выставлена до импорта приложения
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/claude-memory-metrics')
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
 
 bind = f"0.0.0.0:{os.getenv('FLASK_PORT', '5000')}"
 backlog = 2048
@@ -31,3 +38,8 @@ preload_app = True
 
 max_requests = 1000
 max_requests_jitter = 50
+
+
+def child_exit(server, worker):
+    from services import metrics
+    metrics.mark_process_dead(worker.pid)
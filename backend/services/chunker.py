@@ -0,0 +1,221 @@
+import hashlib
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+# Заголовки markdown ("# System Prompt:", "#DATA:"), маркеры страниц PDF, таблиц DOCX
+# и ключи верхних уровней JSON ("  \"meetings\": [") - границы разделов
+MARKDOWN_HEADING_RE = re.compile(r"^(#{1,6})\s*(\S.*)$")
+PAGE_MARKER_RE = re.compile(r"^--- ((?:Страница|Таблица) \d+) ---$")
+JSON_KEY_RE = re.compile(r'^( {0,4})"([^"]{1,80})": [\[{]\s*$')
+FENCE_RE = re.compile(r"^\s*```")
+
+# Разделители записей: "---", "===", "***" на отдельной строке
+SEPARATOR_RE = re.compile(r"^\s*(-{3,}|={3,}|\*{3,})\s*$")
+# Запись JSON массива: "{" на отдельной строке с отступом и "}" / "}," с тем же отступом
+RECORD_START_RE = re.compile(r"^(\s+)\{\s*$")
+# Поле, по которому запись узнается в списке фрагментов: "meeting_id": 101, "name": "..."
+RECORD_KEY_RE = re.compile(r'^\s*"(\w*id|name|title|название|имя)": ("[^"]{1,60}"|[\w.-]{1,30}),?\s*$', re.IGNORECASE)
+
+TERM_RE = re.compile(r"\w+")
+# Грубая нормализация русских окончаний без морфологии: "конверсия", "конверсии",
+# "конверсию" сводятся к одному префиксу
+STEM_CHARS = 6
+STOP_WORDS = {
+    "и", "в", "во", "на", "по", "с", "со", "к", "ко", "о", "об", "от", "до", "из", "за", "для",
+    "не", "ни", "но", "а", "или", "ли", "же", "бы", "что", "как", "это", "то", "у", "при",
+    "какие", "какая", "какой", "каких", "какое", "есть", "vs", "the", "of", "and"
+}
+
+
+def _record_end(lines: List[str], start: int, indent: str) -> Optional[int]:
+    closing = re.compile(rf"^{indent}\}},?\s*$")
+    for index in range(start + 1, len(lines)):
+        if closing.match(lines[index]):
+            return index
+        # Строка с меньшим отступом - запись не закрылась, это не JSON
+        if lines[index].strip() and not lines[index].startswith(indent):
+            return None
+    return None
+
+
+def _record_title(lines: List[str], start: int, end: int) -> Optional[str]:
+    for line in lines[start:min(end, start + 30) + 1]:
+        match = RECORD_KEY_RE.match(line)
+        if match:
+            return f"{match.group(1)}: {match.group(2).strip(chr(34))}"
+    return None
+
+
+def _units(lines: List[str]) -> List[Dict[str, Any]]:
+    """
+    Неделимые единицы текста (индексы строк с 0): заголовки, записи JSON,
+    абзацы между пустыми строками. section - последний заголовок перед единицей.
+    """
+    units = []
+    section = None
+    in_fence = False
+    paragraph_start = None
+
+    def flush(end: int):
+        nonlocal paragraph_start
+        if paragraph_start is not None:
+            units.append({"kind": "paragraph", "start": paragraph_start, "end": end, "section": section})
+            paragraph_start = None
+
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+        if not in_fence:
+            heading = MARKDOWN_HEADING_RE.match(line) or PAGE_MARKER_RE.match(line) or JSON_KEY_RE.match(line)
+            if heading:
+                flush(index - 1)
+                section = heading.group(2) if heading.re is not PAGE_MARKER_RE else heading.group(1)
+                section = section.strip().rstrip(":")
+                units.append({"kind": "heading", "start": index, "end": index, "section": section})
+                index += 1
+                continue
+
+            record = RECORD_START_RE.match(line)
+            if record:
+                end = _record_end(lines, index, record.group(1))
+                if end is not None:
+                    flush(index - 1)
+                    units.append({
+                        "kind": "record",
+                        "start": index,
+                        "end": end,
+                        "section": section,
+                        "title": _record_title(lines, index, end)
+                    })
+                    index = end + 1
+                    continue
+
+            if not line.strip() or SEPARATOR_RE.match(line):
+                flush(index - 1)
+                index += 1
+                continue
+
+        if paragraph_start is None:
+            paragraph_start = index
+        index += 1
+    flush(len(lines) - 1)
+    return units
+
+
+def _split_long(start: int, end: int, lines: List[str], max_chars: int) -> List[tuple]:
+    """Диапазоны строк не длиннее max_chars символов (строка не делится)"""
+    spans = []
+    span_start = start
+    size = 0
+    for index in range(start, end + 1):
+        length = len(lines[index]) + 1
+        if size and size + length > max_chars:
+            spans.append((span_start, index - 1))
+            span_start, size = index, 0
+        size += length
+    spans.append((span_start, end))
+    return spans
+
+
+def chunk_lines(lines: List[str], target_chars: int = 4000, max_chars: int = 12000) -> List[Dict[str, Any]]:
+    """
+    Делит текст на смысловые фрагменты: границы - заголовки, записи JSON
+    и абзацы. Соседние мелкие единицы одного раздела и вида объединяются
+    до target_chars, единица длиннее max_chars делится по строкам.
+
+    Идентификатор фрагмента - хеш его текста: он не меняется, когда правки
+    в других частях файла сдвигают номера строк.
+
+    Returns:
+        [{"id", "start_line", "end_line", "title", "chars"}], строки с 1, как в MemoryTool.view
+    """
+    groups: List[Dict[str, Any]] = []
+    pending_heading = None
+    for unit in _units(lines):
+        if unit["kind"] == "heading":
+            # Заголовок приклеивается к началу следующего фрагмента
+            pending_heading = pending_heading if pending_heading is not None else unit["start"]
+            continue
+
+        start = pending_heading if pending_heading is not None else unit["start"]
+        size = sum(len(line) + 1 for line in lines[start:unit["end"] + 1])
+        last = groups[-1] if groups else None
+        if (
+            last is not None
+            and pending_heading is None
+            and last["kind"] == unit["kind"]
+            and last["section"] == unit["section"]
+            and last["chars"] + size <= target_chars
+        ):
+            last["end"] = unit["end"]
+            last["chars"] += size
+            if unit.get("title"):
+                last["titles"].append(unit["title"])
+        else:
+            groups.append({
+                "kind": unit["kind"],
+                "section": unit["section"],
+                "start": start,
+                "end": unit["end"],
+                "chars": size,
+                "titles": [unit["title"]] if unit.get("title") else []
+            })
+        pending_heading = None
+
+    if pending_heading is not None:
+        groups.append({"kind": "heading", "section": None, "start": pending_heading,
+                       "end": len(lines) - 1, "chars": 0, "titles": []})
+
+    chunks = []
+    seen: Dict[str, int] = {}
+    for group in groups:
+        spans = _split_long(group["start"], group["end"], lines, max_chars)
+        for part, (start, end) in enumerate(spans, start=1):
+            text = "\n".join(lines[start:end + 1])
+            chunk_id = "c" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:8]
+            if chunk_id in seen:
+                seen[chunk_id] += 1
+                chunk_id = f"{chunk_id}-{seen[chunk_id]}"
+            else:
+                seen[chunk_id] = 1
+
+            titles = group["titles"]
+            if len(titles) > 2:
+                title = f"{titles[0]} … {titles[-1]} ({len(titles)} записей)"
+            elif titles:
+                title = ", ".join(titles)
+            else:
+                title = group["section"] or lines[start].strip()[:60]
+            if len(spans) > 1:
+                title = f"{title} (часть {part}/{len(spans)})"
+
+            chunks.append({
+                "id": chunk_id,
+                "start_line": start + 1,
+                "end_line": end + 1,
+                "title": title,
+                "chars": len(text)
+            })
+    return chunks
+
+
+def terms(text: str) -> List[str]:
+    """Термы для лексического поиска: слова без стоп-слов, обрезанные до STEM_CHARS"""
+    result = []
+    for word in TERM_RE.findall(text.lower()):
+        if word in STOP_WORDS or (len(word) < 2 and not word.isdigit()):
+            continue
+        result.append(word if word.isdigit() else word[:STEM_CHARS])
+    return result
+
+
+def chunk_terms(lines: List[str], chunks: List[Dict[str, Any]]) -> List[Dict[str, int]]:
+    """Число вхождений каждого терма во фрагменты chunks (в том же порядке)"""
+    return [
+        dict(Counter(terms("\n".join(lines[chunk["start_line"] - 1:chunk["end_line"]]))))
+        for chunk in chunks
+    ]
@@ -1,63 +1,292 @@
 import time
+import logging
 from anthropic import Anthropic
-from anthropic.types.beta import BetaMessageParam
-from typing import List, Dict, Any
+from anthropic.types.beta import BetaMessage, BetaMessageParam, BetaToolResultBlockParam
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from pathlib import Path
 from services.memory_tool import MemoryTool, SYSTEM_PROMPT
+from services.file_index import FileIndex
+from services.frame_store import FrameStore
+from services.listing import DirectoryGenerations, DirectoryListing
+from services.trash import DeletionJobs
+from services.file_tail import ActiveQueries, StreamSlots
+from services.routing import CorpusEstimator, Router, load_rules
+from services.retrieval import Retriever, format_excerpts
+from services import http_transport, metrics, tracing
+from services.scheduler import TokenBucketScheduler
+from services.sessions import (
+    Session,
+    SessionBusyError,
+    SessionNotFoundError,
+    SessionStore,
+    estimate_tokens,
+)
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def with_cache_breakpoint(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Копия истории с точкой prompt cache на последнем блоке: весь префикс
+    (инструменты, system, прошлые ходы и запросы сессии) читается из кэша
+    на следующем ходе. Точка одна и сдвигается, лимит в 4 точки не превышается.
+    """
+    if not messages:
+        return messages
+    last = messages[-1]
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = [*content[:-1], {**content[-1], "cache_control": CACHE_CONTROL}]
+    return [*messages[:-1], {**last, "content": content}]
+
 
 class ClaudeClient:
-    def __init__(self, user_files_dir: Path, responses_dir: Path):
-        self.client = Anthropic(api_key=Config.CLAUDE_API_KEY)
-        self.memory_tool = MemoryTool(user_files_dir, responses_dir)
+    def __init__(self, user_files_dir: Path, responses_dir: Path, traces_dir: Optional[Path] = None):
+        self.client = Anthropic(
+            api_key=Config.CLAUDE_API_KEY,
+            base_url=Config.CLAUDE_BASE_URL,
+            http_client=http_transport.get_http_client()
+        )
+        # Ходы повторяются в _create_message: SDK повторил бы и таймаут чтения
+        self.turn_client = self.client.with_options(max_retries=0)
+        self.generations = DirectoryGenerations(Config.LISTING_STATE_DIR)
+        self.memory_tool = MemoryTool(
+            user_files_dir,
+            responses_dir,
+            file_index=FileIndex(
+                Config.INDEX_DIR,
+                user_files_dir,
+                chunk_target_chars=Config.CHUNK_TARGET_CHARS,
+                chunk_max_chars=Config.CHUNK_MAX_CHARS,
+                store=FrameStore(
+                    Config.STORE_DIR,
+                    frame_bytes=Config.STORE_FRAME_KB * 1024,
+                    level=Config.STORE_ZSTD_LEVEL
+                ) if Config.STORE_EXTRACTED_TEXT else None
+            ),
+            listing_sections=Config.INDEX_LISTING_SECTIONS,
+            listing_max_lines=Config.INDEX_LISTING_MAX_LINES,
+            generations=self.generations
+        )
+        self.file_listing = DirectoryListing(user_files_dir, "user_files", self.generations)
+        self.response_listing = DirectoryListing(responses_dir, "responses", self.generations)
+        self.active_queries = ActiveQueries(Config.TAIL_STATE_DIR / "queries")
+        self.tail_slots = StreamSlots(Config.TAIL_STATE_DIR / "slots", Config.RESPONSE_TAIL_MAX_STREAMS)
+        self.deletions = DeletionJobs(Config.JOBS_DIR, ttl_seconds=Config.JOBS_TTL_HOURS * 3600)
         self.model = Config.CLAUDE_MODEL
         self.betas = Config.CLAUDE_BETAS
+        self.router = Router(
+            load_rules(Config.ROUTING_RULES_PATH),
+            CorpusEstimator(self.file_listing, self.memory_tool.file_index),
+            default_model=Config.CLAUDE_MODEL,
+            default_max_tokens=Config.CLAUDE_MAX_TOKENS,
+            default_betas=Config.CLAUDE_BETAS
+        )
+        self.retriever = Retriever(
+            self.file_listing,
+            self.memory_tool.file_index,
+            budget_tokens=Config.RETRIEVAL_BUDGET_TOKENS,
+            top_k=Config.RETRIEVAL_TOP_K
+        ) if Config.RETRIEVAL_ENABLED else None
+        self.traces_dir = traces_dir
+        self.scheduler = TokenBucketScheduler(
+            Config.SCHEDULER_DIR,
+            requests_per_minute=Config.CLAUDE_RPM_LIMIT,
+            input_tokens_per_minute=Config.CLAUDE_ITPM_LIMIT,
+            output_tokens_per_minute=Config.CLAUDE_OTPM_LIMIT
+        )
+        self.sessions = SessionStore(
+            Config.SESSIONS_DIR,
+            max_bytes=Config.SESSION_BUDGET_MB * 1024 * 1024,
+            ttl_seconds=Config.SESSION_TTL_HOURS * 3600,
+            max_context_tokens=Config.SESSION_MAX_CONTEXT_TOKENS
+        )
+        # Корзины, оставшиеся от заданий удаления, прерванных перезапуском воркера
+        self.deletions.recover(user_files_dir, self.invalidate_user_files)
+        self.deletions.recover(responses_dir)
+
+    def delete_user_files(self, targets: List[Path]) -> Dict[str, Any]:
+        """Удаляет файлы и директории user_files в фоне; возвращает задание"""
+        try:
+            return self.deletions.submit(self.memory_tool.user_files_dir, targets, self.invalidate_user_files)
+        finally:
+            # И при ошибке переноса: часть путей уже могла уйти в корзину
+            self.generations.bump("user_files")
+
+    def delete_responses(self, targets: List[Path]) -> Dict[str, Any]:
+        try:
+            return self.deletions.submit(self.memory_tool.responses_dir, targets)
+        finally:
+            self.generations.bump("responses")
+
+    def invalidate_user_files(self, paths: List[str]) -> Dict[str, int]:
+        """
+        Удаляет данные, производные от удаленных файлов: записи manifest, артефакты
+        индекса со сжатым текстом и результаты чтения этих файлов в сессиях
+        """
+        counts = {}
+        if self.memory_tool.file_index is not None:
+            counts.update(self.memory_tool.file_index.forget_missing())
+        if paths:
+            counts["sessions"] = self.sessions.forget_paths([f"/user_files/{path}" for path in paths])
+        return counts
 
-    def process_query_sync(self, query: str, max_tokens: int = 8000) -> Dict[str, Any]:
+    def process_query_sync(self, query: str, max_tokens: Optional[int] = None, priority: str = "interactive",
+                           session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Синхронная версия обработки запроса с поддержкой MemoryTool
 
         Args:
             query: Запрос пользователя
-            max_tokens: Максимальное количество токенов для ответа
+            max_tokens: Максимальное количество токенов для ответа; None - по правилам маршрутизации
+            priority: Класс планировщика: interactive или batch
+            session_id: Сессия для продолжения диалога; None - новая сессия
 
         Returns:
             Словарь с результатом обработки
         """
+        result: Dict[str, Any] = {"success": False, "error": "Запрос не выполнен"}
+        for event in self.process_query_stream(query, max_tokens, priority, session_id):
+            if event["type"] == "done":
+                result = {
+                    "success": True,
+                    "query_id": event["query_id"],
+                    "session_id": event["session_id"],
+                    "text": event["text"],
+                    "usage": event["usage"],
+                    "created_files": event["created_files"],
+                    "routing": event["routing"],
+                    "retrieval": event["retrieval"]
+                }
+            elif event["type"] == "error":
+                result = {
+                    "success": False,
+                    "query_id": event["query_id"],
+                    "session_id": event["session_id"],
+                    "error": event["error"],
+                    "code": event.get("code")
+                }
+        return result
+
+    def process_query_stream(self, query: str, max_tokens: Optional[int] = None, priority: str = "interactive",
+                             session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковая обработка запроса: события по мере выполнения ходов
+
+        Args:
+            query: Запрос пользователя
+            max_tokens: Максимальное количество токенов для ответа; None - по правилам маршрутизации
+            priority: Класс планировщика: interactive или batch
+            session_id: Сессия для продолжения диалога; None - новая сессия
+
+        Yields:
+            {"type": "turn"} - завершен ход API (номер, ожидание в очереди, токены)
+            {"type": "text"} - текст модели
+            {"type": "tool_use"} - команда MemoryTool
+            {"type": "done"} / {"type": "error"} - итог запроса
+        """
+        new_session = session_id is None
+        session_id = session_id or self.sessions.create().session_id
+        try:
+            with self.sessions.lock(session_id):
+                session = self.sessions.create(session_id) if new_session else self.sessions.load(session_id)
+                yield from self._process_in_session(session, query, max_tokens, priority)
+        except SessionBusyError:
+            yield {
+                "type": "error",
+                "query_id": None,
+                "session_id": session_id,
+                "error": "Сессия занята другим запросом",
+                "code": "session_busy"
+            }
+        except SessionNotFoundError:
+            yield {
+                "type": "error",
+                "query_id": None,
+                "session_id": session_id,
+                "error": "Сессия не найдена",
+                "code": "session_not_found"
+            }
+
+    def _process_in_session(self, session: Session, query: str, max_tokens: Optional[int],
+                            priority: str) -> Iterator[Dict[str, Any]]:
+        """Выполняет запрос поверх истории сессии; история сохраняется только при успехе"""
         # Запоминаем файлы ДО выполнения запроса
         files_before = self._get_response_file_paths()
         start_time = time.time()
 
+        compacted = self.sessions.prepare(session)
+        retrieval = self._retrieve(query)
+        content: Any = query
+        if retrieval and retrieval["excerpts"]:
+            content = [
+                {"type": "text", "text": format_excerpts(retrieval["excerpts"])},
+                {"type": "text", "text": query}
+            ]
         messages: List[BetaMessageParam] = [
+            *session.messages,
             {
                 "role": "user",
-                "content": query
+                "content": content
             }
         ]
 
-        try:
-            tool_runner = self.client.beta.messages.tool_runner(
-                model=self.model,
-                max_tokens=max_tokens,
-                messages=messages,
-                system=SYSTEM_PROMPT,
-                betas=self.betas,
-                tools=[self.memory_tool]
-            )
+        route = self.router.route(
+            query, estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(messages), priority, max_tokens
+        )
+        metrics.ROUTING_DECISIONS.labels(rule=route["rule"], model=route["model"]).inc()
 
+        turns = 0
+        queue_wait = 0.0
+        totals = metrics.usage_tokens(None)
+        metrics.QUERIES_IN_PROGRESS.inc()
+        trace = tracing.QueryTrace(query, route["model"], route["max_tokens"], session_id=session.session_id)
+        trace.routing = route
+        if retrieval is not None:
+            trace.retrieval = {
+                **{key: retrieval[key] for key in ("tokens", "chunks", "seconds")},
+                "excerpts": [
+                    {key: excerpt[key] for key in ("path", "start_line", "end_line", "chunk", "score")}
+                    for excerpt in retrieval["excerpts"]
+                ]
+            }
+
+        try:
             final_text = ""
             last_usage = None
 
-            for message in tool_runner:
-                for block in message.content:
-                    if hasattr(block, 'text'):
-                        final_text += block.text
+            with tracing.activate(trace), self.active_queries.hold(trace.query_id):
+                for message, turn_wait in self._run_turns(
+                    messages, route["max_tokens"], priority, model=route["model"], betas=route["betas"]
+                ):
+                    turns += 1
+                    queue_wait += turn_wait
+                    for block in message.content:
+                        if hasattr(block, 'text'):
+                            final_text += block.text
+                            yield {"type": "text", "text": block.text}
+                        elif block.type == "tool_use":
+                            yield {"type": "tool_use", "input": block.input}
 
-                if hasattr(message, 'usage'):
-                    last_usage = message.usage
+                    if hasattr(message, 'usage'):
+                        last_usage = message.usage
+                        for kind, value in metrics.usage_tokens(message.usage).items():
+                            totals[kind] += value
+
+                    yield {
+                        "type": "turn",
+                        "turn": turns,
+                        "queue_wait_seconds": round(turn_wait, 3),
+                        "tokens": metrics.usage_tokens(last_usage)
+                    }
 
             elapsed_time = time.time() - start_time
+            metrics.observe_query(elapsed_time, "ok", turns, totals)
+            metrics.ROUTED_QUERY_SECONDS.labels(rule=route["rule"], model=route["model"], status="ok").observe(elapsed_time)
 
             # Определяем новые файлы ПОСЛЕ выполнения запроса
             files_after = self._get_response_file_paths()
@@ -66,61 +295,203 @@ class ClaudeClient:
             # Фильтруем progress.txt из списка созданных файлов
             created_files = [f for f in created_files if not f['name'].lower() == 'progress.txt']
 
-            return {
-                "success": True,
+            trace.finish("ok", created_files=[f['path'] for f in created_files])
+            self._save_trace(trace)
+
+            session.messages = messages
+            session.queries.append({
+                "query_id": trace.query_id,
+                "query": query,
+                "started_at": trace.started_at,
+                "turns": turns,
+                "compacted_results": compacted
+            })
+            try:
+                self.sessions.save(session)
+            except OSError:
+                logger.exception(f"Не удалось сохранить сессию {session.session_id}")
+
+            yield {
+                "type": "done",
+                "query_id": trace.query_id,
+                "session_id": session.session_id,
                 "text": final_text,
                 "usage": {
                     "input_tokens": last_usage.input_tokens if last_usage else 0,
                     "output_tokens": last_usage.output_tokens if last_usage else 0,
-                    "elapsed_seconds": round(elapsed_time, 1)
+                    "elapsed_seconds": round(elapsed_time, 1),
+                    "queue_wait_seconds": round(queue_wait, 1),
+                    "turns": turns,
+                    "total_input_tokens": totals["input"],
+                    "total_output_tokens": totals["output"],
+                    "cache_read_input_tokens": totals["cache_read"],
+                    "cache_creation_input_tokens": totals["cache_creation"]
                 },
-                "created_files": created_files
+                "created_files": created_files,
+                "routing": {key: route[key] for key in ("rule", "model", "max_tokens", "corpus_tokens")},
+                "retrieval": {
+                    "excerpts": len(retrieval["excerpts"]),
+                    "tokens": retrieval["tokens"],
+                    "seconds": retrieval["seconds"]
+                } if retrieval is not None else None
             }
 
         except Exception as e:
-            return {
-                "success": False,
+            metrics.observe_query(time.time() - start_time, "error", turns, totals)
+            metrics.ROUTED_QUERY_SECONDS.labels(
+                rule=route["rule"], model=route["model"], status="error"
+            ).observe(time.time() - start_time)
+            trace.finish("error", error=str(e))
+            self._save_trace(trace)
+            yield {
+                "type": "error",
+                "query_id": trace.query_id,
+                "session_id": session.session_id,
                 "error": str(e)
             }
+        finally:
+            metrics.QUERIES_IN_PROGRESS.dec()
 
-    def _get_response_file_paths(self) -> List[Dict[str, Any]]:
-        """Вспомогательный метод для получения списка файлов в responses"""
-        files = []
-        for file_path in self.memory_tool.responses_dir.rglob("*"):
-            if file_path.is_file() and not file_path.name.startswith("."):
-                rel_path = file_path.relative_to(self.memory_tool.responses_dir)
-                files.append({
-                    "name": file_path.name,
-                    "path": str(rel_path),
-                    "size": file_path.stat().st_size,
-                    "modified": file_path.stat().st_mtime
-                })
-        return files
-
-    def get_available_files(self) -> List[Dict[str, Any]]:
-        """Возвращает список доступных файлов в user_files"""
-        files = []
-        for file_path in self.memory_tool.user_files_dir.rglob("*"):
-            if file_path.is_file() and not file_path.name.startswith("."):
-                rel_path = file_path.relative_to(self.memory_tool.user_files_dir)
-                files.append({
-                    "name": file_path.name,
-                    "path": str(rel_path),
-                    "size": file_path.stat().st_size,
-                    "extension": file_path.suffix
+    def _retrieve(self, query: str) -> Optional[Dict[str, Any]]:
+        """Фрагменты корпуса для вопроса; ошибка поиска не мешает запросу - он идет без фрагментов"""
+        if self.retriever is None or self.memory_tool.file_index is None:
+            return None
+        try:
+            retrieval = self.retriever.search(query)
+        except Exception:
+            logger.exception("Поиск фрагментов не выполнен")
+            return None
+        metrics.RETRIEVAL_SECONDS.observe(retrieval["seconds"])
+        metrics.RETRIEVAL_TOKENS.observe(retrieval["tokens"])
+        return retrieval
+
+    def _create_message(self, **params: Any) -> BetaMessage:
+        """
+        Одна попытка хода API. Длинный ход (http_transport.streams_turn) идет стримом
+        и собирается в итоговое сообщение. Повторы SDK отключены - их делает _run_turns
+        через планировщик
+        """
+        if http_transport.streams_turn(params["max_tokens"]):
+            with self.turn_client.beta.messages.stream(**params) as stream:
+                return stream.get_final_message()
+        return self.turn_client.beta.messages.create(**params)
+
+    def _run_turns(self, messages: List[BetaMessageParam], max_tokens: int, priority: str = "interactive",
+                   model: Optional[str] = None, betas: Optional[List[str]] = None) -> Iterator[Tuple[BetaMessage, float]]:
+        """
+        Цикл вызовов API с выполнением команд MemoryTool между ходами.
+        Аналог tool_runner, но с явными границами ходов, чтобы измерять
+        время модели отдельно от времени инструментов и допускать
+        каждый ход через общий планировщик.
+
+        Args:
+            messages: История сообщений, дополняется на каждом ходе
+            max_tokens: Максимальное количество токенов для ответа
+            priority: Класс планировщика
+            model, betas: выбор маршрутизации; None - из Config
+
+        Yields:
+            Ответ модели на каждом ходе и время ожидания допуска
+        """
+        # Оценка входа следующего хода: фактический контекст прошлого хода + добавленные сообщения
+        context_tokens = estimate_tokens(SYSTEM_PROMPT)
+        pending: List[Any] = list(messages)
+        model = model or self.model
+        betas = self.betas if betas is None else betas
+
+        while True:
+            estimated_input = context_tokens + estimate_tokens(pending)
+            queue_wait = 0.0
+            # Таймаут чтения не повторяется, сбои соединения и 408/409/429/5xx - до
+            # CLAUDE_TURN_RETRIES раз. Каждая попытка заново допускается планировщиком:
+            # отказ возвращает оценку в bucket, повтор списывает ее снова
+            for attempt in range(Config.CLAUDE_TURN_RETRIES + 1):
+                queue_wait += self.scheduler.acquire(priority, estimated_input)
+                turn_start = time.perf_counter()
+                try:
+                    message = self._create_message(
+                        model=model,
+                        max_tokens=max_tokens,
+                        messages=with_cache_breakpoint(messages),
+                        system=SYSTEM_PROMPT,
+                        betas=betas,
+                        tools=[self.memory_tool.to_dict()],
+                        timeout=http_transport.turn_timeout(max_tokens)
+                    )
+                    break
+                except Exception as e:
+                    metrics.observe_api_turn(model, time.perf_counter() - turn_start, "error", {})
+                    self.scheduler.settle(estimated_input, 0, 0)
+                    if attempt == Config.CLAUDE_TURN_RETRIES or not http_transport.is_retryable(e):
+                        raise
+                    delay = http_transport.retry_delay(e, attempt)
+                    logger.warning(f"Ход API не выполнен ({e}), повтор {attempt + 1} через {delay:.1f} с")
+                    time.sleep(delay)
+            api_seconds = time.perf_counter() - turn_start
+            tokens = metrics.usage_tokens(message.usage)
+            metrics.observe_api_turn(model, api_seconds, "ok", tokens)
+            # Лимит входных токенов в минуту не учитывает чтение из кэша
+            self.scheduler.settle(estimated_input, tokens["input"] + tokens["cache_creation"], tokens["output"])
+
+            trace = tracing.current()
+            if trace is not None:
+                trace.add_turn(
+                    api_seconds, tokens, message.stop_reason,
+                    queue_wait_seconds=round(queue_wait, 4),
+                    new_connection=http_transport.last_request_connected()
+                )
+
+            yield message, queue_wait
+
+            # Блоки ответа хранятся как dict: история сессии сериализуется в JSON
+            messages.append({
+                "role": message.role,
+                "content": [block.model_dump(exclude_none=True) for block in message.content]
+            })
+            tool_uses = [block for block in message.content if block.type == "tool_use"]
+            if not tool_uses:
+                return
+
+            context_tokens = tokens["input"] + tokens["cache_read"] + tokens["cache_creation"] + tokens["output"]
+            tool_results = self._run_tools(tool_uses)
+            pending = [tool_results]
+            messages.append({"role": "user", "content": tool_results})
+
+    def _run_tools(self, tool_uses: List[Any]) -> List[BetaToolResultBlockParam]:
+        """Выполняет команды MemoryTool, ошибки возвращаются модели как is_error"""
+        results: List[BetaToolResultBlockParam] = []
+        for tool_use in tool_uses:
+            if tool_use.name != self.memory_tool.name:
+                results.append({
+                    "type": "tool_result",
+                    "tool_use_id": tool_use.id,
+                    "content": f"Error: Tool '{tool_use.name}' not found",
+                    "is_error": True
                 })
-        return files
-
-    def get_response_files(self) -> List[Dict[str, Any]]:
-        """Возвращает список сгенерированных ответов"""
-        files = []
-        for file_path in self.memory_tool.responses_dir.rglob("*"):
-            if file_path.is_file() and not file_path.name.startswith("."):
-                rel_path = file_path.relative_to(self.memory_tool.responses_dir)
-                files.append({
-                    "name": file_path.name,
-                    "path": str(rel_path),
-                    "size": file_path.stat().st_size,
-                    "modified": file_path.stat().st_mtime
+                continue
+
+            try:
+                result = self.memory_tool.call(tool_use.input)
+                results.append({"type": "tool_result", "tool_use_id": tool_use.id, "content": result})
+            except Exception as exc:
+                logger.exception(f"Ошибка выполнения {tool_use.name}")
+                results.append({
+                    "type": "tool_result",
+                    "tool_use_id": tool_use.id,
+                    "content": repr(exc),
+                    "is_error": True
                 })
-        return sorted(files, key=lambda x: x['modified'], reverse=True)
+        return results
+
+    def _save_trace(self, trace: tracing.QueryTrace) -> None:
+        """Сохраняет трассу; ошибка записи не должна ломать ответ пользователю"""
+        if self.traces_dir is None:
+            return
+        try:
+            trace.save(self.traces_dir)
+        except OSError:
+            logger.exception(f"Не удалось сохранить трассу {trace.query_id}")
+
+    def _get_response_file_paths(self) -> List[Dict[str, Any]]:
+        """Файлы в responses; без изменений после прошлого запроса - из кеша листинга"""
+        return self.response_listing.entries(self.response_listing.generation())
@@ -0,0 +1,452 @@
+import fcntl
+import hashlib
+import json
+import logging
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from services.chunker import FENCE_RE, JSON_KEY_RE, MARKDOWN_HEADING_RE, PAGE_MARKER_RE, chunk_lines, chunk_terms
+from services.file_processor import FileProcessor
+from services.frame_store import FrameStore
+from services.sessions import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 2 - добавлены фрагменты (chunks), 3 - DOCX читается read_docx_xml (другие номера строк),
+# 4 - в DOCX ячейки gridSpan дополняются пустыми, надписи не дублируются,
+# 5 - outlineLvl 9 ("основной текст") в DOCX не считается заголовком.
+# Артефакты старой версии пересобираются
+INDEX_VERSION = 5
+
+SUMMARY_CHARS = 300
+
+
+def file_sha256(file_path: Path, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_hidden(relative_path: Path) -> bool:
+    """Скрытый файл или файл в скрытой директории (.trash и т.п.)"""
+    return any(part.startswith(".") for part in relative_path.parts)
+
+
+def build_outline(lines: List[str], max_sections: int = 200) -> List[Dict[str, Any]]:
+    """
+    Разделы текста с диапазонами строк в нумерации MemoryTool.view (с 1).
+    Раздел продолжается до следующего заголовка того же или более высокого уровня.
+    """
+    headings = []
+    in_fence = False
+    # Ключи JSON внутри markdown документа вложены в последний заголовок markdown
+    json_base_level = 0
+    for number, line in enumerate(lines, start=1):
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+
+        match = MARKDOWN_HEADING_RE.match(line)
+        if match:
+            level = len(match.group(1))
+            headings.append((number, level, match.group(2).strip().rstrip(":")))
+            json_base_level = level
+            continue
+        match = PAGE_MARKER_RE.match(line)
+        if match:
+            # Таблица DOCX вложена в текущий раздел, страница PDF - верхний уровень
+            is_table = match.group(1).startswith("Таблица")
+            headings.append((number, json_base_level + 1 if is_table else 1, match.group(1)))
+            continue
+        match = JSON_KEY_RE.match(line)
+        if match:
+            level = json_base_level + len(match.group(1)) // 2
+            headings.append((number, max(level, 1), match.group(2)))
+
+    sections = []
+    for index, (start, level, title) in enumerate(headings):
+        end = len(lines)
+        for next_start, next_level, _ in headings[index + 1:]:
+            if next_level <= level:
+                end = next_start - 1
+                break
+        sections.append({"title": title, "level": level, "start_line": start, "end_line": end})
+
+    return limit_outline(sections, max_sections)
+
+
+def limit_outline(sections: List[Dict[str, Any]], max_sections: int) -> List[Dict[str, Any]]:
+    """Не больше max_sections разделов; верхние уровни остаются целиком - они важнее для навигации"""
+    if len(sections) <= max_sections:
+        return sections
+    levels = sorted({section["level"] for section in sections})
+    while len(levels) > 1 and sum(1 for s in sections if s["level"] <= levels[-1]) > max_sections:
+        levels.pop()
+    return [s for s in sections if s["level"] <= levels[-1]][:max_sections]
+
+
+def extractive_summary(lines: List[str], outline: List[Dict[str, Any]]) -> str:
+    """Первые содержательные строки текста, без заголовков и разметки"""
+    heading_lines = {section["start_line"] for section in outline}
+    parts = []
+    length = 0
+    for number, line in enumerate(lines, start=1):
+        text = line.strip()
+        if number in heading_lines or len(text) < 20 or FENCE_RE.match(text) or text[0] in "{}[]\"":
+            continue
+        parts.append(text)
+        length += len(text)
+        if length >= SUMMARY_CHARS:
+            break
+    summary = " ".join(parts)
+    return summary[:SUMMARY_CHARS].rstrip() + ("…" if len(summary) > SUMMARY_CHARS else "")
+
+
+class FileIndex:
+    """
+    Первый уровень индекса user_files: краткое содержание и оглавление каждого
+    файла с диапазонами строк. Строится пакетно (build_index.py) один раз на
+    содержимое файла: артефакты лежат в index_dir/<sha256>.json, а manifest.json
+    связывает относительный путь, размер и mtime файла с хешем, чтобы просмотр
+    директории не хешировал файлы. Рядом, в <sha256>.terms.json, - термы
+    фрагментов для поиска: воркерам не нужно читать и разбирать текст корпуса.
+
+    С store извлеченный текст файла сохраняется сжатым: view читает диапазон
+    строк из него, не разбирая исходный PDF/DOCX/XLSX заново.
+    """
+
+    def __init__(self, index_dir: Path, user_files_dir: Path,
+                 chunk_target_chars: int = 4000, chunk_max_chars: int = 12000,
+                 store: Optional[FrameStore] = None):
+        self.index_dir = Path(index_dir)
+        self.user_files_dir = Path(user_files_dir)
+        self.chunk_target_chars = chunk_target_chars
+        self.chunk_max_chars = chunk_max_chars
+        self.store = store
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.index_dir / "manifest.json"
+
+    def _artifact_path(self, content_hash: str) -> Path:
+        return self.index_dir / f"{content_hash}.json"
+
+    def _terms_path(self, content_hash: str) -> Path:
+        return self.index_dir / f"{content_hash}.terms.json"
+
+    @contextmanager
+    def _locked(self):
+        """
+        Сборка индекса и очистка после удаления файлов не выполняются одновременно:
+        очистка удалила бы артефакты, собранные, но еще не записанные в manifest
+        """
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.index_dir / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _relative(self, file_path: Path) -> str:
+        return file_path.relative_to(self.user_files_dir).as_posix()
+
+    def load_manifest(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def manifest_version(self) -> Optional[tuple]:
+        """
+        (mtime_ns, size) manifest.json: меняется при каждой записи manifest, в том
+        числе после build_index.py, который не трогает поколение user_files
+        """
+        try:
+            stat = self.manifest_path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _write_json(self, path: Path, data: Any, indent: Optional[int] = 2) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=indent), encoding="utf-8")
+        tmp_path.replace(path)
+
+    def lookup(self, file_path: Path, manifest: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Артефакт индекса, если файл не менялся после индексации"""
+        manifest = self.load_manifest() if manifest is None else manifest
+        entry = manifest.get(self._relative(file_path))
+        if entry is None:
+            return None
+        stat = file_path.stat()
+        if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return self.artifact(entry["sha256"])
+
+    def artifact(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        try:
+            artifact = json.loads(self._artifact_path(content_hash).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return artifact if artifact.get("version") == INDEX_VERSION else None
+
+    def chunk_terms(self, content_hash: str) -> Optional[List[Dict[str, int]]]:
+        """Число вхождений термов в каждый фрагмент артефакта; None, если не посчитано"""
+        try:
+            data = json.loads(self._terms_path(content_hash).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return data["chunks"] if data.get("version") == INDEX_VERSION else None
+
+    def _write_terms(self, content_hash: str, lines: List[str], chunks: List[Dict[str, Any]]) -> None:
+        # Без отступов: словари термов - основной объем файла
+        self._write_json(self._terms_path(content_hash), {
+            "version": INDEX_VERSION,
+            "sha256": content_hash,
+            "chunks": chunk_terms(lines, chunks)
+        }, indent=None)
+
+    def chunk(self, lines: List[str]) -> List[Dict[str, Any]]:
+        return chunk_lines(lines, self.chunk_target_chars, self.chunk_max_chars)
+
+    def read_lines(self, artifact: Dict[str, Any], start_line: int = 1,
+                   end_line: Optional[int] = None) -> Optional[List[str]]:
+        """Строки start_line..end_line (с 1) из сохраненного текста; None, если текст не сохранен"""
+        if self.store is None or not self.store.has(artifact["sha256"]):
+            return None
+        return self.store.read_lines(artifact["sha256"], start_line, end_line)
+
+    def _is_current(self, artifact_path: Path, content_hash: str) -> bool:
+        if self.store is not None and not self.store.has(content_hash):
+            return False
+        try:
+            return json.loads(artifact_path.read_text(encoding="utf-8")).get("version") == INDEX_VERSION
+        except (OSError, ValueError):
+            return False
+
+    def build_artifact(self, file_path: Path, content_hash: str,
+                       summarizer: Optional[Callable[[str, List[Dict[str, Any]]], str]] = None,
+                       max_sections: int = 200,
+                       token_counter: Optional[Callable[[str], Optional[int]]] = None) -> Dict[str, Any]:
+        content = FileProcessor.process_file(file_path)
+        lines = content.splitlines()
+        outline = build_outline(lines, max_sections)
+        summary = summarizer(content, outline) if summarizer else extractive_summary(lines, outline)
+        tokens = token_counter(content) if token_counter else None
+        chunks = self.chunk(lines)
+        if self.store is not None:
+            self.store.put(content_hash, lines)
+        self._write_terms(content_hash, lines, chunks)
+        return {
+            "version": INDEX_VERSION,
+            "sha256": content_hash,
+            "name": file_path.name,
+            "lines": len(lines),
+            "chars": len(content),
+            "tokens": tokens if tokens is not None else estimate_tokens(content),
+            "tokens_source": "api" if tokens is not None else "estimate",
+            "summary": summary,
+            "summary_source": "llm" if summarizer else "extractive",
+            "outline": outline,
+            "chunks": chunks,
+            "created_at": time.time()
+        }
+
+    def build(self, summarizer: Optional[Callable[[str, List[Dict[str, Any]]], str]] = None,
+              force: bool = False, max_sections: int = 200,
+              token_counter: Optional[Callable[[str], Optional[int]]] = None) -> Dict[str, int]:
+        """
+        Индексирует все файлы user_files. Файл с уже известным содержимым
+        (тот же sha256) повторно не обрабатывается, даже если его переименовали.
+
+        Returns:
+            Счетчики: built, cached, failed, removed
+        """
+        with self._locked():
+            return self._build(summarizer, force, max_sections, token_counter)
+
+    def _build(self, summarizer: Optional[Callable[[str, List[Dict[str, Any]]], str]],
+               force: bool, max_sections: int,
+               token_counter: Optional[Callable[[str], Optional[int]]]) -> Dict[str, int]:
+        old_manifest = self.load_manifest()
+        manifest = {}
+        counts = {"built": 0, "cached": 0, "failed": 0, "removed": 0}
+
+        for file_path in sorted(self.user_files_dir.rglob("*")):
+            if not file_path.is_file() or is_hidden(file_path.relative_to(self.user_files_dir)):
+                continue
+            if file_path.suffix.lower() not in FileProcessor.PROCESSORS:
+                continue
+
+            relative = self._relative(file_path)
+            stat = file_path.stat()
+            old = old_manifest.get(relative)
+            if old and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+                content_hash = old["sha256"]
+            else:
+                content_hash = file_sha256(file_path)
+
+            artifact_path = self._artifact_path(content_hash)
+            if not force and self._is_current(artifact_path, content_hash):
+                counts["cached"] += 1
+                if not self._terms_path(content_hash).exists():
+                    # Индекс собран до появления термов: досчитываются без пересборки артефакта
+                    try:
+                        self._backfill_terms(file_path, content_hash)
+                    except Exception:
+                        logger.exception(f"Не удалось посчитать термы {relative}")
+            else:
+                try:
+                    artifact = self.build_artifact(file_path, content_hash, summarizer, max_sections, token_counter)
+                except Exception:
+                    logger.exception(f"Не удалось проиндексировать {relative}")
+                    counts["failed"] += 1
+                    continue
+                self._write_json(artifact_path, artifact)
+                counts["built"] += 1
+
+            manifest[relative] = {"sha256": content_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+        counts["removed"] = self._remove_orphans(manifest)
+        self._write_json(self.manifest_path, manifest)
+        return counts
+
+    def _backfill_terms(self, file_path: Path, content_hash: str) -> None:
+        artifact = self.artifact(content_hash)
+        lines = self.read_lines(artifact)
+        if lines is None:
+            lines = FileProcessor.process_file(file_path).splitlines()
+        self._write_terms(content_hash, lines, artifact["chunks"])
+
+    def _remove_orphans(self, manifest: Dict[str, Any]) -> int:
+        """Удаляет артефакты и сохраненный текст, на которые больше не ссылается ни один файл"""
+        used = {entry["sha256"] for entry in manifest.values()}
+        removed = 0
+        for artifact_path in self.index_dir.glob("*.json"):
+            # <sha256>.json и <sha256>.terms.json; в счетчике - только артефакты
+            if artifact_path == self.manifest_path or artifact_path.name.split(".")[0] in used:
+                continue
+            artifact_path.unlink(missing_ok=True)
+            if not artifact_path.name.endswith(".terms.json"):
+                removed += 1
+        if self.store is not None:
+            for key in self.store.keys():
+                if key not in used:
+                    self.store.delete(key)
+        return removed
+
+    def forget_missing(self) -> Dict[str, int]:
+        """
+        Убирает из manifest удаленные файлы и их артефакты. Вызывается после
+        удаления файлов, чтобы не ждать следующего запуска build_index.py
+        """
+        with self._locked():
+            manifest = self.load_manifest()
+            kept = {
+                relative: entry for relative, entry in manifest.items()
+                if (self.user_files_dir / relative).is_file()
+            }
+            if len(kept) != len(manifest):
+                self._write_json(self.manifest_path, kept)
+            return {"index_entries": len(manifest) - len(kept), "index_artifacts": self._remove_orphans(kept)}
+
+
+def sections_per_entry(files: int, max_sections: int, max_lines: int) -> Optional[int]:
+    """
+    Разделов оглавления на файл, чтобы описания files файлов уложились в max_lines
+    строк (на файл - краткое содержание, строка фрагментов и строка "... еще").
+    None - бюджета не хватает даже на это, файлы описываются одной строкой
+    """
+    per_file = max_lines // files if files else max_lines
+    if per_file < 3:
+        return None
+    return min(max_sections, per_file - 3)
+
+
+def format_entry_line(artifact: Dict[str, Any], view_path: str) -> str:
+    """Краткое описание файла в той же строке листинга, когда на оглавления нет бюджета"""
+    return f" ({artifact['lines']} строк, {len(artifact['chunks'])} фрагментов: {view_path}#chunks)"
+
+
+def format_entry(artifact: Dict[str, Any], max_sections: int, view_path: str) -> List[str]:
+    """Строки описания файла для листинга директории в MemoryTool.view"""
+    lines = [
+        f"  {artifact['lines']} строк. {artifact['summary']}",
+        f"  {len(artifact['chunks'])} фрагментов, список: {view_path}#chunks"
+    ]
+    outline = artifact["outline"]
+    shown = limit_outline(outline, max_sections)
+    for section in shown:
+        indent = "  " * section["level"]
+        lines.append(f"  {indent}[{section['start_line']}-{section['end_line']}] {section['title']}")
+    if len(outline) > len(shown):
+        lines.append(f"  ... еще {len(outline) - len(shown)} вложенных разделов")
+    return lines
+
+
+class LLMSummarizer:
+    """
+    Краткое содержание файла от модели. Вызовы идут через общий планировщик
+    с приоритетом batch, чтобы индексация не отнимала лимиты у пользователей.
+    """
+
+    PROMPT = (
+        "Ниже оглавление и начало файла пользователя. Напиши краткое содержание файла "
+        "на русском языке в 2-3 предложениях: что за данные, какой период и объем, "
+        "какие вопросы по нему можно решить. Только текст содержания, без вступлений.\n\n"
+        "Оглавление:\n{outline}\n\nНачало файла:\n{head}"
+    )
+
+    def __init__(self, client: Any, model: str, scheduler: Any, head_chars: int = 12000, max_tokens: int = 400):
+        self.client = client
+        self.model = model
+        self.scheduler = scheduler
+        self.head_chars = head_chars
+        self.max_tokens = max_tokens
+
+    def __call__(self, content: str, outline: List[Dict[str, Any]]) -> str:
+        outline_text = "\n".join(
+            f"{'  ' * (section['level'] - 1)}{section['title']} (строки {section['start_line']}-{section['end_line']})"
+            for section in outline[:100]
+        ) or "(нет заголовков)"
+        prompt = self.PROMPT.format(outline=outline_text, head=content[:self.head_chars])
+
+        estimated_input = len(prompt) // 3 + 1
+        self.scheduler.acquire("batch", estimated_input)
+        message = self.client.messages.create(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        self.scheduler.settle(estimated_input, message.usage.input_tokens, message.usage.output_tokens)
+        return "".join(block.text for block in message.content if block.type == "text").strip()
+
+
+class TokenCounter:
+    """
+    Точное число токенов текста файла через count_tokens API. Считается один раз
+    на содержимое при индексации и используется маршрутизацией запросов.
+    При ошибке возвращает None - в артефакт попадает оценка по размеру
+    """
+
+    def __init__(self, client: Any, model: str):
+        self.client = client
+        self.model = model
+
+    def __call__(self, content: str) -> Optional[int]:
+        try:
+            result = self.client.messages.count_tokens(
+                model=self.model,
+                messages=[{"role": "user", "content": content}]
+            )
+        except Exception as e:
+            logger.warning(f"count_tokens не выполнен, используется оценка: {e}")
+            return None
+        return result.input_tokens
@@ -1,16 +1,71 @@
 import json
 import csv
+import re
+import time
+import zipfile
+import importlib
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import Union, List, Dict, Any
-import PyPDF2
-import pandas as pd
-from docx import Document
+from typing import Union, List, Dict, Any, Iterable, Iterator, Optional
+from services import metrics, tracing
+
+
+# Пространство имен WordprocessingML в word/document.xml
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Надпись (text box) в mc:AlternateContent записана дважды: в Choice и в Fallback
+MC = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+# Стили заголовков: Heading1, heading 2, Заголовок1 (id стиля зависит от языка шаблона)
+HEADING_STYLE_RE = re.compile(r"^(?:heading|заголовок)\s?(\d)$", re.IGNORECASE)
 
 
 class FileProcessor:
     """Класс для обработки различных типов файлов"""
 
+    # Расширение -> имя метода чтения
+    PROCESSORS = {
+        '.json': 'read_json',
+        '.txt': 'read_txt',
+        '.xml': 'read_xml',
+        '.pdf': 'read_pdf',
+        '.csv': 'read_csv',
+        '.xlsx': 'read_excel',
+        '.xls': 'read_excel',
+        '.docx': 'read_docx_xml',
+    }
+
+    # Тяжелые библиотеки загружаются при первом чтении файла своего формата:
+    # воркеры gunicorn, которые видят только .txt и .json, их не импортируют.
+    # DOCX читается из XML пакета без python-docx (read_docx_xml)
+    BACKENDS = {
+        '.pdf': ('PyPDF2',),
+        '.csv': ('pandas',),
+        '.xlsx': ('pandas', 'openpyxl'),
+        '.xls': ('pandas',),
+    }
+
+    @staticmethod
+    def warm_up(suffixes: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Заранее импортирует библиотеки форматов
+
+        Args:
+            suffixes: Расширения ('.pdf', 'xlsx'); None - все форматы
+
+        Returns:
+            Список импортированных модулей
+        """
+        if suffixes is None:
+            suffixes = FileProcessor.BACKENDS.keys()
+
+        loaded = []
+        for suffix in suffixes:
+            suffix = '.' + suffix.lower().lstrip('.')
+            for module in FileProcessor.BACKENDS.get(suffix, ()):
+                if module not in loaded:
+                    importlib.import_module(module)
+                    loaded.append(module)
+        return loaded
+
     @staticmethod
     def read_json(file_path: Path) -> str:
         """Читает JSON файл и возвращает форматированный текст"""
@@ -71,6 +126,8 @@ class FileProcessor:
     def read_pdf(file_path: Path) -> str:
         """Читает PDF файл и извлекает текст"""
         try:
+            import PyPDF2
+
             text_content = []
             with open(file_path, 'rb') as f:
                 pdf_reader = PyPDF2.PdfReader(f)
@@ -90,6 +147,8 @@ class FileProcessor:
     def read_csv(file_path: Path) -> str:
         """Читает CSV файл и возвращает форматированный текст"""
         try:
+            import pandas as pd
+
             df = pd.read_csv(file_path, encoding='utf-8', on_bad_lines='skip')
 
             data = df.to_dict(orient='records')
@@ -114,6 +173,8 @@ class FileProcessor:
     def read_excel(file_path: Path) -> str:
         """Читает Excel файл и возвращает форматированный текст"""
         try:
+            import pandas as pd
+
             excel_file = pd.ExcelFile(file_path)
             result = {
                 "metadata": {
@@ -144,6 +205,8 @@ class FileProcessor:
     def read_docx(file_path: Path) -> str:
         """Читает DOCX файл и извлекает текст"""
         try:
+            from docx import Document
+
             doc = Document(file_path)
 
             # Извлекаем весь текст из параграфов
@@ -179,6 +242,127 @@ class FileProcessor:
         except Exception as e:
             raise ValueError(f"Ошибка чтения DOCX файла: {str(e)}")
 
+    @staticmethod
+    def _docx_text_elements(element: ET.Element) -> Iterator[ET.Element]:
+        """Потомки абзаца без надписей: их абзацы выводятся отдельными строками"""
+        for child in element:
+            if child.tag == W + "txbxContent":
+                continue
+            yield child
+            yield from FileProcessor._docx_text_elements(child)
+
+    @staticmethod
+    def _docx_paragraph_text(paragraph: ET.Element) -> str:
+        parts = []
+        for element in FileProcessor._docx_text_elements(paragraph):
+            if element.tag == W + "t" and element.text:
+                parts.append(element.text)
+            elif element.tag == W + "tab":
+                parts.append("\t")
+            elif element.tag in (W + "br", W + "cr"):
+                # Одна строка на абзац: номера строк не зависят от переносов внутри абзаца
+                parts.append(" ")
+        return "".join(parts).strip()
+
+    @staticmethod
+    def _docx_heading_level(paragraph: ET.Element) -> Optional[int]:
+        properties = paragraph.find(W + "pPr")
+        if properties is None:
+            return None
+        outline_level = properties.find(W + "outlineLvl")
+        if outline_level is not None:
+            # 0-8 - уровни заголовков, 9 - "основной текст": уровень абзаца важнее стиля.
+            # Нечисловое значение Word тоже читает как основной текст
+            value = outline_level.get(W + "val", "")
+            if not value.isdigit() or int(value) >= 9:
+                return None
+            return int(value) + 1
+        style = properties.find(W + "pStyle")
+        if style is not None:
+            match = HEADING_STYLE_RE.match(style.get(W + "val", ""))
+            if match:
+                return int(match.group(1))
+        return None
+
+    @staticmethod
+    def iter_docx_lines(file_path: Path) -> Iterator[str]:
+        """
+        Строки DOCX в порядке документа, потоково из word/document.xml:
+        абзац - одна строка (заголовки с префиксом "#" по уровню), таблица -
+        маркер "--- Таблица N ---" и строка "| a | b |" на каждую строку таблицы.
+        Объединенная по горизонтали ячейка (gridSpan) выводится один раз и
+        дополняется пустыми ячейками, чтобы столбцы совпадали со строками данных;
+        продолжение вертикального объединения - пустыми ячейками. Абзацы надписей
+        выводятся отдельными строками, копия надписи из mc:Fallback пропускается. Обработанные элементы
+        удаляются из дерева, поэтому память не растет с размером документа.
+        """
+        with zipfile.ZipFile(file_path) as package:
+            with package.open("word/document.xml") as document:
+                body = None
+                table_depth = 0
+                fallback_depth = 0
+                table_number = 0
+                row: List[str] = []
+                cell: List[str] = []
+                for event, element in ET.iterparse(document, events=("start", "end")):
+                    tag = element.tag
+                    if event == "start":
+                        if tag == W + "body":
+                            body = element
+                        elif tag == W + "tbl":
+                            table_depth += 1
+                            if table_depth == 1:
+                                table_number += 1
+                                yield f"--- Таблица {table_number} ---"
+                        elif tag == MC + "Fallback":
+                            fallback_depth += 1
+                        continue
+
+                    if tag == MC + "Fallback":
+                        fallback_depth -= 1
+                    elif fallback_depth:
+                        pass
+                    elif tag == W + "p":
+                        # Абзацы вложенных таблиц входят в текст внешней ячейки
+                        if table_depth == 0:
+                            text = FileProcessor._docx_paragraph_text(element)
+                            if text:
+                                level = FileProcessor._docx_heading_level(element)
+                                yield f"{'#' * min(level, 6)} {text}" if level else text
+                        else:
+                            text = FileProcessor._docx_paragraph_text(element)
+                            if text:
+                                cell.append(text)
+                    elif tag == W + "tc" and table_depth == 1:
+                        merge = element.find(f"{W}tcPr/{W}vMerge")
+                        continued = merge is not None and merge.get(W + "val") != "restart"
+                        grid_span = element.find(f"{W}tcPr/{W}gridSpan")
+                        span = int(grid_span.get(W + "val", "1")) if grid_span is not None else 1
+                        row.append("" if continued else " ".join(cell).replace("|", "/"))
+                        row.extend([""] * (span - 1))
+                        cell = []
+                    elif tag == W + "tr" and table_depth == 1:
+                        if any(row):
+                            yield "| " + " | ".join(row) + " |"
+                        row = []
+                        element.clear()
+                    elif tag == W + "tbl":
+                        table_depth -= 1
+                        if table_depth == 0:
+                            yield ""
+
+                    # Обработанный элемент верхнего уровня больше не нужен
+                    if body is not None and table_depth == 0 and tag in (W + "p", W + "tbl", W + "sectPr"):
+                        body.clear()
+
+    @staticmethod
+    def read_docx_xml(file_path: Path) -> str:
+        """Читает DOCX напрямую из XML пакета: абзацы и таблицы в порядке документа"""
+        try:
+            return "\n".join(FileProcessor.iter_docx_lines(file_path))
+        except Exception as e:
+            raise ValueError(f"Ошибка чтения DOCX файла: {str(e)}")
+
     @staticmethod
     def process_file(file_path: Path) -> str:
         """
@@ -192,22 +376,23 @@ class FileProcessor:
         """
         suffix = file_path.suffix.lower()
 
-        processors = {
-            '.json': FileProcessor.read_json,
-            '.txt': FileProcessor.read_txt,
-            '.xml': FileProcessor.read_xml,
-            '.pdf': FileProcessor.read_pdf,
-            '.csv': FileProcessor.read_csv,
-            '.xlsx': FileProcessor.read_excel,
-            '.xls': FileProcessor.read_excel,
-            '.docx': FileProcessor.read_docx,
-        }
-
-        processor = processors.get(suffix)
-        if not processor:
+        processor_name = FileProcessor.PROCESSORS.get(suffix)
+        if not processor_name:
             raise ValueError(f"Неподдерживаемый тип файла: {suffix}")
 
-        return processor(file_path)
+        processor = getattr(FileProcessor, processor_name)
+        file_format = suffix.lstrip('.')
+        start = time.perf_counter()
+        with metrics.timed(metrics.FILE_READ_SECONDS, format=file_format):
+            content = processor(file_path)
+        elapsed = time.perf_counter() - start
+
+        size = file_path.stat().st_size
+        metrics.FILE_READ_BYTES.labels(format=file_format).inc(size)
+        trace = tracing.current()
+        if trace is not None:
+            trace.add_file_read(file_format, size, elapsed, len(content))
+        return content
 
     @staticmethod
     def get_file_info(file_path: Path) -> Dict[str, Any]:
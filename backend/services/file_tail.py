@@ -0,0 +1,155 @@
+import codecs
+import fcntl
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterator, Optional
+
+
+# Сколько последних отправленных байт сверяется с файлом: MemoryTool.create и
+# str_replace переписывают файл целиком, и дописанный "хвост" может оказаться
+# другим текстом той же длины
+CHECK_BYTES = 256
+
+
+class ActiveQueries:
+    """
+    Запросы, выполняющиеся сейчас во всех воркерах: каждый держит fcntl
+    блокировку своего файла в state_dir. Блокировка снимается и при падении
+    воркера, поэтому оставшийся файл не считается активным запросом
+    (и не удаляется здесь: его мог только что создать новый запрос)
+    """
+
+    def __init__(self, state_dir: Path):
+        self.state_dir = Path(state_dir)
+
+    @contextmanager
+    def hold(self, query_id: str) -> Iterator[None]:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self.state_dir / f"{query_id}.lock"
+        with open(path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                path.unlink(missing_ok=True)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def any_active(self) -> bool:
+        try:
+            paths = list(self.state_dir.iterdir())
+        except FileNotFoundError:
+            return False
+        for path in paths:
+            try:
+                with open(path, "r") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            except BlockingIOError:
+                return True
+            except FileNotFoundError:
+                continue
+        return False
+
+
+class StreamSlots:
+    """
+    Ограничение одновременных tail стримов на все воркеры: стрим держит sync
+    воркер gunicorn, и без ограничения открытые просмотры заняли бы все воркеры.
+    Слот - fcntl блокировка одного из limit файлов
+    """
+
+    def __init__(self, slots_dir: Path, limit: int):
+        self.slots_dir = Path(slots_dir)
+        self.limit = limit
+
+    def acquire(self) -> Optional[IO]:
+        """Открытый файл занятого слота; None - все слоты заняты"""
+        self.slots_dir.mkdir(parents=True, exist_ok=True)
+        for index in range(self.limit):
+            slot = open(self.slots_dir / f"slot-{index}.lock", "w")
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        return None
+
+    @staticmethod
+    def release(slot: IO) -> None:
+        if not slot.closed:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+            slot.close()
+
+
+def tail_file(file_path: Path, offset: int = 0, poll_interval: float = 0.5, idle_timeout: float = 60.0,
+              max_seconds: float = 600.0, chunk_bytes: int = 256 * 1024,
+              is_writing: Optional[Callable[[], bool]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    События дописанного в файл текста, пока модель его пишет.
+
+    offset - байтовое смещение, с которого продолжить (next_offset прошлого
+    события при переподключении). Байты отдаются только целыми символами UTF-8.
+    is_writing - выполняется ли сейчас какой-нибудь запрос: если нет и файл
+    дочитан, стрим завершается сразу, не дожидаясь idle_timeout.
+
+    События:
+        {"type": "append", "text", "next_offset"}
+        {"type": "reset", "size"}  - файл переписан не дописыванием, текст заново с 0
+        {"type": "end", "reason": "finished" | "idle" | "timeout" | "deleted", "next_offset"}
+    """
+    started = time.monotonic()
+    last_change = started
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    sent_tail = b""
+    last_signature = None
+
+    if offset:
+        try:
+            with open(file_path, "rb") as f:
+                f.seek(max(offset - CHECK_BYTES, 0))
+                sent_tail = f.read(min(offset, CHECK_BYTES))
+        except OSError:
+            pass
+
+    while True:
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            yield {"type": "end", "reason": "deleted", "next_offset": offset}
+            return
+
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if signature != last_signature:
+            last_signature = signature
+            with open(file_path, "rb") as f:
+                f.seek(max(offset - len(sent_tail), 0))
+                if stat.st_size < offset or f.read(len(sent_tail)) != sent_tail:
+                    yield {"type": "reset", "size": stat.st_size}
+                    offset, sent_tail = 0, b""
+                    decoder.reset()
+                    f.seek(0)
+
+                while True:
+                    data = f.read(chunk_bytes)
+                    if not data:
+                        break
+                    # Незаконченный символ UTF-8 остается в декодере до следующего чтения
+                    text = decoder.decode(data)
+                    offset += len(data)
+                    sent_tail = (sent_tail + data)[-CHECK_BYTES:]
+                    if text:
+                        yield {"type": "append", "text": text, "next_offset": offset - len(decoder.getstate()[0])}
+            last_change = time.monotonic()
+        elif is_writing is not None and not is_writing():
+            yield {"type": "end", "reason": "finished", "next_offset": offset - len(decoder.getstate()[0])}
+            return
+
+        now = time.monotonic()
+        if now - last_change >= idle_timeout:
+            yield {"type": "end", "reason": "idle", "next_offset": offset - len(decoder.getstate()[0])}
+            return
+        if now - started >= max_seconds:
+            yield {"type": "end", "reason": "timeout", "next_offset": offset - len(decoder.getstate()[0])}
+            return
+        time.sleep(poll_interval)
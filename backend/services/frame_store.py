@@ -0,0 +1,241 @@
+import bisect
+import json
+import logging
+import struct
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import zstandard
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Хвост файла: длина индекса кадров и сигнатура формата
+FOOTER = struct.Struct("<Q8s")
+MAGIC = b"ZFRAMES1"
+
+
+class FrameStore:
+    """
+    Извлеченный текст файлов в сжатом виде: строки режутся на независимые
+    zstd кадры по ~frame_bytes, за ними в том же файле - индекс кадров (смещение,
+    размер, первая строка, id словаря). Чтение диапазона строк распаковывает
+    только нужные кадры.
+
+    Кадры и индекс публикуются одним os.replace, а читатель берет и индекс, и
+    кадры из одного открытого файла: перезапись ключа (--force, train_dictionary)
+    во время чтения не может смешать новые кадры со старыми смещениями.
+
+    Кадры сжимаются со словарем, обученным на корпусе (train_dictionary):
+    у коротких кадров одного корпуса общие ключи JSON и лексика, без словаря
+    каждый кадр начинает сжатие с нуля. Словари хранятся по id, чтобы
+    артефакты со старым словарем читались после переобучения.
+    """
+
+    def __init__(self, store_dir: Path, frame_bytes: int = 64 * 1024, level: int = 3, dict_size: int = 112640):
+        self.store_dir = Path(store_dir)
+        self.dicts_dir = self.store_dir / "dicts"
+        self.frame_bytes = frame_bytes
+        self.level = level
+        self.dict_size = dict_size
+        self._dicts: Dict[int, zstandard.ZstdCompressionDict] = {}
+
+    def _data_path(self, key: str) -> Path:
+        return self.store_dir / f"{key}.zfr"
+
+    def _legacy_paths(self, key: str) -> List[Path]:
+        """Прежний формат: кадры и индекс в отдельных файлах. Такие ключи пересобираются"""
+        return [self.store_dir / f"{key}.zst", self.store_dir / f"{key}.frames.json"]
+
+    @staticmethod
+    def _read_index(f) -> Dict[str, Any]:
+        f.seek(-FOOTER.size, 2)
+        index_size, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError("Неизвестный формат файла кадров")
+        f.seek(-FOOTER.size - index_size, 2)
+        return json.loads(f.read(index_size).decode("utf-8"))
+
+    def _index(self, key: str) -> Dict[str, Any]:
+        with open(self._data_path(key), "rb") as f:
+            return self._read_index(f)
+
+    def _load_dict(self, dict_id: int) -> Optional[zstandard.ZstdCompressionDict]:
+        if not dict_id:
+            return None
+        if dict_id not in self._dicts:
+            data = (self.dicts_dir / f"{dict_id}.zdict").read_bytes()
+            self._dicts[dict_id] = zstandard.ZstdCompressionDict(data)
+        return self._dicts[dict_id]
+
+    def current_dict_id(self) -> int:
+        try:
+            return int((self.dicts_dir / "current").read_text())
+        except (OSError, ValueError):
+            return 0
+
+    def has(self, key: str) -> bool:
+        return self._data_path(key).exists()
+
+    def _split_frames(self, lines: List[str]) -> Iterable[List[str]]:
+        frame: List[str] = []
+        size = 0
+        for line in lines:
+            length = len(line.encode("utf-8")) + 1
+            if frame and size + length > self.frame_bytes:
+                yield frame
+                frame, size = [], 0
+            frame.append(line)
+            size += length
+        if frame:
+            yield frame
+
+    def put(self, key: str, lines: List[str]) -> Dict[str, Any]:
+        """Сохраняет строки текста; возвращает индекс кадров"""
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        dict_id = self.current_dict_id()
+        compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self._load_dict(dict_id))
+
+        frames = []
+        offset = 0
+        raw_bytes = 0
+        first_line = 1
+        # Уникальное временное имя: build_index и переобучение словаря могут писать один ключ
+        tmp_path = self.store_dir / f"{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for frame_lines in self._split_frames(lines):
+                    raw = "\n".join(frame_lines).encode("utf-8")
+                    data = compressor.compress(raw)
+                    f.write(data)
+                    frames.append([offset, len(data), first_line, len(frame_lines)])
+                    offset += len(data)
+                    raw_bytes += len(raw)
+                    first_line += len(frame_lines)
+
+                index = {
+                    "lines": len(lines),
+                    "raw_bytes": raw_bytes,
+                    "stored_bytes": offset,
+                    "dict_id": dict_id,
+                    "frames": frames
+                }
+                encoded = json.dumps(index).encode("utf-8")
+                f.write(encoded)
+                f.write(FOOTER.pack(len(encoded), MAGIC))
+            tmp_path.replace(self._data_path(key))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        for path in self._legacy_paths(key):
+            path.unlink(missing_ok=True)
+
+        metrics.STORAGE_BYTES.labels(kind="raw").inc(raw_bytes)
+        metrics.STORAGE_BYTES.labels(kind="stored").inc(offset)
+        if offset:
+            metrics.STORAGE_COMPRESSION_RATIO.observe(raw_bytes / offset)
+        return index
+
+    def read_lines(self, key: str, start_line: int = 1, end_line: Optional[int] = None) -> List[str]:
+        """
+        Строки start_line..end_line включительно (с 1, end_line=None - до конца).
+        Распаковываются только кадры, пересекающие диапазон.
+        """
+        start = time.perf_counter()
+        try:
+            lines, decoded = self._read_frames(key, start_line, end_line)
+        except FileNotFoundError:
+            # Старый словарь удален train_dictionary после перезаписи ключа,
+            # новая версия файла уже сжата текущим словарем
+            lines, decoded = self._read_frames(key, start_line, end_line)
+        metrics.STORAGE_DECODE_SECONDS.observe(time.perf_counter() - start)
+        metrics.STORAGE_DECODE_BYTES.inc(decoded)
+        return lines
+
+    def _read_frames(self, key: str, start_line: int, end_line: Optional[int]) -> Tuple[List[str], int]:
+        lines: List[str] = []
+        decoded = 0
+        with open(self._data_path(key), "rb") as f:
+            index = self._read_index(f)
+            frames = index["frames"]
+            end_line = index["lines"] if end_line is None else min(end_line, index["lines"])
+            if not frames or start_line > end_line:
+                return lines, decoded
+
+            first = max(bisect.bisect_right([frame[2] for frame in frames], start_line) - 1, 0)
+            decompressor = zstandard.ZstdDecompressor(dict_data=self._load_dict(index["dict_id"]))
+            for offset, size, frame_first, frame_count in frames[first:]:
+                if frame_first > end_line:
+                    break
+                f.seek(offset)
+                raw = decompressor.decompress(f.read(size))
+                decoded += len(raw)
+                frame_lines = raw.decode("utf-8").split("\n")
+                lo = max(start_line - frame_first, 0)
+                hi = min(end_line - frame_first + 1, frame_count)
+                lines.extend(frame_lines[lo:hi])
+        return lines, decoded
+
+    def delete(self, key: str) -> None:
+        for path in (self._data_path(key), *self._legacy_paths(key)):
+            path.unlink(missing_ok=True)
+
+    def keys(self) -> List[str]:
+        return [path.stem for path in self.store_dir.glob("*.zfr")]
+
+    def train_dictionary(self, samples_per_key: int = 64) -> int:
+        """
+        Обучает словарь на кадрах всех сохраненных артефактов и пересжимает их.
+
+        Returns:
+            id нового словаря; 0, если данных для обучения недостаточно
+        """
+        samples = []
+        for key in self.keys():
+            with open(self._data_path(key), "rb") as f:
+                index = self._read_index(f)
+                decompressor = zstandard.ZstdDecompressor(dict_data=self._load_dict(index["dict_id"]))
+                for offset, size, _, _ in index["frames"][:samples_per_key]:
+                    f.seek(offset)
+                    # Обучение идет на фрагментах размером с типичный запрос диапазона
+                    raw = decompressor.decompress(f.read(size))
+                    samples.extend(raw[i:i + 4096] for i in range(0, len(raw), 4096))
+
+        try:
+            dictionary = zstandard.train_dictionary(self.dict_size, samples, level=self.level)
+        except zstandard.ZstdError as e:
+            logger.warning(f"Словарь zstd не обучен: {e}")
+            return 0
+
+        dict_id = dictionary.dict_id()
+        self.dicts_dir.mkdir(parents=True, exist_ok=True)
+        (self.dicts_dir / f"{dict_id}.zdict").write_bytes(dictionary.as_bytes())
+        tmp_path = self.dicts_dir / f"current.{uuid.uuid4().hex}.tmp"
+        tmp_path.write_text(str(dict_id))
+        tmp_path.replace(self.dicts_dir / "current")
+        self._dicts[dict_id] = dictionary
+
+        for key in self.keys():
+            self.put(key, self.read_lines(key))
+
+        used = {str(dict_id)}
+        for key in self.keys():
+            used.add(str(self._index(key)["dict_id"]))
+        for path in self.dicts_dir.glob("*.zdict"):
+            if path.stem not in used:
+                path.unlink()
+        return dict_id
+
+    def stats(self) -> Dict[str, Any]:
+        raw = stored = 0
+        for key in self.keys():
+            index = self._index(key)
+            raw += index["raw_bytes"]
+            stored += index["stored_bytes"]
+        return {
+            "artifacts": len(self.keys()),
+            "raw_bytes": raw,
+            "stored_bytes": stored,
+            "ratio": round(raw / stored, 2) if stored else 0.0,
+            "dict_id": self.current_dict_id()
+        }
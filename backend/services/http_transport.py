@@ -0,0 +1,260 @@
+import gzip
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+import anthropic
+import httpx
+from services import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# TCP keep-alive как в DefaultHttpxClient SDK: долгие ходы без трафика не должны рваться NAT
+KEEPALIVE_SOCKET_OPTIONS = [
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, True),
+    *[
+        (socket.IPPROTO_TCP, getattr(socket, option), value)
+        for option, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 60), ("TCP_KEEPCNT", 5))
+        if hasattr(socket, option)
+    ],
+]
+
+# События httpcore, по которым видно открытие нового соединения
+CONNECT_EVENTS = {
+    "connection.connect_tcp.started": "tcp",
+    "connection.connect_tcp.complete": "tcp",
+    "connection.start_tls.started": "tls",
+    "connection.start_tls.complete": "tls",
+}
+
+
+class ConnectionStats:
+    """
+    Счетчики переиспользования соединений: сколько запросов ушло по уже открытому
+    соединению, а сколько заплатило за TCP connect и TLS handshake
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = 0
+        self.tcp_connects = 0
+        self.tls_handshakes = 0
+        self.handshake_seconds = 0.0
+
+    def on_request(self) -> None:
+        self._local.connected = False
+        with self._lock:
+            self.requests += 1
+
+    def on_connect(self, kind: str, seconds: float) -> None:
+        self._local.connected = True
+        with self._lock:
+            if kind == "tls":
+                self.tls_handshakes += 1
+            else:
+                self.tcp_connects += 1
+            self.handshake_seconds += seconds
+
+    def last_request_connected(self) -> bool:
+        """Открывал ли последний запрос этого потока новое соединение"""
+        return getattr(self._local, "connected", False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "tcp_connects": self.tcp_connects,
+                "tls_handshakes": self.tls_handshakes,
+                "handshake_seconds": round(self.handshake_seconds, 3),
+                "reuse_ratio": round(1 - self.tcp_connects / self.requests, 3) if self.requests else 0.0
+            }
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """
+    Обертка над HTTPTransport: считает новые соединения через trace extension
+    httpcore и при необходимости сжимает тело запроса gzip
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, stats: ConnectionStats,
+                 compress_min_bytes: Optional[int] = None):
+        self.transport = transport
+        self.stats = stats
+        self.compress_min_bytes = compress_min_bytes
+
+    def _tracer(self):
+        """Callback trace extension httpcore, свой на каждый запрос"""
+        started = {}
+
+        def trace(event: str, info: Dict[str, Any]) -> None:
+            if event in CONNECT_EVENTS:
+                kind = CONNECT_EVENTS[event]
+                if event.endswith(".started"):
+                    started[kind] = time.perf_counter()
+                elif kind in started:
+                    seconds = time.perf_counter() - started.pop(kind)
+                    self.stats.on_connect(kind, seconds)
+                    metrics.HTTP_CLIENT_CONNECTIONS.labels(kind=kind).inc()
+                    metrics.HTTP_CLIENT_HANDSHAKE_SECONDS.labels(kind=kind).observe(seconds)
+
+        return trace
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.on_request()
+        metrics.HTTP_CLIENT_REQUESTS.inc()
+
+        content = request.read()
+        metrics.HTTP_CLIENT_REQUEST_BYTES.labels(kind="raw").inc(len(content))
+        if (
+            self.compress_min_bytes is not None
+            and len(content) >= self.compress_min_bytes
+            and "content-encoding" not in request.headers
+        ):
+            headers = httpx.Headers(request.headers)
+            headers["Content-Encoding"] = "gzip"
+            # Уровень 1: тело в сотни килобайт сжимается за миллисекунды, выигрыш основной
+            content = gzip.compress(content, compresslevel=1)
+            headers["Content-Length"] = str(len(content))
+            request = httpx.Request(
+                request.method, request.url, headers=headers, content=content, extensions=request.extensions
+            )
+        metrics.HTTP_CLIENT_REQUEST_BYTES.labels(kind="sent").inc(len(content))
+
+        request.extensions = {**request.extensions, "trace": self._tracer()}
+        return self.transport.handle_request(request)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+_stats = ConnectionStats()
+_client: Optional[httpx.Client] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_http_client() -> httpx.Client:
+    """HTTP клиент для Anthropic API по настройкам Config.CLAUDE_HTTP_*"""
+    http2 = Config.CLAUDE_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("CLAUDE_HTTP2 включен, но пакет h2 не установлен - используется HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=Config.CLAUDE_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.CLAUDE_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=Config.CLAUDE_HTTP_KEEPALIVE_EXPIRY
+    )
+    transport = InstrumentedTransport(
+        httpx.HTTPTransport(http2=http2, limits=limits, socket_options=KEEPALIVE_SOCKET_OPTIONS),
+        _stats,
+        compress_min_bytes=Config.CLAUDE_HTTP_COMPRESS_MIN_BYTES if Config.CLAUDE_HTTP_COMPRESS else None
+    )
+    return httpx.Client(transport=transport, timeout=turn_timeout(8000), follow_redirects=True)
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Общий пул соединений процесса. Создается заново после fork:
+    сокеты мастера gunicorn не должны достаться воркерам
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = build_http_client()
+            _client_pid = os.getpid()
+        return _client
+
+
+def _turn_seconds(max_tokens: int) -> float:
+    """Базовое время на обработку входа плюс генерация max_tokens при минимально допустимой скорости"""
+    return Config.CLAUDE_TURN_TIMEOUT_BASE + max_tokens / Config.CLAUDE_MIN_OUTPUT_TOKENS_PER_SECOND
+
+
+def streams_turn(max_tokens: int) -> bool:
+    """
+    Ход, который без стрима не укладывается в CLAUDE_TURN_TIMEOUT_MAX, идет стримом:
+    read timeout тогда ограничивает паузу между событиями, а не весь ход
+    """
+    return _turn_seconds(max_tokens) > Config.CLAUDE_TURN_TIMEOUT_MAX
+
+
+def turn_timeout(max_tokens: int) -> httpx.Timeout:
+    """Таймаут одного хода API; у стрима read - пауза между событиями"""
+    if streams_turn(max_tokens):
+        read = Config.CLAUDE_TURN_TIMEOUT_BASE
+    else:
+        read = _turn_seconds(max_tokens)
+    return httpx.Timeout(
+        connect=Config.CLAUDE_HTTP_CONNECT_TIMEOUT,
+        read=read,
+        write=60.0,
+        pool=Config.CLAUDE_HTTP_CONNECT_TIMEOUT
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Повторяемая ошибка хода: сбой соединения или 408/409/429/5xx. Таймаут чтения
+    не повторяется - повтор ждал бы столько же и утроил бы потерянное время
+    """
+    if isinstance(error, anthropic.APITimeoutError):
+        return False
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Пауза, которую просит API (retry-after-ms, retry-after: секунды или HTTP дата)"""
+    if not isinstance(error, anthropic.APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """
+    Пауза перед повтором хода: retry-after из ответа (как в SDK - если не больше
+    минуты), иначе экспоненциальная от 0.5 с до 8 с. Джиттер до +25%: воркеры,
+    получившие 429 одновременно, не повторяют в один момент
+    """
+    delay = _retry_after(error)
+    if delay is None or not 0 <= delay <= 60:
+        delay = min(0.5 * 2 ** attempt, 8.0)
+    return delay * (1 + 0.25 * random.random())
+
+
+def connection_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
+
+
+def last_request_connected() -> bool:
+    return _stats.last_request_connected()
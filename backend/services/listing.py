@@ -0,0 +1,229 @@
+import base64
+import bisect
+import fcntl
+import hashlib
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+
+SORT_KEYS = ("path", "name", "size", "modified")
+
+
+class DirectoryGenerations:
+    """
+    Счетчики поколений директорий, общие для всех воркеров: каждое изменение
+    через API (загрузка, удаление, запись MemoryTool) увеличивает счетчик.
+    ETag листинга строится из поколения, поэтому повторный запрос неизменившегося
+    листинга получает 304 после чтения маленького файла, без обхода директории.
+
+    epoch - случайный id файла состояния: после перезапуска контейнера
+    (/tmp очищен) счетчики начинаются заново, и старые ETag не совпадут.
+    Изменения в обход API (файлы скопированы прямо в том) учитываются через
+    mtime самой директории - только на верхнем уровне.
+    """
+
+    def __init__(self, state_dir: Path):
+        self.state_dir = Path(state_dir)
+
+    @property
+    def state_path(self) -> Path:
+        return self.state_dir / "generations.json"
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.state_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _locked_state(self):
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.state_dir / "generations.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self._read()
+                state.setdefault("epoch", uuid.uuid4().hex[:12])
+                state.setdefault("dirs", {})
+
+                yield state
+
+                tmp_path = self.state_path.with_suffix(".tmp")
+                tmp_path.write_text(json.dumps(state))
+                tmp_path.replace(self.state_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def bump(self, name: str) -> None:
+        with self._locked_state() as state:
+            state["dirs"][name] = state["dirs"].get(name, 0) + 1
+
+    def current(self, name: str, directory: Path) -> str:
+        state = self._read()
+        if "epoch" not in state:
+            with self._locked_state() as state:
+                pass
+        try:
+            mtime_ns = directory.stat().st_mtime_ns
+        except OSError:
+            mtime_ns = 0
+        return f"{state['epoch']}-{state['dirs'].get(name, 0)}-{mtime_ns:x}"
+
+
+@dataclass
+class ListingQuery:
+    prefix: str = ""
+    extensions: Tuple[str, ...] = ()
+    modified_after: Optional[float] = None
+    modified_before: Optional[float] = None
+    sort: str = "path"
+    order: str = "asc"
+    limit: int = 1000
+    cursor: Optional[str] = None
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str], default_sort: str = "path", default_order: str = "asc",
+                  default_limit: int = 1000, max_limit: int = 5000) -> "ListingQuery":
+        """
+        Параметры запроса листинга: prefix, extension (".pdf,json"), modified_after /
+        modified_before (unix time), sort (path|name|size|modified), order (asc|desc),
+        limit, cursor. ValueError - некорректный параметр.
+        """
+        sort = args.get("sort", default_sort)
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Неизвестная сортировка: {sort}. Допустимо: {', '.join(SORT_KEYS)}")
+        order = args.get("order", default_order)
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Неизвестный порядок: {order}. Допустимо: asc, desc")
+
+        limit = int(args.get("limit", default_limit))
+        if not 1 <= limit <= max_limit:
+            raise ValueError(f"limit должен быть от 1 до {max_limit}")
+
+        extensions = tuple(sorted(
+            "." + part.strip().lower().lstrip(".")
+            for part in args.get("extension", "").split(",") if part.strip()
+        ))
+        modified_after = args.get("modified_after")
+        modified_before = args.get("modified_before")
+        return cls(
+            prefix=args.get("prefix", "").lstrip("/"),
+            extensions=extensions,
+            modified_after=float(modified_after) if modified_after else None,
+            modified_before=float(modified_before) if modified_before else None,
+            sort=sort,
+            order=order,
+            limit=limit,
+            cursor=args.get("cursor") or None
+        )
+
+    def fingerprint(self) -> str:
+        data = json.dumps([
+            self.prefix, self.extensions, self.modified_after, self.modified_before,
+            self.sort, self.order, self.limit, self.cursor
+        ])
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_cursor(entry: Dict[str, Any], sort: str) -> str:
+    data = json.dumps([entry[sort], entry["path"]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        value, path = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        raise ValueError("Некорректный cursor") from e
+    return value, path
+
+
+class DirectoryListing:
+    """
+    Листинг директории с фильтрами и курсорной пагинацией. Обход директории
+    кешируется в процессе до смены поколения: страницы одного листинга
+    и повторные запросы с другими фильтрами не обходят файлы заново.
+
+    Курсор - значение ключа сортировки и путь последней записи страницы,
+    поэтому страницы не сдвигаются, если между запросами файлы добавились
+    или удалились.
+    """
+
+    def __init__(self, root: Path, name: str, generations: DirectoryGenerations):
+        self.root = Path(root)
+        self.name = name
+        self.generations = generations
+        self._cache: Tuple[Optional[str], List[Dict[str, Any]]] = (None, [])
+
+    def generation(self) -> str:
+        return self.generations.current(self.name, self.root)
+
+    def etag(self, query: ListingQuery, generation: str) -> str:
+        return f"{generation}-{query.fingerprint()}"
+
+    def _scan(self) -> List[Dict[str, Any]]:
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # Скрытые директории не обходятся - в том числе корзина удаления (.trash)
+            dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+            for name in filenames:
+                if name.startswith("."):
+                    continue
+                file_path = Path(dirpath) / name
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append({
+                    "name": name,
+                    "path": str(file_path.relative_to(self.root)),
+                    "size": stat.st_size,
+                    "modified": stat.st_mtime,
+                    "extension": file_path.suffix
+                })
+        return entries
+
+    def entries(self, generation: str) -> List[Dict[str, Any]]:
+        cached_generation, entries = self._cache
+        if cached_generation != generation:
+            entries = self._scan()
+            self._cache = (generation, entries)
+        return entries
+
+    def page(self, query: ListingQuery, generation: str) -> Dict[str, Any]:
+        """
+        Returns:
+            {"items", "total" (после фильтров), "next_cursor" (None - последняя страница)}
+        """
+        items = [
+            entry for entry in self.entries(generation)
+            if entry["path"].startswith(query.prefix)
+            and (not query.extensions or entry["extension"].lower() in query.extensions)
+            and (query.modified_after is None or entry["modified"] >= query.modified_after)
+            and (query.modified_before is None or entry["modified"] < query.modified_before)
+        ]
+        items.sort(key=lambda entry: (entry[query.sort], entry["path"]))
+        total = len(items)
+
+        keys = [(entry[query.sort], entry["path"]) for entry in items]
+        try:
+            if query.order == "asc":
+                start = bisect.bisect_right(keys, decode_cursor(query.cursor)) if query.cursor else 0
+                page = items[start:start + query.limit]
+                has_more = start + query.limit < total
+            else:
+                end = bisect.bisect_left(keys, decode_cursor(query.cursor)) if query.cursor else total
+                page = items[max(end - query.limit, 0):end][::-1]
+                has_more = end - query.limit > 0
+        except TypeError as e:
+            raise ValueError("cursor получен для другой сортировки") from e
+
+        return {
+            "items": page,
+            "total": total,
+            "next_cursor": encode_cursor(page[-1], query.sort) if page and has_more else None
+        }
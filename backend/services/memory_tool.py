@@ -1,5 +1,6 @@
-from anthropic.lib.tools import BetaAbstractMemoryTool
+from anthropic.lib.tools import BetaAbstractMemoryTool, BetaFunctionToolResultType
 from anthropic.types.beta import (
+    BetaMemoryTool20250818Command,
     BetaMemoryTool20250818ViewCommand,
     BetaMemoryTool20250818CreateCommand,
     BetaMemoryTool20250818DeleteCommand,
@@ -7,9 +8,17 @@ from anthropic.types.beta import (
     BetaMemoryTool20250818RenameCommand,
     BetaMemoryTool20250818StrReplaceCommand,
 )
+import re
+import time
 from typing_extensions import override
 from pathlib import Path
+from typing import List, Optional
 from services.file_processor import FileProcessor
+from services.chunker import chunk_lines
+from services.file_index import FileIndex, format_entry, format_entry_line, sections_per_entry
+from services.listing import DirectoryGenerations
+from services.trash import TRASH_DIR_NAME
+from services import metrics, tracing
 
 
 SYSTEM_PROMPT = """Правила работы с memory tool:
@@ -29,6 +38,9 @@ SYSTEM_PROMPT = """Правила работы с memory tool:
 ### view(path)
 Просматривает содержимое файла или директории.
 ✅ Используй для чтения файлов из /user_files/ и /responses/
+✅ В листинге /user_files/ у проиндексированных файлов есть краткое содержание и оглавление с диапазонами строк [начало-конец]. Читай нужный раздел через view_range, а не весь файл
+✅ view("<файл>#chunks") - список смысловых фрагментов файла (записи, разделы) с идентификаторами и строками; view("<файл>#<id>") или view("<файл>#<id1>,<id2>") - только эти фрагменты
+✅ Если к вопросу приложены <excerpt> - фрагменты, найденные поиском по словам вопроса, - начни с них. Они могут быть неполными: недостающее дочитывай через view по указанным строкам и фрагментам
 
 ### create(path, file_text)
 Создаёт новый файл с содержимым.
@@ -60,17 +72,52 @@ SYSTEM_PROMPT = """Правила работы с memory tool:
 - Во время ответа на запросы используй ТОЛЬКО информацию из контекста, предоставленный пользователем. Если вопрос общий и предполагает использование внешних реесурсов и контекста - ты можешь использовать другие источники.
 """
 
+# "<путь>#chunks" или "<путь>#c1a2b3c4d,c5e6f7a8b": адресация фрагментов файла.
+# Имена файлов сами могут содержать "#", поэтому ссылка распознается только по формату id
+CHUNK_REF_RE = re.compile(r"^(?P<path>.+)#(?P<ref>chunks|c[0-9a-f]{8}(?:-\d+)?(?:,c[0-9a-f]{8}(?:-\d+)?)*)$")
+
+
+def number_lines(lines: list, start_num: int) -> str:
+    return "\n".join(f"{i + start_num:4d}: {line}" for i, line in enumerate(lines))
+
 
 class MemoryTool(BetaAbstractMemoryTool):
-    def __init__(self, user_files_dir: Path, responses_dir: Path):
+    def __init__(self, user_files_dir: Path, responses_dir: Path, file_index: Optional[FileIndex] = None,
+                 listing_sections: int = 40, generations: Optional[DirectoryGenerations] = None,
+                 listing_max_lines: int = 600):
         super().__init__()
         self.user_files_dir = user_files_dir
         self.responses_dir = responses_dir
         self.file_processor = FileProcessor()
+        self.file_index = file_index
+        self.listing_sections = listing_sections
+        self.listing_max_lines = listing_max_lines
+        self.generations = generations
 
         self.user_files_dir.mkdir(parents=True, exist_ok=True)
         self.responses_dir.mkdir(parents=True, exist_ok=True)
 
+    @override
+    def execute(self, command: BetaMemoryTool20250818Command) -> BetaFunctionToolResultType:
+        trace = tracing.current()
+        start = time.perf_counter()
+        try:
+            with metrics.timed(metrics.MEMORY_COMMAND_SECONDS, command=command.command):
+                result = super().execute(command)
+        except Exception as e:
+            if trace is not None:
+                trace.add_command(command, time.perf_counter() - start, error=str(e))
+            raise
+
+        if trace is not None:
+            trace.add_command(command, time.perf_counter() - start, result=result)
+        # Изменять можно только /responses - листинг ответов устарел
+        if command.command != "view" and self.generations is not None:
+            self.generations.bump("responses")
+        if isinstance(result, str):
+            metrics.MEMORY_COMMAND_RESULT_CHARS.labels(command=command.command).inc(len(result))
+        return result
+
     def _validate_path(self, path: str) -> tuple[Path, bool]:
         """
         Валидирует путь и возвращает (full_path, read_only)
@@ -86,6 +133,9 @@ class MemoryTool(BetaAbstractMemoryTool):
         else:
             raise ValueError(f"Путь должен начинаться с /user_files или /responses, получено: {path}")
 
+        if TRASH_DIR_NAME in Path(relative_path).parts:
+            raise ValueError(f"Путь {path} недоступен")
+
         try:
             if read_only:
                 full_path.resolve().relative_to(self.user_files_dir.resolve())
@@ -98,45 +148,112 @@ class MemoryTool(BetaAbstractMemoryTool):
 
     @override
     def view(self, command: BetaMemoryTool20250818ViewCommand) -> str:
-        full_path, _ = self._validate_path(command.path)
+        full_path, read_only = self._validate_path(command.path)
+
+        chunk_ref = CHUNK_REF_RE.match(command.path)
+        if chunk_ref and not full_path.exists():
+            return self._view_chunks(chunk_ref.group("path"), chunk_ref.group("ref"))
 
         if full_path.is_dir():
             items = []
             try:
+                # Оглавления есть только у файлов пользователя, manifest читается один раз на листинг
+                manifest = self.file_index.load_manifest() if self.file_index and read_only else None
+                entries = []
                 for item in sorted(full_path.iterdir()):
                     if item.name.startswith("."):
                         continue
-                    items.append(f"{item.name}/" if item.is_dir() else item.name)
+                    artifact = self.file_index.lookup(item, manifest) if manifest and item.is_file() else None
+                    entries.append((item, artifact))
+
+                # Описания всех файлов делят один бюджет строк, чтобы листинг большой
+                # директории не занял окно контекста
+                sections = sections_per_entry(
+                    sum(1 for _, artifact in entries if artifact is not None),
+                    self.listing_sections, self.listing_max_lines
+                )
+                for item, artifact in entries:
+                    if artifact is None:
+                        items.append(f"- {item.name}/" if item.is_dir() else f"- {item.name}")
+                        continue
+                    view_path = f"{command.path.rstrip('/')}/{item.name}"
+                    if sections is None:
+                        items.append(f"- {item.name}" + format_entry_line(artifact, view_path))
+                    else:
+                        items.append(f"- {item.name}")
+                        items.extend(format_entry(artifact, sections, view_path))
 
                 if not items:
                     return f"Директория: {command.path}\n(пустая)"
 
-                return f"Директория: {command.path}\n" + "\n".join([f"- {item}" for item in items])
+                return f"Директория: {command.path}\n" + "\n".join(items)
             except Exception as e:
                 raise RuntimeError(f"Не удалось прочитать директорию {command.path}: {e}") from e
 
         elif full_path.is_file():
             try:
-                content = self.file_processor.process_file(full_path)
-
-                lines = content.splitlines()
                 view_range = command.view_range
 
                 if view_range:
-                    start_line = max(1, view_range[0]) - 1
-                    end_line = len(lines) if view_range[1] == -1 else view_range[1]
-                    lines = lines[start_line:end_line]
-                    start_num = start_line + 1
+                    start_num = max(1, view_range[0])
+                    end_line = None if view_range[1] == -1 else view_range[1]
                 else:
-                    start_num = 1
+                    start_num, end_line = 1, None
 
-                numbered_lines = [f"{i + start_num:4d}: {line}" for i, line in enumerate(lines)]
-                return "\n".join(numbered_lines)
+                return number_lines(self._read_lines(full_path, read_only, start_num, end_line), start_num)
             except Exception as e:
                 raise RuntimeError(f"Не удалось прочитать файл {command.path}: {e}") from e
         else:
             raise RuntimeError(f"Путь не найден: {command.path}")
 
+    def _view_chunks(self, path: str, ref: str) -> str:
+        """Список фрагментов файла или текст выбранных фрагментов с исходными номерами строк"""
+        full_path, read_only = self._validate_path(path)
+        if not full_path.is_file():
+            raise RuntimeError(f"Путь не найден: {path}")
+
+        # У проиндексированного файла фрагменты и их текст берутся из индекса без разбора файла
+        artifact = self.file_index.lookup(full_path) if self.file_index is not None and read_only else None
+        lines = None
+        if artifact is not None:
+            chunks = artifact["chunks"]
+        else:
+            lines = self.file_processor.process_file(full_path).splitlines()
+            chunks = self.file_index.chunk(lines) if self.file_index is not None and read_only else chunk_lines(lines)
+
+        if ref == "chunks":
+            rows = [f"{chunk['id']} [{chunk['start_line']}-{chunk['end_line']}] {chunk['title']}" for chunk in chunks]
+            return f"Фрагменты {path} ({len(chunks)}), чтение: view {path}#<id>\n" + "\n".join(rows)
+
+        by_id = {chunk["id"]: chunk for chunk in chunks}
+        requested = ref.split(",")
+        missing = [chunk_id for chunk_id in requested if chunk_id not in by_id]
+        if missing:
+            raise ValueError(f"Фрагменты не найдены: {', '.join(missing)}. Список: {path}#chunks")
+
+        parts = []
+        for chunk_id in requested:
+            chunk = by_id[chunk_id]
+            start, end = chunk["start_line"], chunk["end_line"]
+            text_lines = self.file_index.read_lines(artifact, start, end) if artifact is not None else None
+            if text_lines is None:
+                if lines is None:
+                    lines = self.file_processor.process_file(full_path).splitlines()
+                text_lines = lines[start - 1:end]
+            parts.append(f"=== {chunk_id} [{start}-{end}] {chunk['title']} ===\n" + number_lines(text_lines, start))
+        return "\n".join(parts)
+
+    def _read_lines(self, full_path: Path, read_only: bool, start_line: int = 1,
+                    end_line: Optional[int] = None) -> List[str]:
+        """Строки файла start_line..end_line (с 1): из сжатого текста индекса или разбором файла"""
+        if self.file_index is not None and read_only:
+            artifact = self.file_index.lookup(full_path)
+            lines = self.file_index.read_lines(artifact, start_line, end_line) if artifact is not None else None
+            if lines is not None:
+                return lines
+        lines = self.file_processor.process_file(full_path).splitlines()
+        return lines[start_line - 1:end_line]
+
     @override
     def create(self, command: BetaMemoryTool20250818CreateCommand) -> str:
         full_path, read_only = self._validate_path(command.path)
@@ -0,0 +1,293 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Tuple
+from flask import Flask, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+
+# Бакеты подобраны под реальные значения: от миллисекунд (view директории)
+# до десятков минут (полный запрос по большому корпусу)
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30, 60, 120, 300, 600, 1200
+)
+TOKEN_BUCKETS = (
+    1000, 5000, 10000, 25000, 50000, 100000, 250000,
+    500000, 1000000, 2500000, 5000000
+)
+TURN_BUCKETS = (1, 2, 3, 5, 8, 10, 15, 20, 30, 40, 60, 100)
+RATIO_BUCKETS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+
+TOKEN_KINDS = ("input", "output", "cache_read", "cache_creation")
+
+
+# HTTP
+HTTP_REQUEST_SECONDS = Histogram(
+    "claude_memory_http_request_seconds",
+    "Время обработки HTTP запроса",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "claude_memory_http_requests_in_progress",
+    "Количество HTTP запросов в обработке",
+    ["endpoint"],
+    multiprocess_mode="livesum",
+)
+
+# Claude API
+API_TURN_SECONDS = Histogram(
+    "claude_memory_api_turn_seconds",
+    "Длительность одного вызова Messages API",
+    ["model", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+API_TURN_TOKENS = Counter(
+    "claude_memory_api_tokens",
+    "Токены, израсходованные вызовами Messages API",
+    ["model", "kind"],
+)
+
+# HTTP клиент Anthropic API: переиспользование соединений
+HTTP_CLIENT_REQUESTS = Counter(
+    "claude_memory_http_client_requests",
+    "HTTP запросы к Anthropic API",
+)
+HTTP_CLIENT_CONNECTIONS = Counter(
+    "claude_memory_http_client_connections",
+    "Новые соединения с Anthropic API (tcp connect, tls handshake)",
+    ["kind"],
+)
+HTTP_CLIENT_HANDSHAKE_SECONDS = Histogram(
+    "claude_memory_http_client_handshake_seconds",
+    "Время установки соединения с Anthropic API",
+    ["kind"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_CLIENT_REQUEST_BYTES = Counter(
+    "claude_memory_http_client_request_bytes",
+    "Объем тел запросов к Anthropic API до (raw) и после (sent) сжатия",
+    ["kind"],
+)
+
+# Маршрутизация запросов: решение и итоговая длительность по правилу,
+# чтобы подбирать пороги правил по реальной нагрузке
+ROUTING_DECISIONS = Counter(
+    "claude_memory_routing_decisions",
+    "Выбранные правила маршрутизации",
+    ["rule", "model"],
+)
+ROUTED_QUERY_SECONDS = Histogram(
+    "claude_memory_routed_query_seconds",
+    "Полное время запроса по правилу маршрутизации",
+    ["rule", "model", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Поиск фрагментов перед первым вызовом API (services/retrieval.py)
+RETRIEVAL_SECONDS = Histogram(
+    "claude_memory_retrieval_seconds",
+    "Время локального поиска фрагментов для вопроса",
+    buckets=LATENCY_BUCKETS,
+)
+RETRIEVAL_TOKENS = Histogram(
+    "claude_memory_retrieval_tokens",
+    "Токены фрагментов, приложенных к вопросу",
+    buckets=TOKEN_BUCKETS,
+)
+
+# Планировщик вызовов API (общий для воркеров)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "claude_memory_scheduler_wait_seconds",
+    "Ожидание допуска хода API в очереди планировщика",
+    ["priority"],
+    buckets=LATENCY_BUCKETS,
+)
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "claude_memory_scheduler_queue_depth",
+    "Ходы API, ожидающие допуска планировщиком",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+
+# Запросы пользователя (все ходы одного запроса вместе)
+QUERY_SECONDS = Histogram(
+    "claude_memory_query_seconds",
+    "Полное время обработки запроса",
+    ["status"],
+    buckets=LATENCY_BUCKETS,
+)
+QUERY_TOKENS = Histogram(
+    "claude_memory_query_tokens",
+    "Токены на один запрос",
+    ["kind"],
+    buckets=TOKEN_BUCKETS,
+)
+QUERY_TURNS = Histogram(
+    "claude_memory_query_turns",
+    "Количество ходов API на один запрос",
+    buckets=TURN_BUCKETS,
+)
+QUERY_CACHE_HIT_RATIO = Histogram(
+    "claude_memory_query_cache_hit_ratio",
+    "Доля входных токенов, прочитанных из prompt cache",
+    buckets=RATIO_BUCKETS,
+)
+QUERIES_IN_PROGRESS = Gauge(
+    "claude_memory_queries_in_progress",
+    "Глубина очереди: запросы, обрабатываемые прямо сейчас",
+    multiprocess_mode="livesum",
+)
+
+# MemoryTool
+MEMORY_COMMAND_SECONDS = Histogram(
+    "claude_memory_tool_command_seconds",
+    "Время выполнения команды MemoryTool",
+    ["command", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+MEMORY_COMMAND_RESULT_CHARS = Counter(
+    "claude_memory_tool_result_chars",
+    "Размер результатов команд MemoryTool в символах",
+    ["command"],
+)
+
+# FileProcessor
+FILE_READ_SECONDS = Histogram(
+    "claude_memory_file_read_seconds",
+    "Время чтения файла FileProcessor",
+    ["format", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+FILE_READ_BYTES = Counter(
+    "claude_memory_file_read_bytes",
+    "Объем прочитанных исходных файлов в байтах",
+    ["format"],
+)
+
+# Сжатый текст файлов в индексе (FrameStore)
+COMPRESSION_RATIO_BUCKETS = (1, 1.5, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30)
+STORAGE_BYTES = Counter(
+    "claude_memory_storage_bytes",
+    "Объем записанного текста до (raw) и после (stored) сжатия zstd",
+    ["kind"],
+)
+STORAGE_COMPRESSION_RATIO = Histogram(
+    "claude_memory_storage_compression_ratio",
+    "Степень сжатия текста одного файла",
+    buckets=COMPRESSION_RATIO_BUCKETS,
+)
+STORAGE_DECODE_SECONDS = Histogram(
+    "claude_memory_storage_decode_seconds",
+    "Время распаковки кадров при чтении диапазона строк",
+    buckets=LATENCY_BUCKETS,
+)
+STORAGE_DECODE_BYTES = Counter(
+    "claude_memory_storage_decode_bytes",
+    "Объем распакованных кадров в байтах",
+)
+
+
+def is_multiprocess() -> bool:
+    """Gunicorn выставляет PROMETHEUS_MULTIPROC_DIR, dev-сервер работает в одном процессе"""
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def render() -> Tuple[bytes, str]:
+    """Метрики в текстовом формате Prometheus, агрегированные по всем воркерам"""
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Вызывается из gunicorn child_exit, чтобы livesum-метрики не учитывали мертвый воркер"""
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str):
+    """
+    Измеряет длительность блока и пишет ее в гистограмму.
+    Метка status выставляется в ok/error автоматически.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        histogram.labels(status=status, **labels).observe(time.perf_counter() - start)
+
+
+def usage_tokens(usage: Any) -> Dict[str, int]:
+    """Токены из объекта usage ответа Messages API"""
+    if usage is None:
+        return {kind: 0 for kind in TOKEN_KINDS}
+    return {
+        "input": usage.input_tokens or 0,
+        "output": usage.output_tokens or 0,
+        "cache_read": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_creation": getattr(usage, "cache_creation_input_tokens", None) or 0,
+    }
+
+
+def observe_api_turn(model: str, seconds: float, status: str, tokens: Dict[str, int]) -> None:
+    API_TURN_SECONDS.labels(model=model, status=status).observe(seconds)
+    for kind, value in tokens.items():
+        if value:
+            API_TURN_TOKENS.labels(model=model, kind=kind).inc(value)
+
+
+def cache_hit_ratio(tokens: Dict[str, int]) -> float:
+    total_input = tokens["input"] + tokens["cache_read"] + tokens["cache_creation"]
+    return tokens["cache_read"] / total_input if total_input else 0.0
+
+
+def observe_query(seconds: float, status: str, turns: int, tokens: Dict[str, int]) -> None:
+    QUERY_SECONDS.labels(status=status).observe(seconds)
+    QUERY_TURNS.observe(turns)
+    for kind, value in tokens.items():
+        QUERY_TOKENS.labels(kind=kind).observe(value)
+    QUERY_CACHE_HIT_RATIO.observe(cache_hit_ratio(tokens))
+
+
+def init_app(app: Flask) -> None:
+    """Подключает измерение длительности всех HTTP запросов приложения"""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUESTS_IN_PROGRESS.labels(endpoint=g.metrics_endpoint).inc()
+
+    @app.after_request
+    def _record_request(response):
+        # Для SSE ответов учитывается время до начала стрима,
+        # полное время запроса к Claude видно в claude_memory_query_seconds
+        start = g.pop("metrics_start", None)
+        endpoint = g.pop("metrics_endpoint", None)
+        if start is not None:
+            HTTP_REQUEST_SECONDS.labels(
+                method=request.method,
+                endpoint=endpoint,
+                status=str(response.status_code),
+            ).observe(time.perf_counter() - start)
+            HTTP_REQUESTS_IN_PROGRESS.labels(endpoint=endpoint).dec()
+        return response
@@ -0,0 +1,172 @@
+import logging
+import math
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from services.chunker import terms
+from services.file_index import FileIndex
+from services.file_processor import FileProcessor
+from services.listing import DirectoryListing
+from services.memory_tool import number_lines
+from services.sessions import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Параметры BM25
+K1 = 1.2
+B = 0.75
+
+EXCERPTS_HEADER = (
+    "Фрагменты файлов, найденные локальным поиском по словам вопроса. Это не полный текст "
+    "и не обязательно все нужное: номера строк - как в view, остальное читай через memory."
+)
+
+
+def format_excerpts(excerpts: List[Dict[str, Any]]) -> str:
+    """Текст блока с фрагментами для первого сообщения запроса"""
+    parts = [EXCERPTS_HEADER]
+    for excerpt in excerpts:
+        parts.append(
+            f'<excerpt path="{excerpt["path"]}" lines="{excerpt["start_line"]}-{excerpt["end_line"]}" '
+            f'chunk="{excerpt["chunk"]}">\n{excerpt["text"]}\n</excerpt>'
+        )
+    return "\n\n".join(parts)
+
+
+class Retriever:
+    """
+    Локальный лексический поиск (BM25) по фрагментам проиндексированных файлов
+    user_files до первого вызова API: вопрос сразу приходит с подходящими
+    фрагментами, и модели не нужны ходы на обход директорий, чтобы их найти.
+
+    Термы фрагментов считает build_index.py (артефакт <sha256>.terms.json), воркер
+    только загружает их - один раз на содержимое файла; статистика корпуса
+    пересчитывается при смене поколения user_files или manifest индекса. Файлы
+    без индекса не участвуют - их модель читает как раньше
+    """
+
+    def __init__(self, listing: DirectoryListing, file_index: FileIndex,
+                 budget_tokens: int = 6000, top_k: int = 8):
+        self.listing = listing
+        self.file_index = file_index
+        self.budget_tokens = budget_tokens
+        self.top_k = top_k
+        self._version = None
+        self._chunk_terms: Dict[str, List[Dict[str, int]]] = {}
+        self._docs: List[Dict[str, Any]] = []
+        self._postings: Dict[str, List[tuple]] = {}
+        self._average_length = 0.0
+
+    def _file_lines(self, relative: str, artifact: Dict[str, Any], start_line: int = 1,
+                    end_line: Optional[int] = None) -> List[str]:
+        """Строки из сохраненного текста (только нужные кадры), без него - разбор исходного файла"""
+        lines = self.file_index.read_lines(artifact, start_line, end_line)
+        if lines is None:
+            lines = FileProcessor.process_file(self.listing.root / relative).splitlines()[start_line - 1:end_line]
+        return lines
+
+    def _refresh(self) -> None:
+        generation = self.listing.generation()
+        # Индексация не меняет поколение user_files, но добавляет фрагменты
+        version = (generation, self.file_index.manifest_version())
+        if version == self._version:
+            return
+
+        manifest = self.file_index.load_manifest()
+        docs = []
+        used = set()
+        for entry in self.listing.entries(generation):
+            relative = Path(entry["path"]).as_posix()
+            manifest_entry = manifest.get(relative)
+            # Размер не совпал - файл изменен после индексации, строки артефакта неверны
+            if manifest_entry is None or manifest_entry["size"] != entry["size"]:
+                continue
+            content_hash = manifest_entry["sha256"]
+            artifact = self.file_index.artifact(content_hash)
+            if artifact is None:
+                continue
+            if content_hash not in self._chunk_terms:
+                chunk_terms = self.file_index.chunk_terms(content_hash)
+                # Нет термов или они от другой сборки фрагментов - файл ждет build_index.py
+                if chunk_terms is None or len(chunk_terms) != len(artifact["chunks"]):
+                    continue
+                self._chunk_terms[content_hash] = chunk_terms
+            used.add(content_hash)
+            for chunk, chunk_terms in zip(artifact["chunks"], self._chunk_terms[content_hash]):
+                docs.append({
+                    "relative": relative,
+                    "artifact": artifact,
+                    "chunk": chunk,
+                    "terms": chunk_terms,
+                    "length": sum(chunk_terms.values())
+                })
+
+        postings: Dict[str, List[tuple]] = {}
+        for doc_index, doc in enumerate(docs):
+            for term, frequency in doc["terms"].items():
+                postings.setdefault(term, []).append((doc_index, frequency))
+
+        for content_hash in set(self._chunk_terms) - used:
+            del self._chunk_terms[content_hash]
+        self._docs = docs
+        self._postings = postings
+        self._average_length = sum(doc["length"] for doc in docs) / len(docs) if docs else 0.0
+        self._version = version
+
+    def _rank(self, query: str) -> List[tuple]:
+        scores: Dict[int, float] = {}
+        total = len(self._docs)
+        for term in set(terms(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, frequency in postings:
+                length_norm = 1 - B + B * self._docs[doc_index]["length"] / self._average_length
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * frequency * (K1 + 1) / (frequency + K1 * length_norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:self.top_k]
+
+    def search(self, query: str) -> Dict[str, Any]:
+        """
+        Returns:
+            {"excerpts": [{"path", "start_line", "end_line", "chunk", "score", "text"}],
+             "tokens", "chunks", "seconds"} - фрагменты по убыванию релевантности
+             в пределах budget_tokens; фрагмент, не влезающий целиком, обрезается по строкам
+        """
+        start = time.perf_counter()
+        self._refresh()
+
+        excerpts = []
+        remaining = self.budget_tokens
+        for doc_index, score in self._rank(query):
+            doc = self._docs[doc_index]
+            chunk = doc["chunk"]
+            lines = self._file_lines(doc["relative"], doc["artifact"], chunk["start_line"], chunk["end_line"])
+            # Строки добавляются, пока фрагмент помещается в оставшийся бюджет;
+            # +2 токена - номер строки
+            taken = 0
+            for line in lines:
+                cost = estimate_tokens(line) + 2
+                if cost > remaining:
+                    break
+                remaining -= cost
+                taken += 1
+            if taken == 0:
+                break
+            excerpts.append({
+                "path": f"/user_files/{doc['relative']}",
+                "start_line": chunk["start_line"],
+                "end_line": chunk["start_line"] + taken - 1,
+                "chunk": chunk["id"],
+                "score": round(score, 3),
+                "text": number_lines(lines[:taken], chunk["start_line"])
+            })
+            if taken < len(lines):
+                break
+
+        return {
+            "excerpts": excerpts,
+            "tokens": self.budget_tokens - remaining,
+            "chunks": len(self._docs),
+            "seconds": round(time.perf_counter() - start, 4)
+        }
@@ -0,0 +1,178 @@
+import json
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from services.file_index import FileIndex
+from services.listing import DirectoryListing
+
+
+# Условия правила: все заданные должны выполняться
+CONDITIONS = {
+    "min_corpus_tokens", "max_corpus_tokens",
+    "min_context_tokens", "max_context_tokens",
+    "min_query_chars", "max_query_chars",
+    "query_pattern", "priority"
+}
+# Что правило задает; не заданное берется из Config
+OUTPUTS = {"model", "max_tokens", "betas"}
+
+# Без правил - модель, max_tokens и беты из Config для всех запросов.
+# Пример правил: routing_rules.example.json
+DEFAULT_RULES: List[Dict[str, Any]] = []
+
+# Окно контекста без беты 1M. Модель дочитывает файлы в диалог, поэтому правило,
+# убирающее бету, применяется, только если корпус, контекст и ответ помещаются в окно
+STANDARD_CONTEXT_TOKENS = 200000
+LONG_CONTEXT_BETA = "context-1m-2025-08-07"
+
+# Байт на токен для файлов без индекса: с запасом, чтобы не занизить корпус
+UNINDEXED_BYTES_PER_TOKEN = 4
+
+
+def load_rules(path: Optional[Path]) -> List[Dict[str, Any]]:
+    """
+    Правила из JSON файла: [{"name", "when": {...}, "model", "max_tokens", "betas"}].
+    Применяется первое подходящее правило. ValueError - ошибка в правилах
+    """
+    if path is None:
+        return DEFAULT_RULES
+    rules = json.loads(Path(path).read_text(encoding="utf-8"))
+    if not isinstance(rules, list):
+        raise ValueError("Правила маршрутизации должны быть списком")
+    for index, rule in enumerate(rules):
+        name = rule.get("name") or f"rule-{index + 1}"
+        unknown = set(rule.get("when", {})) - CONDITIONS
+        if unknown:
+            raise ValueError(f"Правило {name}: неизвестные условия {', '.join(sorted(unknown))}")
+        unknown = set(rule) - OUTPUTS - {"name", "when"}
+        if unknown:
+            raise ValueError(f"Правило {name}: неизвестные поля {', '.join(sorted(unknown))}")
+        if "query_pattern" in rule.get("when", {}):
+            re.compile(rule["when"]["query_pattern"])
+        rule["name"] = name
+    return rules
+
+
+class CorpusEstimator:
+    """
+    Размер корпуса user_files в токенах: у проиндексированных файлов - число токенов
+    из артефакта индекса (посчитано один раз на содержимое), у остальных - по размеру.
+    Пересчитывается при смене поколения user_files или manifest индекса
+    """
+
+    def __init__(self, listing: DirectoryListing, file_index: Optional[FileIndex]):
+        self.listing = listing
+        self.file_index = file_index
+        self._cache: tuple = (None, {})
+        self._artifact_tokens: Dict[str, int] = {}
+
+    def estimate(self) -> Dict[str, int]:
+        generation = self.listing.generation()
+        # Индексация не меняет поколение user_files, но меняет токены файлов
+        version = (generation, self.file_index.manifest_version() if self.file_index is not None else None)
+        cached_version, result = self._cache
+        if cached_version == version:
+            return result
+
+        manifest = self.file_index.load_manifest() if self.file_index is not None else {}
+        tokens = indexed = 0
+        entries = self.listing.entries(generation)
+        for entry in entries:
+            relative = Path(entry["path"]).as_posix()
+            manifest_entry = manifest.get(relative)
+            artifact_tokens = None
+            if manifest_entry is not None and manifest_entry["size"] == entry["size"]:
+                artifact_tokens = self._tokens_of(manifest_entry["sha256"])
+            if artifact_tokens is None:
+                tokens += entry["size"] // UNINDEXED_BYTES_PER_TOKEN
+            else:
+                tokens += artifact_tokens
+                indexed += 1
+
+        result = {"files": len(entries), "indexed_files": indexed, "tokens": tokens}
+        self._cache = (version, result)
+        return result
+
+    def _tokens_of(self, content_hash: str) -> Optional[int]:
+        if content_hash not in self._artifact_tokens:
+            artifact = self.file_index.artifact(content_hash)
+            if artifact is None or "tokens" not in artifact:
+                return None
+            self._artifact_tokens[content_hash] = artifact["tokens"]
+        return self._artifact_tokens[content_hash]
+
+
+class Router:
+    """
+    Выбор модели, max_tokens и бет для запроса по правилам: маленький корпус
+    и короткий вопрос не должны ждать так же долго, как анализ 135k токенов.
+    Решение записывается в трассу и метрики вместе с итоговой длительностью,
+    сводка по правилам - python plot_traces.py routing
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]], corpus: CorpusEstimator,
+                 default_model: str, default_max_tokens: int, default_betas: List[str]):
+        self.rules = rules
+        self.corpus = corpus
+        self.default_model = default_model
+        self.default_max_tokens = default_max_tokens
+        self.default_betas = default_betas
+
+    @staticmethod
+    def _matches(when: Dict[str, Any], facts: Dict[str, Any]) -> bool:
+        for key, value in when.items():
+            if key == "query_pattern":
+                if not re.search(value, facts["query"], re.IGNORECASE):
+                    return False
+            elif key == "priority":
+                if facts["priority"] != value:
+                    return False
+            else:
+                bound, fact = key.split("_", 1)
+                if bound == "min" and facts[fact] < value:
+                    return False
+                if bound == "max" and facts[fact] > value:
+                    return False
+        return True
+
+    def _fits_window(self, rule: Dict[str, Any], facts: Dict[str, Any], max_tokens: Optional[int]) -> bool:
+        if LONG_CONTEXT_BETA in rule.get("betas", self.default_betas):
+            return True
+        max_tokens = max_tokens or rule.get("max_tokens", self.default_max_tokens)
+        return facts["corpus_tokens"] + facts["context_tokens"] + max_tokens <= STANDARD_CONTEXT_TOKENS
+
+    def route(self, query: str, context_tokens: int, priority: str,
+              max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Args:
+            context_tokens: оценка истории сессии, системного промпта и вопроса
+            max_tokens: явно заданный в запросе лимит; важнее правила
+
+        Returns:
+            {"rule", "model", "max_tokens", "betas", "corpus_tokens", "context_tokens", "decision_seconds"}
+        """
+        start = time.perf_counter()
+        corpus = self.corpus.estimate()
+        facts = {
+            "query": query,
+            "priority": priority,
+            "corpus_tokens": corpus["tokens"],
+            "context_tokens": context_tokens,
+            "query_chars": len(query)
+        }
+        rule = next((
+            rule for rule in self.rules
+            if self._matches(rule.get("when", {}), facts) and self._fits_window(rule, facts, max_tokens)
+        ), None)
+        rule = rule or {"name": "default"}
+        return {
+            "rule": rule["name"],
+            "model": rule.get("model", self.default_model),
+            "max_tokens": max_tokens or rule.get("max_tokens", self.default_max_tokens),
+            "betas": list(rule.get("betas", self.default_betas)),
+            "corpus_tokens": corpus["tokens"],
+            "corpus_files": corpus["files"],
+            "context_tokens": context_tokens,
+            "decision_seconds": round(time.perf_counter() - start, 4)
+        }
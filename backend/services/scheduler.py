@@ -0,0 +1,209 @@
+import fcntl
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional
+from services import metrics
+
+
+# Меньше - важнее. Пакетные задачи ждут, пока есть интерактивные запросы,
+# но за счет старения (aging_seconds) не голодают бесконечно
+PRIORITIES = {
+    "interactive": 0,
+    "batch": 1,
+}
+
+BUCKETS = ("requests", "input_tokens", "output_tokens")
+
+
+class TokenBucketScheduler:
+    """
+    Общий для всех воркеров gunicorn планировщик вызовов Anthropic API.
+
+    Три token bucket: запросы, входные и выходные токены в минуту. Состояние
+    хранится в JSON файле под fcntl блокировкой, поэтому работает между процессами
+    без внешних сервисов. Каждый ход API получает тикет в общей очереди; допускается
+    только голова очереди (приоритет с учетом старения, затем порядок поступления),
+    и только когда во всех bucket достаточно ресурса.
+
+    Входные токены списываются по оценке до вызова и уточняются после ответа (settle),
+    выходные - только по факту: bucket может уйти в минус и задержит следующие ходы.
+    """
+
+    def __init__(
+        self,
+        state_dir: Path,
+        requests_per_minute: int = 0,
+        input_tokens_per_minute: int = 0,
+        output_tokens_per_minute: int = 0,
+        aging_seconds: float = 30.0,
+        poll_interval: float = 0.1,
+        stale_seconds: float = 30.0
+    ):
+        self.state_dir = Path(state_dir)
+        self.limits = {
+            "requests": requests_per_minute,
+            "input_tokens": input_tokens_per_minute,
+            "output_tokens": output_tokens_per_minute,
+        }
+        self.aging_seconds = aging_seconds
+        self.poll_interval = poll_interval
+        self.stale_seconds = stale_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.limits.values())
+
+    @contextmanager
+    def _locked_state(self):
+        """Читает состояние под эксклюзивной блокировкой и записывает изменения"""
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        state_path = self.state_dir / "scheduler.json"
+        with open(self.state_dir / "scheduler.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    state = json.loads(state_path.read_text())
+                except (OSError, ValueError):
+                    state = {}
+                state.setdefault("buckets", {bucket: float(limit) for bucket, limit in self.limits.items()})
+                state.setdefault("updated", time.time())
+                state.setdefault("queue", {})
+                state.setdefault("seq", 0)
+
+                yield state
+
+                tmp_path = state_path.with_suffix(".tmp")
+                tmp_path.write_text(json.dumps(state))
+                tmp_path.replace(state_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refill(self, state: Dict[str, Any], now: float) -> None:
+        elapsed = max(now - state["updated"], 0.0)
+        for bucket, limit in self.limits.items():
+            if limit:
+                level = state["buckets"].get(bucket, float(limit))
+                state["buckets"][bucket] = min(float(limit), level + elapsed * limit / 60.0)
+        state["updated"] = now
+
+    def _head(self, state: Dict[str, Any], now: float) -> Optional[str]:
+        """Тикет, который сейчас имеет право быть допущенным"""
+        def rank(item):
+            ticket_id, ticket = item
+            waited = now - ticket["enqueued"]
+            return (ticket["priority"] - waited / self.aging_seconds, ticket["seq"])
+
+        if not state["queue"]:
+            return None
+        return min(state["queue"].items(), key=rank)[0]
+
+    def _has_capacity(self, state: Dict[str, Any], input_tokens: int) -> bool:
+        buckets = state["buckets"]
+        if self.limits["requests"] and buckets["requests"] < 1:
+            return False
+        # Запрос больше емкости bucket допускается, когда bucket полон
+        if self.limits["input_tokens"] and buckets["input_tokens"] < min(input_tokens, self.limits["input_tokens"]):
+            return False
+        if self.limits["output_tokens"] and buckets["output_tokens"] <= 0:
+            return False
+        return True
+
+    def acquire(self, priority: str, input_tokens: int) -> float:
+        """
+        Блокирует до допуска хода API
+
+        Args:
+            priority: Класс из PRIORITIES
+            input_tokens: Оценка входных токенов хода
+
+        Returns:
+            Время ожидания в очереди, секунды
+        """
+        if not self.enabled:
+            return 0.0
+
+        ticket_id = uuid.uuid4().hex
+        start = time.time()
+        metrics.SCHEDULER_QUEUE_DEPTH.labels(priority=priority).inc()
+        try:
+            with self._locked_state() as state:
+                state["seq"] += 1
+                state["queue"][ticket_id] = {
+                    "priority": PRIORITIES.get(priority, PRIORITIES["batch"]),
+                    "seq": state["seq"],
+                    "enqueued": start,
+                    "heartbeat": start,
+                    "pid": os.getpid()
+                }
+
+            while True:
+                with self._locked_state() as state:
+                    now = time.time()
+                    self._refill(state, now)
+                    # Тикеты упавших воркеров не должны блокировать очередь
+                    state["queue"] = {
+                        key: ticket for key, ticket in state["queue"].items()
+                        if now - ticket["heartbeat"] < self.stale_seconds
+                    }
+                    ticket = state["queue"].setdefault(ticket_id, {
+                        "priority": PRIORITIES.get(priority, PRIORITIES["batch"]),
+                        "seq": state["seq"] + 1,
+                        "enqueued": start,
+                        "heartbeat": now,
+                        "pid": os.getpid()
+                    })
+                    ticket["heartbeat"] = now
+
+                    if self._head(state, now) == ticket_id and self._has_capacity(state, input_tokens):
+                        del state["queue"][ticket_id]
+                        if self.limits["requests"]:
+                            state["buckets"]["requests"] -= 1
+                        if self.limits["input_tokens"]:
+                            state["buckets"]["input_tokens"] -= input_tokens
+                        break
+
+                time.sleep(self.poll_interval)
+        except BaseException:
+            self._cancel(ticket_id)
+            raise
+        finally:
+            metrics.SCHEDULER_QUEUE_DEPTH.labels(priority=priority).dec()
+
+        waited = time.time() - start
+        metrics.SCHEDULER_WAIT_SECONDS.labels(priority=priority).observe(waited)
+        return waited
+
+    def settle(self, estimated_input_tokens: int, input_tokens: int, output_tokens: int) -> None:
+        """Уточняет списание после ответа API фактическими токенами"""
+        if not self.enabled:
+            return
+        with self._locked_state() as state:
+            self._refill(state, time.time())
+            if self.limits["input_tokens"]:
+                state["buckets"]["input_tokens"] -= input_tokens - estimated_input_tokens
+            if self.limits["output_tokens"]:
+                state["buckets"]["output_tokens"] -= output_tokens
+
+    def _cancel(self, ticket_id: str) -> None:
+        try:
+            with self._locked_state() as state:
+                state["queue"].pop(ticket_id, None)
+        except OSError:
+            pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Текущее состояние bucket и очереди для диагностики (общее для всех воркеров)"""
+        if not self.enabled:
+            return {"enabled": False}
+        with self._locked_state() as state:
+            self._refill(state, time.time())
+            return {
+                "enabled": True,
+                "limits": self.limits,
+                "buckets": {bucket: round(level, 1) for bucket, level in state["buckets"].items()},
+                "queue_depth": len(state["queue"])
+            }
@@ -0,0 +1,340 @@
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+
+SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+COMPACTED_RESULT = "[Результат команды удален при сжатии сессии. Если он нужен, повтори команду view.]"
+DELETED_RESULT = "[Результат команды удален: файл удален пользователем.]"
+DELETED_EXCERPT = "[Фрагмент удален: файл удален пользователем.]"
+COMPACTED_EXCERPT = "[Фрагмент удален при сжатии сессии. Если он нужен, прочитай эти строки через view.]"
+
+# Фрагменты файлов, приложенные к вопросу поиском (services/retrieval.py)
+EXCERPT_RE = re.compile(r'<excerpt path="(?P<path>[^"]*)"[^>]*>\n(?P<text>.*?)\n</excerpt>', re.DOTALL)
+
+
+class SessionNotFoundError(KeyError):
+    pass
+
+
+class SessionBusyError(RuntimeError):
+    pass
+
+
+class Session:
+    """
+    История диалога одного пользователя: сообщения в формате Messages API,
+    включая tool_use и tool_result, чтобы продолжение не перечитывало файлы заново
+    """
+
+    def __init__(self, session_id: str, messages: Optional[List[Dict[str, Any]]] = None,
+                 created_at: Optional[float] = None, queries: Optional[List[Dict[str, Any]]] = None,
+                 compactions: int = 0):
+        self.session_id = session_id
+        self.messages: List[Dict[str, Any]] = messages or []
+        self.created_at = created_at or time.time()
+        self.queries: List[Dict[str, Any]] = queries or []
+        self.compactions = compactions
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "compactions": self.compactions,
+            "queries": self.queries,
+            "messages": self.messages
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        return cls(
+            data["session_id"],
+            messages=data.get("messages"),
+            created_at=data.get("created_at"),
+            queries=data.get("queries"),
+            compactions=data.get("compactions", 0)
+        )
+
+
+def estimate_tokens(content: Any) -> int:
+    """Грубая оценка токенов по размеру JSON: ~3 символа на токен для смешанного русского текста"""
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False, default=str)
+    return len(content) // 3 + 1
+
+
+def compact_messages(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """
+    Заменяет результаты старых команд и приложенные поиском фрагменты файлов
+    заглушкой, начиная с самых ранних, пока оценка контекста не уложится
+    в max_tokens. Пары tool_use/tool_result сохраняются, поэтому история
+    остается валидной для API; у фрагмента остаются путь и номера строк.
+
+    Returns:
+        Количество сжатых результатов и фрагментов
+    """
+    def compact_excerpt(match: re.Match) -> str:
+        nonlocal total, compacted
+        if total <= max_tokens or match.group("text") in (COMPACTED_EXCERPT, DELETED_EXCERPT):
+            return match.group(0)
+        total -= estimate_tokens(match.group("text")) - estimate_tokens(COMPACTED_EXCERPT)
+        compacted += 1
+        opening_tag = match.group(0).split("\n", 1)[0]
+        return f"{opening_tag}\n{COMPACTED_EXCERPT}\n</excerpt>"
+
+    total = estimate_tokens(messages)
+    compacted = 0
+    for message in messages:
+        if total <= max_tokens:
+            break
+        if message["role"] != "user" or not isinstance(message["content"], list):
+            continue
+        for block in message["content"]:
+            if block.get("type") == "text" and "<excerpt " in block["text"]:
+                block["text"] = EXCERPT_RE.sub(compact_excerpt, block["text"])
+                continue
+            if block.get("type") != "tool_result" or block.get("content") == COMPACTED_RESULT:
+                continue
+            total -= estimate_tokens(block.get("content", "")) - estimate_tokens(COMPACTED_RESULT)
+            block["content"] = COMPACTED_RESULT
+            block.pop("is_error", None)
+            compacted += 1
+    return compacted
+
+
+def forget_paths(messages: List[Dict[str, Any]], deleted: List[str]) -> int:
+    """
+    Заменяет заглушкой результаты команд по удаленным путям (сам путь, вложенные
+    файлы и фрагменты "<путь>#id") и приложенные к вопросам фрагменты этих файлов,
+    чтобы продолжение сессии не отвечало по содержимому удаленных файлов.
+
+    Returns:
+        Количество замененных результатов
+    """
+    def is_deleted(path: str) -> bool:
+        path = path.split("#", 1)[0].rstrip("/")
+        return any(path == d or path.startswith(d + "/") for d in deleted)
+
+    def forget_excerpt(match: re.Match) -> str:
+        nonlocal replaced
+        if match.group("text") == DELETED_EXCERPT or not is_deleted(match.group("path")):
+            return match.group(0)
+        replaced += 1
+        return f'<excerpt path="{match.group("path")}">\n{DELETED_EXCERPT}\n</excerpt>'
+
+    tool_ids = set()
+    replaced = 0
+    for message in messages:
+        if not isinstance(message["content"], list):
+            continue
+        for block in message["content"]:
+            if message["role"] == "user" and block.get("type") == "text" and "<excerpt " in block["text"]:
+                block["text"] = EXCERPT_RE.sub(forget_excerpt, block["text"])
+            elif block.get("type") == "tool_use" and is_deleted(str(block.get("input", {}).get("path", ""))):
+                tool_ids.add(block["id"])
+            elif block.get("type") == "tool_result" and block.get("tool_use_id") in tool_ids \
+                    and block.get("content") != DELETED_RESULT:
+                block["content"] = DELETED_RESULT
+                block.pop("is_error", None)
+                replaced += 1
+    return replaced
+
+
+class SessionStore:
+    """
+    Сессии в JSON файлах: общие для всех воркеров и переживают перезапуск.
+
+    Объем ограничен бюджетом max_bytes: при превышении удаляются давно не
+    использованные сессии (LRU по mtime), сессии старше ttl_seconds удаляются
+    всегда. Контекст одной сессии ограничен max_context_tokens - сверх него
+    старые результаты команд сжимаются (compact_messages).
+    """
+
+    def __init__(self, sessions_dir: Path, max_bytes: int, ttl_seconds: float, max_context_tokens: int):
+        self.sessions_dir = Path(sessions_dir)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_context_tokens = max_context_tokens
+
+    def _path(self, session_id: str) -> Path:
+        if not SESSION_ID_RE.match(session_id):
+            raise ValueError(f"Некорректный идентификатор сессии: {session_id}")
+        return self.sessions_dir / f"{session_id}.json"
+
+    def create(self, session_id: Optional[str] = None) -> Session:
+        session_id = session_id or uuid.uuid4().hex
+        self._path(session_id)
+        return Session(session_id)
+
+    def load(self, session_id: str) -> Session:
+        path = self._path(session_id)
+        try:
+            return Session.from_dict(json.loads(path.read_text(encoding="utf-8")))
+        except FileNotFoundError:
+            raise SessionNotFoundError(session_id)
+
+    def exists(self, session_id: str) -> bool:
+        return self._path(session_id).exists()
+
+    @contextmanager
+    def lock(self, session_id: str) -> Iterator[None]:
+        """
+        Один запрос на сессию одновременно: параллельные продолжения
+        перезаписали бы историю друг друга
+        """
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        lock_path = self._path(session_id).with_suffix(".lock")
+        while True:
+            with open(lock_path, "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise SessionBusyError(session_id)
+                try:
+                    # Файл блокировки мог удалить evict между open и flock: блокировка
+                    # удаленного файла ничего не защищает, нужен новый файл
+                    if not self._is_current_lock(lock, lock_path):
+                        continue
+                    yield
+                    return
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _is_current_lock(lock: Any, lock_path: Path) -> bool:
+        try:
+            return os.stat(lock_path).st_ino == os.fstat(lock.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _remove_stale_locks(self) -> int:
+        """
+        Удаляет файлы блокировки удаленных сессий. Файл удаляется только под
+        блокировкой на том же дескрипторе: lock() проверяет, что держит
+        блокировку файла, который еще лежит по своему пути
+        """
+        removed = 0
+        for lock_path in self.sessions_dir.glob("*.lock"):
+            if lock_path.with_suffix(".json").exists():
+                continue
+            try:
+                with open(lock_path, "a") as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    try:
+                        if self._is_current_lock(lock, lock_path) and not lock_path.with_suffix(".json").exists():
+                            lock_path.unlink()
+                            removed += 1
+                    finally:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def prepare(self, session: Session) -> int:
+        """Сжимает историю перед новым запросом, если она выросла сверх лимита"""
+        compacted = compact_messages(session.messages, self.max_context_tokens)
+        if compacted:
+            session.compactions += 1
+        return compacted
+
+    def save(self, session: Session) -> Path:
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(session.session_id)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(session.to_dict(), ensure_ascii=False, default=str), encoding="utf-8")
+        tmp_path.replace(path)
+        self.evict(keep=session.session_id)
+        return path
+
+    def delete(self, session_id: str) -> bool:
+        """Удаляет сессию; занятую запросом сессию удалить нельзя (SessionBusyError)"""
+        path = self._path(session_id)
+        if not path.exists():
+            return False
+        # Файл блокировки остается: его удаление под удерживаемой блокировкой дало бы
+        # двум процессам блокировки разных файлов одной сессии. Его убирает evict
+        with self.lock(session_id):
+            path.unlink(missing_ok=True)
+        return True
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """Удаляет просроченные сессии и самые старые сверх бюджета"""
+        now = time.time()
+        files = []
+        for path in self.sessions_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        evicted = []
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if path.stem == keep:
+                continue
+            if now - mtime > self.ttl_seconds or total > self.max_bytes:
+                try:
+                    self.delete(path.stem)
+                except (SessionBusyError, ValueError):
+                    continue
+                total -= size
+                evicted.append(path.stem)
+        self._remove_stale_locks()
+        return evicted
+
+    def forget_paths(self, deleted: List[str]) -> int:
+        """
+        Убирает из всех сессий результаты команд по удаленным путям (пути MemoryTool:
+        "/user_files/..."). Сессия, занятая запросом, пропускается.
+
+        Returns:
+            Количество измененных сессий
+        """
+        deleted = [path.rstrip("/") for path in deleted]
+        changed = 0
+        for path in self.sessions_dir.glob("*.json"):
+            try:
+                with self.lock(path.stem):
+                    session = self.load(path.stem)
+                    if forget_paths(session.messages, deleted):
+                        tmp_path = path.with_suffix(".tmp")
+                        tmp_path.write_text(json.dumps(session.to_dict(), ensure_ascii=False, default=str), encoding="utf-8")
+                        # mtime не обновляется: очистка не продлевает жизнь сессии в LRU
+                        stat = path.stat()
+                        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                        tmp_path.replace(path)
+                        changed += 1
+            except (SessionBusyError, SessionNotFoundError, ValueError):
+                continue
+        return changed
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        sessions = []
+        for path in self.sessions_dir.glob("*.json"):
+            try:
+                session = self.load(path.stem)
+                stat = path.stat()
+            except (SessionNotFoundError, ValueError):
+                continue
+            sessions.append({
+                "session_id": session.session_id,
+                "created_at": session.created_at,
+                "updated_at": stat.st_mtime,
+                "size": stat.st_size,
+                "queries": len(session.queries),
+                "messages": len(session.messages),
+                "compactions": session.compactions
+            })
+        return sorted(sessions, key=lambda s: s["updated_at"], reverse=True)
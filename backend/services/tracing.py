@@ -0,0 +1,171 @@
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+_current_trace: ContextVar[Optional["QueryTrace"]] = ContextVar("query_trace", default=None)
+
+
+class QueryTrace:
+    """
+    Структурированная трасса одного запроса: ходы API и команды MemoryTool
+    с длительностями, токенами и размерами результатов.
+    Время модели, инструментов и чтения файлов считается раздельно.
+    """
+
+    def __init__(self, query: str, model: str, max_tokens: int, query_id: Optional[str] = None,
+                 session_id: Optional[str] = None):
+        self.query_id = query_id or uuid.uuid4().hex
+        self.session_id = session_id
+        self.query = query
+        self.model = model
+        self.max_tokens = max_tokens
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.turns: List[Dict[str, Any]] = []
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.elapsed_seconds: Optional[float] = None
+        self.created_files: List[str] = []
+        # Решение маршрутизации (services/routing.py): правило, модель, размер корпуса
+        self.routing: Optional[Dict[str, Any]] = None
+        # Фрагменты, приложенные к вопросу поиском (services/retrieval.py), без текста
+        self.retrieval: Optional[Dict[str, Any]] = None
+        self._pending_file_reads: List[Dict[str, Any]] = []
+
+    def _offset(self) -> float:
+        return round(time.perf_counter() - self._start, 4)
+
+    def add_turn(self, api_seconds: float, tokens: Dict[str, int], stop_reason: Optional[str], **extra: Any) -> None:
+        """Записывает завершенный вызов Messages API"""
+        self.turns.append({
+            "index": len(self.turns) + 1,
+            "started_at": round(self._offset() - api_seconds, 4),
+            "api_seconds": round(api_seconds, 4),
+            "tokens": tokens,
+            "stop_reason": stop_reason,
+            **extra,
+            "commands": []
+        })
+
+    def add_command(self, command: Any, seconds: float, result: Any = None, error: Optional[str] = None) -> None:
+        """Записывает выполненную команду MemoryTool в последний ход"""
+        entry = {
+            "command": command.command,
+            "path": getattr(command, "path", None) or getattr(command, "old_path", None),
+            "view_range": getattr(command, "view_range", None),
+            "seconds": round(seconds, 4),
+            "result_chars": len(result) if isinstance(result, str) else 0,
+            "status": "error" if error else "ok",
+            "file_reads": self._pending_file_reads
+        }
+        if error:
+            entry["error"] = error
+        self._pending_file_reads = []
+
+        if not self.turns:
+            self.add_turn(0.0, {}, None)
+        self.turns[-1]["commands"].append(entry)
+
+    def add_file_read(self, file_format: str, size: int, seconds: float, output_chars: int) -> None:
+        """Записывает разбор файла FileProcessor внутри текущей команды"""
+        self._pending_file_reads.append({
+            "format": file_format,
+            "bytes": size,
+            "seconds": round(seconds, 4),
+            "output_chars": output_chars
+        })
+
+    def finish(self, status: str, error: Optional[str] = None, created_files: Optional[List[str]] = None) -> None:
+        self.status = status
+        self.error = error
+        self.elapsed_seconds = round(time.perf_counter() - self._start, 4)
+        self.created_files = created_files or []
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка: куда ушло время и сколько токенов израсходовано"""
+        api_seconds = sum(turn["api_seconds"] for turn in self.turns)
+        commands = [command for turn in self.turns for command in turn["commands"]]
+        tool_seconds = sum(command["seconds"] for command in commands)
+        file_read_seconds = sum(read["seconds"] for command in commands for read in command["file_reads"])
+
+        tokens: Dict[str, int] = {}
+        for turn in self.turns:
+            for kind, value in turn["tokens"].items():
+                tokens[kind] = tokens.get(kind, 0) + value
+
+        # Размер контекста последнего хода - то, что в plot_comparison.py называется "Entry Tokens"
+        entry_tokens = max(
+            (sum(turn["tokens"].get(kind, 0) for kind in ("input", "cache_read", "cache_creation"))
+             for turn in self.turns),
+            default=0
+        )
+
+        return {
+            "turns": len(self.turns),
+            "commands": len(commands),
+            "new_connections": sum(1 for turn in self.turns if turn.get("new_connection")),
+            "api_seconds": round(api_seconds, 4),
+            "tool_seconds": round(tool_seconds, 4),
+            "file_read_seconds": round(file_read_seconds, 4),
+            "tokens": tokens,
+            "entry_tokens": entry_tokens
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "query_id": self.query_id,
+            "session_id": self.session_id,
+            "query": self.query,
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "routing": self.routing,
+            "retrieval": self.retrieval,
+            "started_at": self.started_at,
+            "status": self.status,
+            "error": self.error,
+            "elapsed_seconds": self.elapsed_seconds,
+            "created_files": self.created_files,
+            "summary": self.summary(),
+            "turns": self.turns
+        }
+
+    def save(self, traces_dir: Path) -> Path:
+        traces_dir.mkdir(parents=True, exist_ok=True)
+        trace_path = traces_dir / f"{self.query_id}.json"
+        tmp_path = trace_path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(self.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+        tmp_path.replace(trace_path)
+        return trace_path
+
+
+@contextmanager
+def activate(trace: QueryTrace):
+    """Делает трассу текущей для MemoryTool и FileProcessor на время запроса"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current() -> Optional[QueryTrace]:
+    return _current_trace.get()
+
+
+def trace_path(traces_dir: Path, query_id: str) -> Path:
+    """Путь к трассе; query_id - hex строка, что исключает выход за пределы директории"""
+    if not query_id or not all(c in "0123456789abcdef" for c in query_id):
+        raise ValueError(f"Недопустимый идентификатор запроса: {query_id}")
+    return traces_dir / f"{query_id}.json"
+
+
+def load_trace(traces_dir: Path, query_id: str) -> Optional[Dict[str, Any]]:
+    path = trace_path(traces_dir, query_id)
+    if not path.is_file():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
@@ -0,0 +1,184 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Корзина лежит внутри удаляемой директории: user_files и responses - отдельные
+# тома docker, rename между ними невозможен. Скрытые директории не попадают
+# в листинги и индекс
+TRASH_DIR_NAME = ".trash"
+
+# invalidate(relative_paths) -> счетчики удаленных производных данных
+Invalidator = Callable[[List[str]], Dict[str, int]]
+
+
+class DeletionJobs:
+    """
+    Удаление без блокировки воркера: путь переименовывается в
+    <root>/.trash/<job_id>/ (rename в пределах тома мгновенный и для директории
+    с десятками тысяч файлов), запрос сразу возвращает задание, а содержимое
+    корзины и производные данные (индекс, сессии) удаляет фоновый поток.
+
+    Состояние заданий - JSON файлы в jobs_dir, общие для воркеров. Задание,
+    брошенное при перезапуске воркера, подбирает recover(): корзина разбирается
+    под fcntl блокировкой задания, поэтому одно задание выполняет один процесс.
+    """
+
+    def __init__(self, jobs_dir: Path, ttl_seconds: float = 86400):
+        self.jobs_dir = Path(jobs_dir)
+        self.ttl_seconds = ttl_seconds
+
+    def _job_path(self, job_id: str) -> Path:
+        if not job_id.isalnum():
+            raise ValueError(f"Некорректный идентификатор задания: {job_id}")
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _write(self, job: Dict[str, Any]) -> None:
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        path = self._job_path(job["job_id"])
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(job, ensure_ascii=False))
+        tmp_path.replace(path)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._job_path(job_id).read_text())
+        except FileNotFoundError:
+            return None
+
+    def submit(self, root: Path, targets: List[Path], invalidate: Optional[Invalidator] = None) -> Dict[str, Any]:
+        """
+        Переносит targets (файлы и директории внутри root) в корзину и запускает
+        фоновую очистку. После возврата пути уже не видны.
+        """
+        job_id = uuid.uuid4().hex
+        trash_path = Path(root) / TRASH_DIR_NAME / job_id
+        trash_path.mkdir(parents=True)
+
+        # Запись задания с путями сохраняется до переименования: если процесс
+        # упадет посреди переноса, recover() найдет корзину вместе с путями
+        # для инвалидации производных данных
+        job = {
+            "job_id": job_id,
+            "root": str(root),
+            "paths": [target.relative_to(root).as_posix() for target in targets],
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "removed_files": 0,
+            "removed_bytes": 0,
+            "invalidated": {},
+            "error": None
+        }
+        self._write(job)
+
+        moved = 0
+        try:
+            for index, target in enumerate(targets):
+                # Номер в имени: одинаковые имена из разных поддиректорий не конфликтуют
+                target.rename(trash_path / f"{index}-{target.name}")
+                moved += 1
+        finally:
+            if moved < len(targets):
+                # Перенос прерван ошибкой: очищается и инвалидируется только перенесенное
+                job["paths"] = job["paths"][:moved]
+                self._write(job)
+                self._start(job, trash_path, invalidate)
+
+        self._cleanup_jobs()
+        # Снимок до запуска потока: словарь задания дальше меняет фоновый поток
+        snapshot = dict(job)
+        self._start(job, trash_path, invalidate)
+        return snapshot
+
+    def _start(self, job: Dict[str, Any], trash_path: Path, invalidate: Optional[Invalidator]) -> None:
+        thread = threading.Thread(
+            target=self._reap,
+            args=(job, trash_path, invalidate),
+            name=f"trash-reaper-{job['job_id'][:8]}",
+            daemon=True
+        )
+        thread.start()
+
+    def _reap(self, job: Dict[str, Any], trash_path: Path, invalidate: Optional[Invalidator]) -> None:
+        lock_path = trash_path.with_suffix(".lock")
+        with open(lock_path, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # задание уже выполняет другой процесс
+
+            if not trash_path.exists():
+                # Корзину уже разобрал другой процесс между iterdir() в recover()
+                # и захватом блокировки - его итог не перезаписывается
+                if (self.get(job["job_id"]) or job)["status"] not in ("done", "failed"):
+                    job.update(status="done", finished_at=time.time())
+                    self._write(job)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock_path.unlink(missing_ok=True)
+                return
+
+            job.update(status="running", started_at=time.time())
+            self._write(job)
+            try:
+                for dirpath, dirnames, filenames in os.walk(trash_path, topdown=False):
+                    for name in filenames:
+                        path = os.path.join(dirpath, name)
+                        job["removed_bytes"] += os.lstat(path).st_size
+                        os.unlink(path)
+                        job["removed_files"] += 1
+                    for name in dirnames:
+                        os.rmdir(os.path.join(dirpath, name))
+                trash_path.rmdir()
+                if invalidate is not None:
+                    job["invalidated"] = invalidate(job["paths"])
+                job["status"] = "done"
+            except Exception as e:
+                logger.exception(f"Задание удаления {job['job_id']} не выполнено")
+                job.update(status="failed", error=str(e))
+            finally:
+                job["finished_at"] = time.time()
+                self._write(job)
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        lock_path.unlink(missing_ok=True)
+
+    def recover(self, root: Path, invalidate: Optional[Invalidator] = None) -> int:
+        """Запускает очистку корзин, оставшихся от прерванных заданий"""
+        trash_dir = Path(root) / TRASH_DIR_NAME
+        if not trash_dir.is_dir():
+            return 0
+        started = 0
+        for trash_path in trash_dir.iterdir():
+            if not trash_path.is_dir():
+                continue
+            try:
+                created_at = trash_path.stat().st_mtime
+            except FileNotFoundError:
+                continue  # корзину только что разобрал поток другого процесса
+            job = self.get(trash_path.name) or {
+                "job_id": trash_path.name, "root": str(root), "paths": [], "status": "queued",
+                "created_at": created_at, "started_at": None, "finished_at": None,
+                "removed_files": 0, "removed_bytes": 0, "invalidated": {}, "error": None
+            }
+            job.update(removed_files=0, removed_bytes=0)
+            self._start(job, trash_path, invalidate)
+            started += 1
+        return started
+
+    def _cleanup_jobs(self) -> None:
+        """Удаляет записи давно завершенных заданий"""
+        now = time.time()
+        for path in self.jobs_dir.glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > self.ttl_seconds and json.loads(path.read_text())["status"] in ("done", "failed"):
+                    path.unlink()
+            except (OSError, ValueError, KeyError):
+                continue
@@ -0,0 +1,290 @@
+"""
+Генератор синтетических файлов всех поддерживаемых форматов с кириллическим содержимым.
+
+Размер задается как объем исходного текста в байтах; для бинарных форматов
+(xlsx, docx, pdf) итоговый файл будет отличаться из-за сжатия и разметки.
+
+    python -m benchmarks.corpus storage/user_files/bench --sizes 1MB 10MB --formats txt csv pdf
+"""
+import argparse
+import csv
+import json
+import random
+import sys
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List
+
+FORMATS = ("txt", "json", "csv", "xml", "xlsx", "docx", "pdf")
+
+WORDS = (
+    "пилот демонстрация заказчик поставщик договор тендер заявка проект участник "
+    "срок стоимость бюджет этап внедрение отчет результат анализ показатель метрика "
+    "качество требование спецификация оборудование лицензия сервис интеграция данные "
+    "платформа модуль доработка согласование протокол совещание решение риск план "
+    "Москва Казань Новосибирск Екатеринбург рубль квартал неделя обязательство"
+).split()
+
+COLUMNS = ["Номер", "Компания", "Город", "Этап", "Сумма, руб", "Дата", "Комментарий"]
+CITIES = ["Москва", "Казань", "Новосибирск", "Екатеринбург", "Самара", "Томск"]
+STAGES = ["Заявка", "Демо", "Пилот", "Договор", "Внедрение"]
+
+
+def parse_size(value: str) -> int:
+    """'512KB', '10MB', '1GB' или число байт"""
+    value = value.strip().upper()
+    for suffix, factor in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024), ("B", 1)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+def format_size(size: int) -> str:
+    for suffix, factor in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024)):
+        if size >= factor:
+            return f"{size / factor:.4g}{suffix}"
+    return f"{size}B"
+
+
+class CorpusGenerator:
+    """Детерминированный генератор: одинаковый seed дает одинаковые файлы"""
+
+    def __init__(self, seed: int = 42):
+        self.random = random.Random(seed)
+
+    def sentence(self, words: int = 12) -> str:
+        text = " ".join(self.random.choice(WORDS) for _ in range(words))
+        return text[0].upper() + text[1:] + "."
+
+    def paragraph(self, sentences: int = 4) -> str:
+        return " ".join(self.sentence(self.random.randint(6, 16)) for _ in range(sentences))
+
+    def record(self, index: int) -> Dict[str, str]:
+        return {
+            "Номер": str(index),
+            "Компания": f"ООО «{self.random.choice(WORDS).capitalize()} {self.random.choice(WORDS).capitalize()}»",
+            "Город": self.random.choice(CITIES),
+            "Этап": self.random.choice(STAGES),
+            "Сумма, руб": str(self.random.randint(10, 5000) * 1000),
+            "Дата": f"2025-{self.random.randint(1, 12):02d}-{self.random.randint(1, 28):02d}",
+            "Комментарий": self.sentence(self.random.randint(5, 20))
+        }
+
+    def records(self, size: int) -> Iterator[Dict[str, str]]:
+        """Записи, пока их суммарный текстовый объем не превысит size байт"""
+        total = 0
+        index = 1
+        while total < size:
+            record = self.record(index)
+            total += sum(len(value.encode("utf-8")) for value in record.values()) + len(record) * 2
+            index += 1
+            yield record
+
+    def write_txt(self, path: Path, size: int) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            written = 0
+            section = 1
+            while written < size:
+                block = [f"=== Раздел {section}. {self.sentence(4)[:-1]} ===", ""]
+                for record in (self.record(i) for i in range(self.random.randint(3, 8))):
+                    block.append("; ".join(f"{key}: {value}" for key, value in record.items()))
+                    block.append(self.paragraph())
+                    block.append("---")
+                text = "\n".join(block) + "\n\n"
+                f.write(text)
+                written += len(text.encode("utf-8"))
+                section += 1
+
+    def write_json(self, path: Path, size: int) -> None:
+        # Пишем потоком, чтобы генерировать файлы в сотни мегабайт без загрузки в память
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"source": "benchmark", "records": [')
+            for index, record in enumerate(self.records(size)):
+                f.write((",\n" if index else "\n") + json.dumps(record, ensure_ascii=False))
+            f.write("\n]}\n")
+
+    def write_csv(self, path: Path, size: int) -> None:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.records(size))
+
+    def write_xml(self, path: Path, size: int) -> None:
+        from xml.sax.saxutils import escape, quoteattr
+
+        tags = ["number", "company", "city", "stage", "amount", "date", "comment"]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<records>\n')
+            for record in self.records(size):
+                values = list(record.values())
+                f.write(f"  <record id={quoteattr(values[0])}>")
+                f.write("".join(f"<{tag}>{escape(value)}</{tag}>" for tag, value in zip(tags[1:], values[1:])))
+                f.write("</record>\n")
+            f.write("</records>\n")
+
+    def write_xlsx(self, path: Path, size: int) -> None:
+        from openpyxl import Workbook
+
+        # Три листа, как в реальных выгрузках по этапам; write_only не держит книгу в памяти
+        workbook = Workbook(write_only=True)
+        for sheet in range(3):
+            worksheet = workbook.create_sheet(f"Лист{sheet + 1}")
+            worksheet.append(COLUMNS)
+            for record in self.records(size // 3):
+                worksheet.append(list(record.values()))
+        workbook.save(path)
+
+    def write_docx(self, path: Path, size: int) -> None:
+        from docx import Document
+
+        doc = Document()
+        written = 0
+        section = 1
+        while written < size:
+            doc.add_heading(f"Раздел {section}. {self.sentence(4)[:-1]}", level=1)
+            for _ in range(3):
+                text = self.paragraph()
+                doc.add_paragraph(text)
+                written += len(text.encode("utf-8"))
+
+            records = [self.record(i) for i in range(self.random.randint(5, 15))]
+            table = doc.add_table(rows=2, cols=len(COLUMNS))
+            # Объединенная строка заголовка, как в тендерной документации
+            title = table.rows[0].cells[0].merge(table.rows[0].cells[-1])
+            title.text = f"Таблица {section}. Участники отбора"
+            for cell, column in zip(table.rows[1].cells, COLUMNS):
+                cell.text = column
+            for record in records:
+                for cell, value in zip(table.add_row().cells, record.values()):
+                    cell.text = value
+                    written += len(value.encode("utf-8"))
+            section += 1
+        doc.save(path)
+
+    def pdf_lines(self, size: int) -> Iterator[str]:
+        written = 0
+        while written < size:
+            line = self.sentence(self.random.randint(6, 10))
+            written += len(line.encode("utf-8"))
+            yield line
+
+    def write_pdf(self, path: Path, size: int) -> None:
+        with open(path, "wb") as f:
+            write_pdf(f, self.pdf_lines(size))
+
+    def write(self, file_format: str, path: Path, size: int) -> Path:
+        getattr(self, f"write_{file_format}")(path, size)
+        return path
+
+
+# Кириллица в PDF без встраивания шрифта: Helvetica с /Differences на имена глифов
+# Adobe (afii100xx), которые PyPDF2 переводит обратно в Unicode при извлечении текста
+_UPPER = "АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"
+_LOWER = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+_PDF_CODES = {char: 128 + i for i, char in enumerate(_UPPER + _LOWER)}
+_PDF_GLYPHS = [f"/afii{10017 + i}" for i in range(len(_UPPER))] + [f"/afii{10065 + i}" for i in range(len(_LOWER))]
+
+
+def _pdf_string(text: str) -> bytes:
+    result = bytearray()
+    for char in text:
+        code = _PDF_CODES.get(char)
+        if code is None:
+            code = ord(char) if ord(char) < 128 else ord("?")
+            if char in "()\\":
+                result.append(ord("\\"))
+        result.append(code)
+    return b"(" + bytes(result) + b")"
+
+
+def write_pdf(f: BinaryIO, lines: Iterable[str], lines_per_page: int = 50) -> None:
+    """
+    Минимальный PDF по lines_per_page строк на страницу. Страницы пишутся потоком:
+    объекты страниц идут первыми, каталог и дерево страниц - в конце файла
+    """
+    offsets: List[int] = []
+    position = 0
+
+    def write_object(body: bytes) -> int:
+        nonlocal position
+        offsets.append(position)
+        data = b"%d 0 obj\n" % len(offsets) + body + b"\nendobj\n"
+        f.write(data)
+        position += len(data)
+        return len(offsets)
+
+    header = b"%PDF-1.4\n"
+    f.write(header)
+    position = len(header)
+
+    font_id = write_object(
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding << /Type /Encoding /Differences [128 "
+        + " ".join(_PDF_GLYPHS).encode("ascii") + b"] >> >>"
+    )
+    # Список страниц известен только в конце: номер объекта Pages резервируется сразу,
+    # а xref указывает на его полную версию, дописанную после страниц
+    pages_id = write_object(b"<< >>")
+
+    page_ids = []
+    page: List[str] = []
+
+    def flush_page() -> None:
+        stream = b"BT /F1 9 Tf 12 TL 36 806 Td " + b" ".join(_pdf_string(line) + b" '" for line in page) + b" ET"
+        content_id = write_object(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(write_object(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content_id, font_id)
+        ))
+        page.clear()
+
+    for line in lines:
+        page.append(line)
+        if len(page) == lines_per_page:
+            flush_page()
+    if page or not page_ids:
+        flush_page()
+
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    pages_body = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+    offsets[pages_id - 1] = position
+    data = b"%d 0 obj\n" % pages_id + pages_body + b"\nendobj\n"
+    f.write(data)
+    position += len(data)
+    catalog_id = write_object(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    xref = b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1)
+    xref += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    f.write(xref)
+    f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, catalog_id, position))
+
+
+def generate_corpus(target_dir: Path, sizes: List[int], formats=FORMATS, seed: int = 42) -> List[Path]:
+    """Создает target_dir/<size>/sample.<format> для каждой пары размер × формат"""
+    generator = CorpusGenerator(seed)
+    paths = []
+    for size in sizes:
+        size_dir = target_dir / format_size(size)
+        size_dir.mkdir(parents=True, exist_ok=True)
+        for file_format in formats:
+            path = size_dir / f"sample.{file_format}"
+            if not path.exists():
+                generator.write(file_format, path, size)
+            paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетического корпуса")
+    parser.add_argument("target_dir", type=Path)
+    parser.add_argument("--sizes", nargs="+", default=["100KB", "1MB"])
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.target_dir, [parse_size(size) for size in args.sizes], args.formats, args.seed)
+    for path in paths:
+        print(f"{path.stat().st_size:>12}  {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Локальная замена Anthropic Messages API для нагрузочного тестирования без платных вызовов.
+
+Сервер воспроизводит записанные tool-use диалоги: номер хода определяется
+количеством assistant сообщений в запросе, диалог выбирается по тексту первого
+сообщения пользователя (поле "match"), иначе используется первый загруженный.
+
+    python -m benchmarks.mock_anthropic serve benchmarks/conversations/*.json --port 8765 --latency-ms 800
+    python -m benchmarks.mock_anthropic from-trace storage/traces/<query_id>.json > conversation.json
+
+Затем backend запускается с CLAUDE_BASE_URL=http://127.0.0.1:8765
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+
+class MockMessagesServer:
+    """
+    Mock /v1/messages с настраиваемой задержкой:
+    latency_ms + ms_per_output_token * output_tokens ± jitter
+    """
+
+    def __init__(
+        self,
+        conversations: List[Dict[str, Any]],
+        latency_ms: float = 0.0,
+        ms_per_output_token: float = 0.0,
+        jitter: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        if not conversations:
+            raise ValueError("Нужен хотя бы один диалог")
+        self.conversations = conversations
+        self.latency_ms = latency_ms
+        self.ms_per_output_token = ms_per_output_token
+        self.jitter = jitter
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+        self.app = Flask(__name__)
+        self.app.add_url_rule("/v1/messages", "messages", self._messages, methods=["POST"])
+        self._server = make_server(host, port, self.app, threaded=True)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self._server.host}:{self._server.port}"
+
+    def start(self) -> "MockMessagesServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+
+    def __enter__(self) -> "MockMessagesServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _pick_conversation(self, first_user_text: str) -> Dict[str, Any]:
+        for conversation in self.conversations:
+            match = conversation.get("match")
+            if match and match in first_user_text:
+                return conversation
+        return self.conversations[0]
+
+    def _messages(self):
+        raw = request.get_data()
+        # Клиент может сжимать тело запроса (CLAUDE_HTTP_COMPRESS)
+        if request.headers.get("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+        body = json.loads(raw)
+        messages = body.get("messages", [])
+        first_user_text = _text_of(messages[0]) if messages else ""
+        conversation = self._pick_conversation(first_user_text)
+
+        turns = conversation["turns"]
+        turn_index = min(sum(1 for m in messages if m["role"] == "assistant"), len(turns) - 1)
+        turn = turns[turn_index]
+
+        # Уникальный идентификатор диалога, чтобы параллельные запросы не писали в один файл
+        conversation_id = hashlib.sha1(first_user_text.encode("utf-8")).hexdigest()[:10]
+        content = json.loads(json.dumps(turn["content"]).replace("{conversation}", conversation_id))
+        for block in content:
+            if block["type"] == "tool_use":
+                block.setdefault("id", f"toolu_{uuid.uuid4().hex[:24]}")
+
+        usage = dict(turn.get("usage") or {})
+        # Без записанного usage оцениваем вход как ~4 символа на токен
+        usage.setdefault("input_tokens", len(raw) // 4)
+        usage.setdefault("output_tokens", len(json.dumps(content, ensure_ascii=False)) // 4)
+        usage.setdefault("cache_read_input_tokens", 0)
+        usage.setdefault("cache_creation_input_tokens", 0)
+
+        delay = (self.latency_ms + self.ms_per_output_token * usage["output_tokens"]) / 1000
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(max(delay, 0))
+
+        with self._lock:
+            self.requests_served += 1
+
+        has_tool_use = any(block["type"] == "tool_use" for block in content)
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "content": content,
+            "stop_reason": "tool_use" if has_tool_use else "end_turn",
+            "stop_sequence": None,
+            "usage": usage
+        }
+        if body.get("stream"):
+            return Response(_stream_events(message), mimetype="text/event-stream")
+        return jsonify(message)
+
+
+def _stream_events(message: Dict[str, Any]) -> Iterator[str]:
+    """Ответ в формате SSE Messages API: блоки целиком одним delta"""
+    def event(name: str, data: Dict[str, Any]) -> str:
+        return f"event: {name}\ndata: {json.dumps({'type': name, **data}, ensure_ascii=False)}\n\n"
+
+    usage = message["usage"]
+    yield event("message_start", {"message": {
+        **message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 0}
+    }})
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "tool_use":
+            yield event("content_block_start", {"index": index, "content_block": {**block, "input": {}}})
+            delta = {"type": "input_json_delta", "partial_json": json.dumps(block["input"], ensure_ascii=False)}
+        else:
+            yield event("content_block_start", {"index": index, "content_block": {**block, "text": ""}})
+            delta = {"type": "text_delta", "text": block["text"]}
+        yield event("content_block_delta", {"index": index, "delta": delta})
+        yield event("content_block_stop", {"index": index})
+    yield event("message_delta", {
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": usage["output_tokens"]}
+    })
+    yield event("message_stop", {})
+
+
+def _text_of(message: Dict[str, Any]) -> str:
+    content = message.get("content")
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content or [] if isinstance(block, dict))
+
+
+def load_conversations(paths: List[Path]) -> List[Dict[str, Any]]:
+    return [json.loads(Path(path).read_text(encoding="utf-8")) for path in paths]
+
+
+def conversation_from_trace(trace: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Строит диалог из трассы запроса (storage/traces): команды view повторяются как есть,
+    команды записи заменяются одной записью ответа в /responses.
+    """
+    turns = []
+    for turn in trace["turns"]:
+        content = []
+        for command in turn["commands"]:
+            if command["command"] != "view":
+                continue
+            tool_input = {"command": "view", "path": command["path"]}
+            if command.get("view_range"):
+                tool_input["view_range"] = command["view_range"]
+            content.append({"type": "tool_use", "name": "memory", "input": tool_input})
+        if content:
+            tokens = turn.get("tokens", {})
+            turns.append({
+                "content": content,
+                "usage": {
+                    "input_tokens": tokens.get("input", 0),
+                    "output_tokens": tokens.get("output", 0),
+                    "cache_read_input_tokens": tokens.get("cache_read", 0),
+                    "cache_creation_input_tokens": tokens.get("cache_creation", 0)
+                }
+            })
+
+    turns.append({"content": [{
+        "type": "tool_use",
+        "name": "memory",
+        "input": {
+            "command": "create",
+            "path": "/responses/bench-{conversation}.txt",
+            "file_text": "Ответ воспроизведен из трассы"
+        }
+    }]})
+    turns.append({"content": [{"type": "text", "text": "Ответ сохранен"}]})
+    return {"name": trace["query_id"], "match": trace["query"][:200], "turns": turns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Anthropic Messages API")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Запустить mock сервер")
+    serve_parser.add_argument("conversations", nargs="+", type=Path)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--latency-ms", type=float, default=0.0)
+    serve_parser.add_argument("--ms-per-output-token", type=float, default=0.0)
+    serve_parser.add_argument("--jitter", type=float, default=0.0, help="Разброс задержки, доля от 0 до 1")
+
+    trace_parser = subparsers.add_parser("from-trace", help="Преобразовать трассу запроса в диалог")
+    trace_parser.add_argument("trace", type=Path)
+
+    args = parser.parse_args()
+
+    if args.action == "from-trace":
+        trace = json.loads(args.trace.read_text(encoding="utf-8"))
+        print(json.dumps(conversation_from_trace(trace), ensure_ascii=False, indent=2))
+        return 0
+
+    server = MockMessagesServer(
+        load_conversations(args.conversations),
+        latency_ms=args.latency_ms,
+        ms_per_output_token=args.ms_per_output_token,
+        jitter=args.jitter,
+        host=args.host,
+        port=args.port
+    )
+    print(f"Mock Messages API: {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
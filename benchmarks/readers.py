@@ -0,0 +1,187 @@
+"""
+Микро-бенчмарк читателей FileProcessor: время, пиковый RSS и размер вывода
+в зависимости от размера входного файла.
+
+    python -m benchmarks.readers --sizes 1MB 10MB 100MB
+    python -m benchmarks.readers --sizes 10MB --baseline benchmarks/results/readers-abc123.json --max-regression 0.25
+
+Каждое измерение выполняется в отдельном процессе, чтобы пиковый RSS одного
+читателя не влиял на другой. При --baseline команда завершается с кодом 1,
+если время или память хотя бы одного случая выросли больше порога.
+"""
+import argparse
+import importlib
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks import corpus, stats
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+
+# Для DOCX сравниваются потоковый read_docx_xml (используется FileProcessor)
+# и прежний read_docx на python-docx
+READERS = {
+    "txt": ("read_txt",),
+    "json": ("read_json",),
+    "csv": ("read_csv",),
+    "xml": ("read_xml",),
+    "xlsx": ("read_excel",),
+    "docx": ("read_docx_xml", "read_docx"),
+    "pdf": ("read_pdf",),
+}
+
+# Библиотеки читателей, которых нет в FileProcessor.BACKENDS
+READER_BACKENDS = {
+    "read_docx": ("docx",),
+}
+
+
+def _peak_rss_kb() -> int:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measure_once(reader: str, path: Path) -> Dict[str, Any]:
+    """Выполняется в дочернем процессе: один вызов читателя"""
+    sys.path.insert(0, str(BACKEND_DIR))
+    from services.file_processor import FileProcessor
+
+    # Библиотеки формата грузятся лениво; импорт измеряется отдельно от чтения
+    start = time.perf_counter()
+    FileProcessor.warm_up([path.suffix])
+    for module in READER_BACKENDS.get(reader, ()):
+        importlib.import_module(module)
+    import_seconds = time.perf_counter() - start
+
+    baseline_kb = _peak_rss_kb()
+    start = time.perf_counter()
+    output = getattr(FileProcessor, reader)(path)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "import_seconds": import_seconds,
+        "peak_rss_kb": _peak_rss_kb(),
+        "baseline_rss_kb": baseline_kb,
+        "output_chars": len(output)
+    }
+
+
+def run_isolated(reader: str, path: Path) -> Dict[str, Any]:
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.readers", "--measure", reader, str(path)],
+        capture_output=True, text=True, cwd=Path(__file__).parent.parent
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{reader} {path}: {result.stderr.strip().splitlines()[-1:]}")
+    return json.loads(result.stdout)
+
+
+def run_benchmark(corpus_dir: Path, sizes: List[int], formats: List[str], repeat: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for path in corpus.generate_corpus(corpus_dir, sizes, formats):
+        file_format = path.suffix.lstrip(".")
+        for reader in READERS[file_format]:
+            case = f"{reader} {path.parent.name}"
+            try:
+                runs = [run_isolated(reader, path) for _ in range(repeat)]
+            except RuntimeError as e:
+                results[case] = {"error": str(e)}
+                continue
+
+            seconds = [run["seconds"] for run in runs]
+            results[case] = {
+                "input_bytes": path.stat().st_size,
+                "wall_s": round(stats.percentile(seconds, 50), 6),
+                "wall_min_s": round(min(seconds), 6),
+                "peak_rss_mb": round(max(run["peak_rss_kb"] for run in runs) / 1024, 1),
+                "delta_rss_mb": round(max(run["peak_rss_kb"] - run["baseline_rss_kb"] for run in runs) / 1024, 1),
+                "output_chars": runs[0]["output_chars"],
+                "mb_per_s": round(path.stat().st_size / 1024 ** 2 / stats.percentile(seconds, 50), 3)
+            }
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'case':<24} {'input':>10} {'wall':>10} {'MB/s':>8} {'peak RSS':>10} {'ΔRSS':>9} {'output':>12}")
+    for case, result in results.items():
+        if "error" in result:
+            print(f"{case:<24} ошибка: {result['error']}")
+            continue
+        print(
+            f"{case:<24} {corpus.format_size(result['input_bytes']):>10} {result['wall_s']:>9.3f}s "
+            f"{result['mb_per_s']:>8.2f} {result['peak_rss_mb']:>8.1f}MB {result['delta_rss_mb']:>7.1f}MB "
+            f"{result['output_chars']:>12}"
+        )
+
+
+# Абсолютные изменения меньше этих значений считаются шумом измерения
+NOISE_FLOOR = {"wall_s": 0.01, "delta_rss_mb": 2.0}
+
+
+def find_regressions(baseline: Dict[str, Any], results: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Случаи, где время или прирост памяти выросли больше чем на threshold (доля)"""
+    regressions = []
+    for case, result in results.items():
+        old = baseline["results"].get(case)
+        if old is None or "error" in old:
+            continue
+        if "error" in result:
+            regressions.append(f"{case}: {result['error']}")
+            continue
+        for metric in ("wall_s", "delta_rss_mb"):
+            if result[metric] - old[metric] < NOISE_FLOOR[metric]:
+                continue
+            if old[metric] and (result[metric] - old[metric]) / old[metric] > threshold:
+                regressions.append(
+                    f"{case}: {metric} {old[metric]} → {result[metric]} "
+                    f"({(result[metric] - old[metric]) / old[metric] * 100:+.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк читателей FileProcessor")
+    parser.add_argument("--measure", nargs=2, metavar=("READER", "PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", type=Path, help="Директория корпуса (по умолчанию временная)")
+    parser.add_argument("--sizes", nargs="+", default=["1MB", "10MB"])
+    parser.add_argument("--formats", nargs="+", choices=corpus.FORMATS, default=list(corpus.FORMATS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", type=Path, help="Отчет для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Допустимый рост, доля (0.2 = 20%%)")
+    parser.add_argument("--output", type=Path, help="Путь к JSON отчету")
+    args = parser.parse_args()
+
+    if args.measure:
+        reader, path = args.measure
+        print(json.dumps(measure_once(reader, Path(path))))
+        return 0
+
+    corpus_dir = args.corpus or Path(tempfile.gettempdir()) / "claude-memory-bench-corpus"
+    sizes = [corpus.parse_size(size) for size in args.sizes]
+    results = run_benchmark(corpus_dir, sizes, args.formats, args.repeat)
+    print_results(results)
+
+    params = {"sizes": args.sizes, "formats": args.formats, "repeat": args.repeat}
+    print(f"\nОтчет: {stats.save_report('readers', params, results, args.output)}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = find_regressions(baseline, results, args.max_regression)
+        if regressions:
+            print(f"\nРегрессии больше {args.max_regression * 100:.0f}%:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nРегрессий больше {args.max_regression * 100:.0f}% нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+"""
+Офлайн бенчмарки сервиса: Anthropic API заменяется локальным mock сервером.
+
+    python -m benchmarks.run queries --queries 40 --concurrency 8 --latency-ms 500
+    python -m benchmarks.run views --sizes 1MB 10MB
+    python -m benchmarks.run upload --files 20 --size 5MB
+    python -m benchmarks.run listing --files 10000
+    python -m benchmarks.run retrieval
+    python -m benchmarks.run questions --limit 5   # настоящий API, нужен CLAUDE_API_KEY
+    python -m benchmarks.run compare benchmarks/results/a.json benchmarks/results/b.json
+
+Каждый набор печатает таблицу ops/s и p50/p95/p99 и сохраняет JSON отчет
+в benchmarks/results/<suite>-<commit>-<время>.json для сравнения между коммитами.
+"""
+import argparse
+import logging
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import httpx
+
+from benchmarks import corpus, stats
+from benchmarks.mock_anthropic import MockMessagesServer, load_conversations
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+CONVERSATIONS_DIR = Path(__file__).parent / "conversations"
+PROMPTS_DIR = Path(__file__).parent.parent / "prompts"
+
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def use_storage(storage_dir: Path, claude_base_url: str = None) -> None:
+    """
+    Направляет все хранилища backend (файлы, индекс, состояние листингов, заданий,
+    планировщика и tail) во временную директорию: бенчмарк не делит bucket планировщика
+    и блокировки активных запросов с dev-сервером на той же машине
+    """
+    from config import Config
+
+    Config.USER_FILES_DIR = storage_dir / "user_files"
+    Config.RESPONSES_DIR = storage_dir / "responses"
+    Config.TRACES_DIR = storage_dir / "traces"
+    Config.SESSIONS_DIR = storage_dir / "sessions"
+    Config.INDEX_DIR = storage_dir / "index"
+    Config.STORE_DIR = Config.INDEX_DIR / "text"
+    Config.LISTING_STATE_DIR = storage_dir / "listing"
+    Config.JOBS_DIR = storage_dir / "jobs"
+    Config.SCHEDULER_DIR = storage_dir / "scheduler"
+    Config.TAIL_STATE_DIR = storage_dir / "tail"
+    Config.CLAUDE_API_KEY = Config.CLAUDE_API_KEY or "benchmark"
+    if claude_base_url:
+        Config.CLAUDE_BASE_URL = claude_base_url
+
+
+@contextmanager
+def backend_server(storage_dir: Path, claude_base_url: str = None) -> Iterator[str]:
+    """Поднимает backend в этом процессе на временном хранилище, возвращает базовый URL"""
+    from werkzeug.serving import make_server
+
+    use_storage(storage_dir, claude_base_url)
+
+    from app import create_app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.port}"
+    finally:
+        server.shutdown()
+
+
+def measure(fn, count: int, concurrency: int = 1) -> Dict:
+    """Выполняет fn(i) count раз в concurrency потоков, возвращает сводку"""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run(i):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            fn(i)
+            ok = True
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, range(count)))
+    return stats.summarize(latencies, time.perf_counter() - wall_start, errors=errors)
+
+
+def suite_queries(args) -> Dict[str, Dict]:
+    """Параллельные /api/query против mock Messages API"""
+    conversations = load_conversations(args.conversations or sorted(CONVERSATIONS_DIR.glob("*.json")))
+    storage_dir = Path(tempfile.mkdtemp(prefix="bench-queries-"))
+    # Пути в диалогах ссылаются на /user_files/bench/sample.<format>
+    bench_dir = storage_dir / "user_files" / "bench"
+    bench_dir.mkdir(parents=True)
+    generator = corpus.CorpusGenerator()
+    for file_format in ("txt", "csv", "docx"):
+        generator.write(file_format, bench_dir / f"sample.{file_format}", corpus.parse_size(args.corpus_size))
+
+    results = {}
+    with MockMessagesServer(conversations, latency_ms=args.latency_ms,
+                            ms_per_output_token=args.ms_per_output_token, jitter=args.jitter) as mock:
+        with backend_server(storage_dir, mock.base_url) as base_url:
+            with httpx.Client(base_url=base_url, timeout=None) as http:
+                for concurrency in args.concurrency:
+                    def query(i):
+                        # Уникальный текст - уникальные файлы ответа у каждого диалога mock сервера
+                        response = http.post("/api/query", json={"query": f"Бенчмарк c={concurrency} #{i}"})
+                        response.raise_for_status()
+
+                    results[f"query c={concurrency}"] = measure(query, args.queries, concurrency)
+    return results
+
+
+def suite_views(args) -> Dict[str, Dict]:
+    """MemoryTool.view больших файлов каждого формата: целиком и диапазоном строк"""
+    from anthropic.types.beta import BetaMemoryTool20250818ViewCommand
+    from services.memory_tool import MemoryTool
+
+    storage_dir = Path(tempfile.mkdtemp(prefix="bench-views-"))
+    sizes = [corpus.parse_size(size) for size in args.sizes]
+    corpus.generate_corpus(storage_dir / "user_files", sizes, args.formats)
+    memory_tool = MemoryTool(storage_dir / "user_files", storage_dir / "responses")
+
+    results = {}
+    for size in sizes:
+        for file_format in args.formats:
+            path = f"/user_files/{corpus.format_size(size)}/sample.{file_format}"
+            for label, view_range in (("full", None), ("range", [1, 200])):
+                command = BetaMemoryTool20250818ViewCommand(command="view", path=path, view_range=view_range)
+                results[f"{file_format} {corpus.format_size(size)} {label}"] = measure(
+                    lambda _: memory_tool.view(command), args.repeat
+                )
+    return results
+
+
+def suite_upload(args) -> Dict[str, Dict]:
+    """Пропускная способность /api/upload"""
+    storage_dir = Path(tempfile.mkdtemp(prefix="bench-upload-"))
+    size = corpus.parse_size(args.size)
+    source = corpus.generate_corpus(storage_dir / "source", [size], ["txt"])[0]
+    payload = source.read_bytes()
+
+    with backend_server(storage_dir) as base_url:
+        with httpx.Client(base_url=base_url, timeout=None) as http:
+            def upload(i):
+                response = http.post("/api/upload", files={"files[]": (f"upload-{i}.txt", payload, "text/plain")})
+                response.raise_for_status()
+
+            result = measure(upload, args.files, args.concurrency)
+
+    result["mb_per_s"] = round(result["throughput_per_s"] * len(payload) / 1024 ** 2, 3)
+    return {f"upload {args.size} c={args.concurrency}": result}
+
+
+def suite_listing(args) -> Dict[str, Dict]:
+    """/api/files и /api/responses при большом количестве файлов"""
+    storage_dir = Path(tempfile.mkdtemp(prefix="bench-listing-"))
+    for root in ("user_files", "responses"):
+        for i in range(args.files):
+            path = storage_dir / root / f"dir{i % 100:03d}" / f"file{i:05d}.txt"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text("x", encoding="utf-8")
+
+    results = {}
+    with backend_server(storage_dir) as base_url:
+        with httpx.Client(base_url=base_url, timeout=None) as http:
+            for endpoint in ("/api/files", "/api/responses"):
+                def listing(_):
+                    http.get(endpoint).raise_for_status()
+
+                results[f"GET {endpoint} n={args.files}"] = measure(listing, args.repeat)
+    return results
+
+
+def demo_questions(path: Path) -> List[str]:
+    """Нумерованные вопросы из файла вида "1. Вопрос?" (prompts/Demo2Pilots тест вопросы.txt)"""
+    questions = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        match = re.match(r"^\s*\d+\.\s*(.+)$", line)
+        if match:
+            questions.append(match.group(1).strip())
+    return questions
+
+
+def indexed_storage(prefix: str, sources: List[Path]) -> Path:
+    """Временное хранилище с файлами sources в user_files/demo и построенным индексом"""
+    from config import Config
+    from services.file_index import FileIndex
+    from services.frame_store import FrameStore
+
+    storage_dir = Path(tempfile.mkdtemp(prefix=prefix))
+    use_storage(storage_dir)
+    demo_dir = Config.USER_FILES_DIR / "demo"
+    demo_dir.mkdir(parents=True)
+    for source in sources:
+        shutil.copy(source, demo_dir / source.name)
+    FileIndex(Config.INDEX_DIR, Config.USER_FILES_DIR, store=FrameStore(Config.STORE_DIR)).build()
+    return storage_dir
+
+
+def suite_retrieval(args) -> Dict[str, Dict]:
+    """Локальный поиск фрагментов по вопросам Demo2Pilots: время и объем приложенного текста"""
+    from config import Config
+    from services.file_index import FileIndex
+    from services.frame_store import FrameStore
+    from services.listing import DirectoryGenerations, DirectoryListing
+    from services.retrieval import Retriever
+
+    questions = demo_questions(args.questions)
+    indexed_storage("bench-retrieval-", args.files)
+
+    def retriever():
+        return Retriever(
+            DirectoryListing(Config.USER_FILES_DIR, "user_files", DirectoryGenerations(Config.LISTING_STATE_DIR)),
+            FileIndex(Config.INDEX_DIR, Config.USER_FILES_DIR, store=FrameStore(Config.STORE_DIR)),
+            budget_tokens=args.budget_tokens
+        )
+
+    # Первый поиск воркера загружает термы всех фрагментов из индекса
+    cold = measure(lambda _: retriever().search(questions[0]), args.repeat)
+    warm_retriever = retriever()
+    found = [warm_retriever.search(question) for question in questions]
+    warm = measure(lambda i: warm_retriever.search(questions[i % len(questions)]), len(questions) * args.repeat)
+    warm["mean_excerpts"] = round(sum(len(result["excerpts"]) for result in found) / len(found), 2)
+    warm["mean_tokens"] = round(sum(result["tokens"] for result in found) / len(found))
+    warm["chunks"] = found[0]["chunks"]
+    return {"search cold": cold, f"search n={len(questions)}": warm}
+
+
+def suite_questions(args) -> Dict[str, Dict]:
+    """
+    Вопросы Demo2Pilots через ClaudeClient без поиска и с поиском: время и ходы API.
+    Единственный набор, которому нужен настоящий API (CLAUDE_API_KEY): mock сервер
+    воспроизводит записанные диалоги, и число ходов в нем от фрагментов не меняется
+    """
+    from config import Config
+    from services.claude_client import ClaudeClient
+
+    questions = demo_questions(args.questions)[:args.limit]
+    storage_dir = indexed_storage("bench-questions-", args.files)
+    if args.claude_base_url:
+        Config.CLAUDE_BASE_URL = args.claude_base_url
+
+    results = {}
+    for mode in args.retrieval:
+        Config.RETRIEVAL_ENABLED = mode == "on"
+        client = ClaudeClient(Config.USER_FILES_DIR, Config.RESPONSES_DIR, storage_dir / "traces")
+        turns: List[int] = []
+
+        def ask(i):
+            result = client.process_query_sync(questions[i])
+            if not result.get("success"):
+                raise RuntimeError(result.get("error"))
+            turns.append(result["usage"]["turns"])
+
+        result = measure(ask, len(questions))
+        result["mean_turns"] = round(sum(turns) / len(turns), 2) if turns else 0.0
+        result["turns"] = turns
+        results[f"retrieval {mode}"] = result
+        print(f"retrieval {mode}: ходов в среднем {result['mean_turns']}, ошибок {result['errors']}")
+    return results
+
+
+SUITES = {
+    "queries": suite_queries,
+    "views": suite_views,
+    "upload": suite_upload,
+    "listing": suite_listing,
+    "retrieval": suite_retrieval,
+    "questions": suite_questions,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарки Claude Memory Tool")
+    parser.add_argument("--output", type=Path, help="Путь к JSON отчету")
+    subparsers = parser.add_subparsers(dest="suite", required=True)
+
+    queries = subparsers.add_parser("queries", help="Параллельные запросы против mock API")
+    queries.add_argument("--queries", type=int, default=20)
+    queries.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    queries.add_argument("--conversations", type=Path, nargs="*")
+    queries.add_argument("--corpus-size", default="1MB")
+    queries.add_argument("--latency-ms", type=float, default=200.0)
+    queries.add_argument("--ms-per-output-token", type=float, default=0.0)
+    queries.add_argument("--jitter", type=float, default=0.2)
+
+    views = subparsers.add_parser("views", help="view больших файлов по форматам")
+    views.add_argument("--sizes", nargs="+", default=["1MB", "10MB"])
+    views.add_argument("--formats", nargs="+", choices=corpus.FORMATS, default=list(corpus.FORMATS))
+    views.add_argument("--repeat", type=int, default=5)
+
+    upload = subparsers.add_parser("upload", help="Пропускная способность загрузки")
+    upload.add_argument("--files", type=int, default=20)
+    upload.add_argument("--size", default="5MB")
+    upload.add_argument("--concurrency", type=int, default=4)
+
+    listing = subparsers.add_parser("listing", help="Листинг при большом количестве файлов")
+    listing.add_argument("--files", type=int, default=10000)
+    listing.add_argument("--repeat", type=int, default=20)
+
+    demo_files = [PROMPTS_DIR / "АРТЕМ - merged_database #rc_demo2pilots.txt"]
+    demo_questions_path = PROMPTS_DIR / "Demo2Pilots тест вопросы.txt"
+
+    retrieval = subparsers.add_parser("retrieval", help="Локальный поиск фрагментов по вопросам Demo2Pilots")
+    retrieval.add_argument("--questions", type=Path, default=demo_questions_path)
+    retrieval.add_argument("--files", type=Path, nargs="+", default=demo_files)
+    retrieval.add_argument("--budget-tokens", type=int, default=6000)
+    retrieval.add_argument("--repeat", type=int, default=5)
+
+    questions = subparsers.add_parser("questions", help="Вопросы Demo2Pilots без поиска и с поиском (нужен API)")
+    questions.add_argument("--questions", type=Path, default=demo_questions_path)
+    questions.add_argument("--files", type=Path, nargs="+", default=demo_files)
+    questions.add_argument("--limit", type=int, default=None)
+    questions.add_argument("--retrieval", nargs="+", choices=["off", "on"], default=["off", "on"])
+    questions.add_argument("--claude-base-url", help="Другой адрес Messages API")
+
+    compare = subparsers.add_parser("compare", help="Сравнить два отчета")
+    compare.add_argument("base", type=Path)
+    compare.add_argument("new", type=Path)
+
+    args = parser.parse_args()
+
+    if args.suite == "compare":
+        stats.compare_reports(args.base, args.new)
+        return 0
+
+    params = {key: value for key, value in vars(args).items() if key not in ("suite", "output")}
+    results = SUITES[args.suite](args)
+    stats.print_report(args.suite, results)
+    print(f"\nОтчет: {stats.save_report(args.suite, params, results, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Время старта и память воркера в зависимости от FILE_PROCESSOR_WARMUP.
+
+    python -m benchmarks.startup --repeat 5
+
+Для каждого режима в отдельном процессе измеряется импорт приложения и create_app(),
+затем, как gunicorn с preload_app, процесс форкается и "воркер" читает только .txt
+и .json файлы. Для воркера сообщаются RSS, USS (собственные страницы) и PSS из
+/proc/self/smaps_rollup (Linux), а также какие тяжелые библиотеки оказались загружены.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from benchmarks import corpus, stats
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+HEAVY_MODULES = ("pandas", "PyPDF2", "docx", "openpyxl", "numpy")
+
+MODES = {
+    "lazy": "",
+    "warmup-all": "all",
+}
+
+
+def _memory_kb() -> Dict[str, int]:
+    """RSS/USS/PSS текущего процесса в килобайтах; пустой словарь вне Linux"""
+    memory = {}
+    try:
+        for line in Path("/proc/self/smaps_rollup").read_text().splitlines():
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                memory[key] = int(value.split()[0])
+    except OSError:
+        return {}
+    return {
+        "rss_kb": memory.get("Rss", 0),
+        "pss_kb": memory.get("Pss", 0),
+        "uss_kb": memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0)
+    }
+
+
+def measure_once(files_dir: Path) -> Dict[str, Any]:
+    """Выполняется в дочернем процессе с выставленным FILE_PROCESSOR_WARMUP"""
+    start = time.perf_counter()
+    sys.path.insert(0, str(BACKEND_DIR))
+    from config import Config
+
+    storage_dir = Path(tempfile.mkdtemp(prefix="bench-startup-"))
+    Config.USER_FILES_DIR = storage_dir / "user_files"
+    Config.RESPONSES_DIR = storage_dir / "responses"
+    Config.TRACES_DIR = storage_dir / "traces"
+    Config.SESSIONS_DIR = storage_dir / "sessions"
+    Config.INDEX_DIR = storage_dir / "index"
+    Config.STORE_DIR = Config.INDEX_DIR / "text"
+    Config.LISTING_STATE_DIR = storage_dir / "listing"
+    Config.JOBS_DIR = storage_dir / "jobs"
+    Config.SCHEDULER_DIR = storage_dir / "scheduler"
+    Config.TAIL_STATE_DIR = storage_dir / "tail"
+
+    from app import create_app
+    create_app()
+    startup_seconds = time.perf_counter() - start
+    master_memory = _memory_kb()
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        from services.file_processor import FileProcessor
+
+        for path in sorted(files_dir.iterdir()):
+            FileProcessor.process_file(path)
+        worker = {
+            **_memory_kb(),
+            "loaded": [module for module in HEAVY_MODULES if module in sys.modules]
+        }
+        os.write(write_fd, json.dumps(worker).encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        worker = json.loads(pipe.read())
+    os.waitpid(pid, 0)
+
+    return {"startup_seconds": startup_seconds, "master": master_memory, "worker": worker}
+
+
+def run_mode(warmup: str, files_dir: Path) -> Dict[str, Any]:
+    env = {**os.environ, "FILE_PROCESSOR_WARMUP": warmup}
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--measure", str(files_dir)],
+        capture_output=True, text=True, env=env, cwd=Path(__file__).parent.parent
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время старта и память воркера")
+    parser.add_argument("--measure", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="Путь к JSON отчету")
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_once(args.measure)))
+        return 0
+
+    files_dir = Path(tempfile.mkdtemp(prefix="bench-startup-files-"))
+    generator = corpus.CorpusGenerator()
+    for file_format in ("txt", "json"):
+        generator.write(file_format, files_dir / f"sample.{file_format}", 256 * 1024)
+
+    results = {}
+    for mode, warmup in MODES.items():
+        runs = [run_mode(warmup, files_dir) for _ in range(args.repeat)]
+        last = runs[-1]
+        results[mode] = {
+            "startup_s": round(stats.percentile([run["startup_seconds"] for run in runs], 50), 4),
+            "master_rss_mb": round(last["master"].get("rss_kb", 0) / 1024, 1),
+            "worker_rss_mb": round(last["worker"].get("rss_kb", 0) / 1024, 1),
+            "worker_uss_mb": round(last["worker"].get("uss_kb", 0) / 1024, 1),
+            "worker_pss_mb": round(last["worker"].get("pss_kb", 0) / 1024, 1),
+            "loaded": last["worker"]["loaded"]
+        }
+
+    print(f"{'mode':<12} {'startup':>9} {'master RSS':>11} {'worker RSS':>11} {'USS':>8} {'PSS':>8}  loaded")
+    for mode, result in results.items():
+        print(
+            f"{mode:<12} {result['startup_s']:>8.3f}s {result['master_rss_mb']:>9.1f}MB "
+            f"{result['worker_rss_mb']:>9.1f}MB {result['worker_uss_mb']:>6.1f}MB {result['worker_pss_mb']:>6.1f}MB  "
+            f"{', '.join(result['loaded']) or '-'}"
+        )
+
+    params = {"repeat": args.repeat, "files": ["txt", "json"]}
+    print(f"\nОтчет: {stats.save_report('startup', params, results, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Перцентили, отчеты и сравнение результатов бенчмарков между коммитами"""
+import json
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль с линейной интерполяцией, q от 0 до 100"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies: List[float], wall_seconds: float, **extra: Any) -> Dict[str, Any]:
+    """Сводка по одному случаю: пропускная способность и p50/p95/p99 в секундах"""
+    return {
+        "count": len(latencies),
+        "throughput_per_s": round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0,
+        "mean_s": round(sum(latencies) / len(latencies), 6) if latencies else 0.0,
+        "p50_s": round(percentile(latencies, 50), 6),
+        "p95_s": round(percentile(latencies, 95), 6),
+        "p99_s": round(percentile(latencies, 99), 6),
+        **extra
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_report(suite: str, params: Dict[str, Any], results: Dict[str, Dict[str, Any]],
+                output: Optional[Path] = None) -> Path:
+    report = {
+        "suite": suite,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": params,
+        "results": results
+    }
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output = RESULTS_DIR / f"{suite}-{report['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+    return output
+
+
+def print_report(suite: str, results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"\n{suite}")
+    print(f"{'case':<40} {'n':>6} {'ops/s':>10} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for case, result in results.items():
+        print(
+            f"{case:<40} {result['count']:>6} {result['throughput_per_s']:>10.2f} "
+            f"{result['p50_s'] * 1000:>8.1f}ms {result['p95_s'] * 1000:>8.1f}ms {result['p99_s'] * 1000:>8.1f}ms"
+        )
+
+
+def compare_reports(base_path: Path, new_path: Path) -> None:
+    """Печатает изменение p50/p95/p99 и пропускной способности между двумя отчетами"""
+    base = json.loads(base_path.read_text(encoding="utf-8"))
+    new = json.loads(new_path.read_text(encoding="utf-8"))
+
+    def delta(old: float, current: float) -> str:
+        if not old:
+            return "n/a"
+        return f"{(current - old) / old * 100:+.1f}%"
+
+    print(f"{base['suite']}: {base['commit']} → {new['commit']}")
+    print(f"{'case':<40} {'ops/s':>10} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for case, result in new["results"].items():
+        old = base["results"].get(case)
+        if old is None:
+            print(f"{case:<40} (новый случай)")
+            continue
+        print(
+            f"{case:<40} {delta(old['throughput_per_s'], result['throughput_per_s']):>10} "
+            f"{delta(old['p50_s'], result['p50_s']):>10} {delta(old['p95_s'], result['p95_s']):>10} "
+            f"{delta(old['p99_s'], result['p99_s']):>10}"
+        )
@@ -37,11 +37,27 @@ export default {
     return response.data;
   },
 
-  async listFiles() {
-    const response = await api.get('/files');
+  async listFiles(params = {}) {
+    const response = await api.get('/files', { params });
     return response.data;
   },
 
+  // Все страницы листинга: сервер отдает не больше limit записей и next_cursor
+  async listAll(listPage, key, params = {}) {
+    const items = [];
+    let cursor = null;
+    do {
+      const page = await listPage({ ...params, ...(cursor ? { cursor } : {}) });
+      items.push(...page[key]);
+      cursor = page.next_cursor;
+    } while (cursor);
+    return items;
+  },
+
+  async listAllFiles(params = {}) {
+    return this.listAll((pageParams) => this.listFiles(pageParams), 'files', params);
+  },
+
   async deleteFile(filepath) {
     const response = await api.delete(`/files/${filepath}`);
     return response.data;
@@ -52,19 +68,24 @@ export default {
     return response.data;
   },
 
-  async sendQuery(query, maxTokens = 8000) {
+  async sendQuery(query, maxTokens = null) {
+    // Без max_tokens лимит выбирают правила маршрутизации на сервере
     const response = await api.post('/query', {
       query,
-      max_tokens: maxTokens
+      ...(maxTokens ? { max_tokens: maxTokens } : {})
     });
     return response.data;
   },
   
-  async listResponses() {
-    const response = await api.get('/responses');
+  async listResponses(params = {}) {
+    const response = await api.get('/responses', { params });
     return response.data;
   },
 
+  async listAllResponses(params = {}) {
+    return this.listAll((pageParams) => this.listResponses(pageParams), 'responses', params);
+  },
+
   async getResponse(filepath) {
     const response = await api.get(`/responses/${filepath}`);
     return response.data;
@@ -0,0 +1,216 @@
+"""
+Графики в стиле plot_comparison.py, построенные по реальным трассам запросов
+из storage/traces вместо вручную набранных массивов.
+
+    python plot_traces.py plot [--traces backend/storage/traces] [--group-by corpus] [--output charts.png]
+    python plot_traces.py replay <query_id> [--user-files backend/storage/user_files]
+    python plot_traces.py routing
+
+replay повторно выполняет view-команды трассы на текущих файлах (без вызовов API)
+и сравнивает время инструментов с записанным - удобно для проверки оптимизаций
+FileProcessor и MemoryTool. routing сводит время и ходы по правилам
+маршрутизации (services/routing.py) - для подбора порогов правил.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = ROOT_DIR / "backend"
+
+
+def default_storage(name: str) -> str:
+    """
+    Директория хранилища по умолчанию: backend/storage (Config, локальный запуск),
+    если ее нет - storage/ рядом со скриптом (тома docker-compose)
+    """
+    candidates = [BACKEND_DIR / "storage" / name, ROOT_DIR / "storage" / name]
+    return str(next((path for path in candidates if path.is_dir()), candidates[0]))
+
+
+def load_traces(traces_dir: Path):
+    traces = []
+    for path in sorted(traces_dir.glob("*.json")):
+        trace = json.loads(path.read_text(encoding="utf-8"))
+        if trace.get("status") == "ok":
+            traces.append(trace)
+    return traces
+
+
+def corpus_of(trace) -> str:
+    """Корпус запроса - первая поддиректория /user_files, которую открывала модель"""
+    for turn in trace["turns"]:
+        for command in turn["commands"]:
+            path = command.get("path") or ""
+            parts = [part for part in path.split("/") if part]
+            if len(parts) >= 3 and parts[0] == "user_files":
+                return parts[1]
+    return "all"
+
+
+def plot(args):
+    import numpy as np
+    from matplotlib import pyplot as plt
+
+    traces = load_traces(Path(args.traces))
+    if not traces:
+        print(f"Нет завершенных трасс в {args.traces}")
+        return 1
+
+    groups = {"all": traces}
+    if args.group_by == "corpus":
+        by_corpus = defaultdict(list)
+        for trace in traces:
+            by_corpus[corpus_of(trace)].append(trace)
+        groups.update(by_corpus)
+
+    plt.figure(figsize=(15, 5 * (len(groups) + 1)))
+    rows = len(groups) + 1
+
+    for row, (name, group) in enumerate(groups.items()):
+        entry_tokens = np.array([trace["summary"]["entry_tokens"] for trace in group])
+        seconds = np.array([trace["elapsed_seconds"] for trace in group])
+        prefix = "" if name == "all" else f"{name}: "
+
+        plt.subplot(rows, 2, row * 2 + 1)
+        plt.bar(entry_tokens, seconds, width=max(entry_tokens.max() / 50, 1))
+        plt.xlabel("Entry Tokens")
+        plt.ylabel("Time Taken (s)")
+        plt.title(f"{prefix}# of Entry Tokens vs Time Taken on Questions (s)")
+        plt.grid()
+
+        plt.subplot(rows, 2, row * 2 + 2)
+        plt.bar(entry_tokens, seconds / 60, width=max(entry_tokens.max() / 50, 1))
+        plt.xlabel("Entry Tokens")
+        plt.ylabel("Time Taken (min)")
+        plt.title(f"{prefix}# of Entry Tokens vs Time Taken on Questions (min)")
+        plt.grid()
+
+    # Разбивка времени: модель / инструменты / разбор файлов
+    labels = [trace["query_id"][:8] for trace in traces]
+    api = np.array([trace["summary"]["api_seconds"] for trace in traces])
+    files = np.array([trace["summary"]["file_read_seconds"] for trace in traces])
+    tools = np.array([trace["summary"]["tool_seconds"] for trace in traces]) - files
+
+    plt.subplot(rows, 2, rows * 2 - 1)
+    plt.bar(labels, api, label="Model (API)")
+    plt.bar(labels, tools, bottom=api, label="MemoryTool")
+    plt.bar(labels, files, bottom=api + tools, label="File parsing")
+    plt.xlabel("Query")
+    plt.ylabel("Time Taken (s)")
+    plt.title("Where the time went")
+    plt.xticks(rotation=90)
+    plt.legend()
+    plt.grid()
+
+    plt.subplot(rows, 2, rows * 2)
+    plt.scatter([trace["summary"]["turns"] for trace in traces], [trace["elapsed_seconds"] for trace in traces])
+    plt.xlabel("API Turns")
+    plt.ylabel("Time Taken (s)")
+    plt.title("# of Turns vs Time Taken on Questions (s)")
+    plt.grid()
+
+    plt.tight_layout()
+    if args.output:
+        plt.savefig(args.output)
+        print(f"Сохранено: {args.output}")
+    else:
+        plt.show()
+    return 0
+
+
+def replay(args):
+    sys.path.insert(0, str(BACKEND_DIR))
+    from anthropic.types.beta import BetaMemoryTool20250818ViewCommand
+    from services.memory_tool import MemoryTool
+
+    trace_path = Path(args.traces) / f"{args.query_id}.json"
+    if not trace_path.is_file():
+        print(f"Трасса не найдена: {trace_path}")
+        return 1
+    trace = json.loads(trace_path.read_text(encoding="utf-8"))
+
+    # Команды записи не повторяются, responses подменяется временной директорией
+    memory_tool = MemoryTool(Path(args.user_files), Path(tempfile.mkdtemp()))
+    recorded_total = replayed_total = 0.0
+
+    print(f"{'turn':>4}  {'recorded':>9}  {'replayed':>9}  path")
+    for turn in trace["turns"]:
+        for command in turn["commands"]:
+            if command["command"] != "view" or not (command["path"] or "").startswith("/user_files"):
+                continue
+            view = BetaMemoryTool20250818ViewCommand(
+                command="view", path=command["path"], view_range=command.get("view_range")
+            )
+            start = time.perf_counter()
+            try:
+                memory_tool.view(view)
+                status = ""
+            except Exception as e:
+                status = f"  ({e})"
+            elapsed = time.perf_counter() - start
+
+            recorded_total += command["seconds"]
+            replayed_total += elapsed
+            print(f"{turn['index']:>4}  {command['seconds']:>8.3f}s  {elapsed:>8.3f}s  {command['path']}{status}")
+
+    print(f"Итого: записано {recorded_total:.3f}s, повтор {replayed_total:.3f}s")
+    return 0
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def routing(args):
+    traces = load_traces(Path(args.traces))
+    groups = defaultdict(list)
+    for trace in traces:
+        route = trace.get("routing") or {"rule": "-", "model": trace.get("model")}
+        groups[(route["rule"], route["model"])].append(trace)
+    if not groups:
+        print(f"Нет завершенных трасс в {args.traces}")
+        return 1
+
+    print(f"{'rule':<32} {'model':<28} {'n':>5} {'p50 s':>8} {'p95 s':>8} {'mean s':>8} {'turns':>6} {'corpus tok':>11}")
+    for (rule, model), group in sorted(groups.items(), key=lambda item: -len(item[1])):
+        seconds = [trace["elapsed_seconds"] for trace in group]
+        turns = [trace["summary"]["turns"] for trace in group]
+        corpus = [(trace.get("routing") or {}).get("corpus_tokens") or 0 for trace in group]
+        print(
+            f"{rule:<32} {model:<28} {len(group):>5} {percentile(seconds, 0.5):>8.1f} "
+            f"{percentile(seconds, 0.95):>8.1f} {sum(seconds) / len(seconds):>8.1f} "
+            f"{sum(turns) / len(turns):>6.1f} {sum(corpus) // len(corpus):>11}"
+        )
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Графики и повтор трасс запросов")
+    parser.add_argument("--traces", default=default_storage("traces"), help="Директория с трассами")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    plot_parser = subparsers.add_parser("plot", help="Построить графики по трассам")
+    plot_parser.add_argument("--group-by", choices=["none", "corpus"], default="corpus")
+    plot_parser.add_argument("--output", help="Сохранить в файл вместо показа окна")
+    plot_parser.set_defaults(func=plot)
+
+    replay_parser = subparsers.add_parser("replay", help="Повторить view-команды трассы на текущих файлах")
+    replay_parser.add_argument("query_id")
+    replay_parser.add_argument("--user-files", default=default_storage("user_files"))
+    replay_parser.set_defaults(func=replay)
+
+    routing_parser = subparsers.add_parser("routing", help="Время и ходы по правилам маршрутизации")
+    routing_parser.set_defaults(func=routing)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())